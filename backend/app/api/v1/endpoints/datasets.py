@@ -1,11 +1,23 @@
-from typing import List, Any
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+import os
+import shutil
+from typing import List, Any, Optional
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from .... import crud, models, schemas
 from ....database import SessionLocal
+from ....services import search_index
+from ....services.import_jobs import import_jobs
 
 router = APIRouter()
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ROW_PAGE_SIZE = 500
+MAX_ROW_PAGE_SIZE = 5000
+ROW_STREAM_PAGE_SIZE = 2000
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -22,13 +34,140 @@ def create_dataset(dataset: schemas.DatasetCreate, db: Session = Depends(get_db)
 def read_datasets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return crud.get_datasets(db, skip=skip, limit=limit)
 
+@router.get("/summary", response_model=List[schemas.DatasetSummary])
+def read_dataset_summaries(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    """Sheet names, column headers and row counts without any row payload."""
+    return crud.get_dataset_summaries(db, skip=skip, limit=limit)
+
+@router.get("/search", response_model=List[schemas.SearchHit])
+def search_datasets(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=200), db: Session = Depends(get_db)):
+    """Find the sheets and columns whose header or values contain ``q``, best match first."""
+    return search_index.search(db, q, limit=limit)
+
+@router.post("/upload", response_model=schemas.ImportJob, status_code=202)
+def upload_dataset(file: UploadFile = File(...), name: Optional[str] = Form(None)):
+    """Store an uploaded workbook and queue its import; returns the job to poll."""
+    file_name = os.path.basename(file.filename or "")
+    if not file_name.lower().endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="Only .xlsx / .xls workbooks are supported")
+
+    # Sync handler runs in the threadpool: the spooled upload is copied to disk
+    # chunk by chunk without ever being held in memory or blocking the event loop
+    file_path = import_jobs.new_upload_path(file_name)
+    with open(file_path, "wb") as out:
+        shutil.copyfileobj(file.file, out, UPLOAD_CHUNK_SIZE)
+
+    job = import_jobs.submit(name or f"Upload: {file_name}", file_name, file_path)
+    return job.snapshot()
+
+@router.get("/import-jobs", response_model=List[schemas.ImportJob])
+def read_import_jobs():
+    return [job.snapshot() for job in import_jobs.list()]
+
+@router.get("/import-jobs/{job_id}", response_model=schemas.ImportJob)
+def read_import_job(job_id: str):
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.snapshot()
+
+@router.get("/import-jobs/{job_id}/events")
+async def stream_import_job(job_id: str):
+    """SSE stream of job snapshots; closes once the job has finished."""
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+
+    async def event_generator():
+        last_version = -1
+        while True:
+            snapshot = job.snapshot()
+            if snapshot["version"] != last_version:
+                last_version = snapshot["version"]
+                yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot["status"] in ("succeeded", "failed"):
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 @router.get("/{dataset_id}", response_model=schemas.Dataset)
-def read_dataset(dataset_id: int, db: Session = Depends(get_db)):
-    db_dataset = crud.get_dataset(db, dataset_id=dataset_id)
+def read_dataset(dataset_id: int, include_rows: bool = False, db: Session = Depends(get_db)):
+    """Sheet headers and row counts; rows are read through the paged ``/rows`` endpoint.
+
+    ``include_rows=true`` restores the old full payload and should only be used on small datasets.
+    """
+    if include_rows:
+        db_dataset = crud.get_dataset_with_rows(db, dataset_id=dataset_id)
+    else:
+        db_dataset = crud.get_dataset_overview(db, dataset_id=dataset_id)
     if db_dataset is None:
         raise HTTPException(status_code=404, detail="Dataset not found")
     return db_dataset
 
+@router.get("/{dataset_id}/sheets/{sheet_name}/rows", response_model=schemas.RowPage)
+def read_sheet_rows(
+    dataset_id: int,
+    sheet_name: str,
+    after: int = Query(-1, description="Return rows with row_index greater than this (keyset cursor)"),
+    limit: Optional[int] = Query(None, ge=1),
+    columns: Optional[List[str]] = Query(None, description="Only return these columns"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: Session = Depends(get_db)
+):
+    """Rows of one sheet in ``row_index`` order.
+
+    ``format=json`` returns one page (``limit`` defaults to ``ROW_PAGE_SIZE``) and the
+    cursor for the next one. ``format=ndjson`` streams every row after ``after``
+    (up to ``limit``), one JSON object per line, for exports.
+    """
+    sheet = crud.get_sheet(db, dataset_id, sheet_name)
+    if sheet is None:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+    sheet_columns = crud.get_sheet_columns(db, sheet)
+    if columns:
+        unknown = [c for c in columns if c not in sheet_columns]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+
+    if format == "ndjson":
+        sheet_id = sheet.id
+
+        def row_stream():
+            # The request session is closed once the response starts; streaming uses its own
+            stream_db = SessionLocal()
+            try:
+                for r in crud.iter_sheet_rows(stream_db, sheet_id, after=after, page_size=ROW_STREAM_PAGE_SIZE, limit=limit):
+                    line = {"id": r.id, "row_index": r.row_index, "data": crud.project_row(sheet_columns, r.data, columns)}
+                    yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+            finally:
+                stream_db.close()
+
+        return StreamingResponse(row_stream(), media_type="application/x-ndjson")
+
+    limit = min(limit or ROW_PAGE_SIZE, MAX_ROW_PAGE_SIZE)
+    page = crud.get_sheet_rows(db, sheet.id, after=after, limit=limit)
+    return schemas.RowPage(
+        sheet_name=sheet.name,
+        columns=columns or sheet_columns,
+        rows=[
+            schemas.DatasetRow(id=r.id, row_index=r.row_index, data=crud.project_row(sheet_columns, r.data, columns))
+            for r in page
+        ],
+        next_after=page[-1].row_index if len(page) == limit else None,
+    )
+
+@router.get("/{dataset_id}/profiles", response_model=List[schemas.SheetProfile])
+def read_dataset_profiles(dataset_id: int, db: Session = Depends(get_db)):
+    return crud.get_column_profiles(db, dataset_id)
+
+@router.get("/{dataset_id}/sheets/{sheet_name}/profiles", response_model=schemas.SheetProfile)
+def read_sheet_profiles(dataset_id: int, sheet_name: str, db: Session = Depends(get_db)):
+    profiles = crud.get_column_profiles(db, dataset_id, sheet_name=sheet_name)
+    if not profiles:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+    return profiles[0]
+
 @router.get("/{dataset_id}/preview/{sheet_name}/{column_name}", response_model=List[str])
 def get_dataset_column_preview(
     dataset_id: int, 
@@ -1,10 +1,14 @@
 import json
-from typing import List, Any
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Any, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from .... import crud, models, schemas
-from ....services import mapping_generation_service
+from ....services.generation_jobs import format_event_id, generation_jobs, parse_event_id
+from ....services.hedging import hedge_policy
+from ....services.llm_cache import llm_cache
+from ....services.llm_factory import check_llm_health, get_rate_limiter
+from ....services.mapping_history import mapping_history
 from .datasets import get_db
 
 router = APIRouter()
@@ -21,6 +25,30 @@ def update_mapping_by_context(dataset_id: int, framework_id: int, mapping: schem
     # Create a new version of mapping (Snapshot style) or upsert logic
     return crud.create_mapping(db=db, mapping=mapping)
 
+@router.get("/llm-cache")
+def read_llm_cache_stats():
+    """Size and hit/miss counters of the LLM response cache."""
+    return llm_cache.stats()
+
+@router.delete("/llm-cache")
+def clear_llm_cache():
+    return {"status": "success", "removed": llm_cache.clear()}
+
+@router.get("/llm-limits")
+def read_llm_limits():
+    """Current adaptive concurrency, token/request budgets and queue depth of the LLM rate limiter, plus hedging stats."""
+    return dict(get_rate_limiter().snapshot(), hedging=hedge_policy.snapshot())
+
+@router.get("/llm-health")
+async def read_llm_health(refresh: bool = False):
+    """Whether each configured LLM endpoint answers (cached; ``refresh=true`` probes again)."""
+    return await check_llm_health(refresh=refresh)
+
+@router.get("/history")
+def read_mapping_history_stats():
+    """Size of the in-memory index of saved mappings reused before calling the LLM."""
+    return mapping_history.stats()
+
 @router.put("/{mapping_id}", response_model=schemas.Mapping)
 def update_mapping_inplace(mapping_id: int, mapping: schemas.MappingCreate, db: Session = Depends(get_db)):
     db_mapping = crud.update_mapping(db=db, mapping_id=mapping_id, mapping=mapping)
@@ -35,14 +63,128 @@ def delete_mapping(mapping_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Mapping not found")
     return {"status": "success"}
 
-@router.get("/generate/stream")
-def generate_mapping_stream(dataset_id: int, framework_id: int, db: Session = Depends(get_db)):
-    def event_generator():
-        for chunk in mapping_generation_service.generate_ai_mapping_stream(db, dataset_id, framework_id):
-            yield f"data: {json.dumps(chunk)}\n\n"
-            
+def job_event_stream(job_id: str, after_seq: int = 0):
+    """SSE response replaying a job's events after ``after_seq`` and then following it live."""
+    async def event_generator():
+        async for seq, payload in generation_jobs.follow(job_id, after_seq):
+            yield f"id: {format_event_id(job_id, seq)}\ndata: {json.dumps(payload)}\n\n"
+
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+def requesting_user(user: Optional[str] = Query(None), x_user: Optional[str] = Header(None, alias="X-User")):
+    """Who submitted a job, for fair scheduling (``?user=`` since EventSource cannot set headers)."""
+    return user or x_user
+
+@router.get("/generate/stream")
+def generate_mapping_stream(dataset_id: int, framework_id: int, use_cache: bool = True,
+                            last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+                            user: Optional[str] = Depends(requesting_user)):
+    """Submit a generation job and subscribe to its events.
+
+    The job keeps running if the client disconnects; an ``EventSource`` that
+    reconnects sends ``Last-Event-ID`` and gets the missed events instead of a new job.
+    A request identical to a job that is still queued or running subscribes to that job.
+    """
+    resume = parse_event_id(last_event_id)
+    if resume:
+        job = generation_jobs.get(resume[0])
+        if job and job["dataset_id"] == dataset_id and job["framework_id"] == framework_id:
+            return job_event_stream(*resume)
+
+    job_id = generation_jobs.submit(dataset_id, framework_id, use_cache=use_cache, user=user)
+    if job_id is None:
+        async def not_found():
+            yield f"data: {json.dumps({'type': 'error', 'message': 'Dataset or Framework not found'})}\n\n"
+        return StreamingResponse(not_found(), media_type="text/event-stream")
+    return job_event_stream(job_id)
+
+@router.post("/generate/jobs", response_model=schemas.GenerationJob, status_code=202)
+def submit_generation_job(request: schemas.MappingGenerateRequest, user: Optional[str] = Depends(requesting_user)):
+    """Queue a generation job; follow it through ``/generate/jobs/{job_id}`` or its ``/events`` stream."""
+    job_id = generation_jobs.submit(request.dataset_id, request.framework_id, use_cache=request.use_cache, user=user)
+    if job_id is None:
+        raise HTTPException(status_code=404, detail="Dataset or Framework not found")
+    return generation_jobs.get(job_id)
+
+@router.get("/generate/jobs", response_model=List[schemas.GenerationJob])
+def read_generation_jobs(user: Optional[str] = Depends(requesting_user), limit: int = Query(50, ge=1, le=500)):
+    return generation_jobs.list(user=user, limit=limit)
+
+@router.get("/generate/queue")
+def read_generation_queue():
+    """Running and queued generation jobs per user."""
+    return generation_jobs.queue_stats()
+
+@router.get("/generate/jobs/{job_id}", response_model=schemas.GenerationJob)
+def read_generation_job(job_id: str):
+    job = generation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Generation job not found")
+    return job
+
+@router.get("/generate/jobs/{job_id}/events")
+def stream_generation_job(job_id: str, after: int = 0,
+                          last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """SSE stream of a job's events after ``after`` (or the ``Last-Event-ID`` header)."""
+    if generation_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Generation job not found")
+    resume = parse_event_id(last_event_id)
+    if resume and resume[0] == job_id:
+        after = resume[1]
+    return job_event_stream(job_id, after)
+
+@router.post("/generate/jobs/{job_id}/retry-failed", response_model=schemas.GenerationJob, status_code=202)
+def retry_failed_sheets(job_id: str):
+    """Call the LLM again for the sheet groups that ended as placeholders; follow ``/events`` for the result."""
+    job = generation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Generation job not found")
+    if job["status"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="Generation job is still running")
+    if not generation_jobs.retry_failed(job_id):
+        raise HTTPException(status_code=400, detail="No failed sheet groups to retry")
+    return generation_jobs.get(job_id)
+
+@router.post("/generate/jobs/{job_id}/cancel", response_model=schemas.GenerationJob)
+def cancel_generation_job(job_id: str):
+    """Stop a queued or running job; mappings generated so far stay in its draft."""
+    job = generation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Generation job not found")
+    if job["status"] not in ("queued", "running") or not generation_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Generation job is {job['status']}")
+    return generation_jobs.get(job_id)
+
+@router.post("/generate/batches", response_model=schemas.GenerationBatch, status_code=202)
+def submit_generation_batch(request: schemas.GenerationBatchRequest, user: Optional[str] = Depends(requesting_user)):
+    """Queue one job per dataset/framework pair, run together under a shared LLM concurrency budget."""
+    if not request.pairs:
+        raise HTTPException(status_code=400, detail="No dataset/framework pairs given")
+    batch_id, missing = generation_jobs.submit_batch(
+        [(pair.dataset_id, pair.framework_id) for pair in request.pairs], use_cache=request.use_cache, user=user
+    )
+    if batch_id is None:
+        pairs = ", ".join(f"{dataset_id}/{framework_id}" for dataset_id, framework_id in missing)
+        raise HTTPException(status_code=404, detail=f"Dataset or Framework not found: {pairs}")
+    return generation_jobs.get_batch(batch_id)
+
+@router.get("/generate/batches/{batch_id}", response_model=schemas.GenerationBatch)
+def read_generation_batch(batch_id: str):
+    """Aggregate progress and throughput of a batch, with each of its jobs."""
+    batch = generation_jobs.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Generation batch not found")
+    return batch
+
+@router.post("/generate/batches/{batch_id}/cancel", response_model=schemas.GenerationBatch)
+def cancel_generation_batch(batch_id: str):
+    """Stop the queued and running jobs of a batch; finished jobs keep their drafts."""
+    if generation_jobs.get_batch(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Generation batch not found")
+    if not generation_jobs.cancel_batch(batch_id):
+        raise HTTPException(status_code=409, detail="Generation batch has no active jobs")
+    return generation_jobs.get_batch(batch_id)
+
 @router.get("/", response_model=List[schemas.Mapping])
 def read_mappings(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     # Use saved mappings logic (ordered by date) for better UX
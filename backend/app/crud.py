@@ -1,32 +1,89 @@
+from sqlalchemy import and_, func
 from sqlalchemy.orm import Session, joinedload
 from datetime import datetime
+from typing import Optional
 from . import models, schemas
+from .services import preview_cache, row_codec
+from .services.mapping_history import OFFICIAL, mapping_history
 
 # --- Datasets ---
 
+def _first_rows(db: Session, sheet_ids):
+    """First row (lowest row_index) of every sheet, in one query.
+
+    Joins back on a per-sheet ``MIN(row_index)`` so the database only touches the
+    head of each sheet through ``ix_dataset_rows_sheet_row``.
+    """
+    if not sheet_ids:
+        return {}
+    Row = models.DatasetRow
+    heads = (
+        db.query(Row.sheet_id.label("sheet_id"), func.min(Row.row_index).label("row_index"))
+        .filter(Row.sheet_id.in_(sheet_ids))
+        .group_by(Row.sheet_id)
+        .subquery()
+    )
+    rows = db.query(Row).join(
+        heads, and_(Row.sheet_id == heads.c.sheet_id, Row.row_index == heads.c.row_index)
+    ).all()
+    first = {}
+    for r in rows:
+        first.setdefault(r.sheet_id, r)
+    return first
+
+def _row_counts(db: Session, sheet_ids):
+    """``{sheet_id: row count}`` with a single GROUP BY (only used for sheets without a stored count)."""
+    if not sheet_ids:
+        return {}
+    Row = models.DatasetRow
+    return dict(
+        db.query(Row.sheet_id, func.count(Row.id))
+        .filter(Row.sheet_id.in_(sheet_ids))
+        .group_by(Row.sheet_id)
+        .all()
+    )
+
+def _load_dataset_sheets(db: Session, skip: int, limit: int, with_first_row: bool):
+    """Datasets page plus their sheets, header rows and row counts in a fixed number of queries."""
+    datasets = db.query(models.Dataset).order_by(models.Dataset.id).offset(skip).limit(limit).all()
+    if not datasets:
+        return [], {}, {}, {}
+
+    sheets = db.query(models.DatasetSheet).filter(
+        models.DatasetSheet.dataset_id.in_([d.id for d in datasets])
+    ).order_by(models.DatasetSheet.id).all()
+
+    sheets_by_dataset = {}
+    for s in sheets:
+        sheets_by_dataset.setdefault(s.dataset_id, []).append(s)
+
+    # Headers are cached on the sheet; legacy sheets need their first row to learn them
+    need_row = [s.id for s in sheets if with_first_row or not s.column_names]
+    first_rows = _first_rows(db, need_row)
+    counts = _row_counts(db, [s.id for s in sheets if s.row_count is None])
+    return datasets, sheets_by_dataset, first_rows, counts
+
 def get_datasets(db: Session, skip: int = 0, limit: int = 100):
-    # Optimize: Only load one row per sheet for column inference to avoid massive payload
-    datasets = db.query(models.Dataset).offset(skip).limit(limit).all()
-    
+    # One row per sheet is returned for column inference; all sheets and rows are loaded set-wise
+    datasets, sheets_by_dataset, first_rows, _ = _load_dataset_sheets(db, skip, limit, with_first_row=True)
+
     result = []
     for d in datasets:
         sheets_data = []
-        for s in d.sheets:
-            # Manually query for just 1 row
-            # We must be careful not to touch s.rows relationship to avoid lazy loading thousands of rows
-            first_row = db.query(models.DatasetRow).filter(models.DatasetRow.sheet_id == s.id).first()
-            
-            # Construct Pydantic model for row
+        for s in sheets_by_dataset.get(d.id, []):
+            first_row = first_rows.get(s.id)
             rows_list = []
             if first_row:
                  rows_list.append(schemas.DatasetRow(
                      id=first_row.id, 
                      row_index=first_row.row_index, 
-                     data=first_row.data
+                     data=row_codec.decode_row(s.column_names, first_row.data)
                  ))
-            
-            # Construct Pydantic model for sheet
-            sheets_data.append(schemas.DatasetSheet(name=s.name, rows=rows_list))
+            sheets_data.append(schemas.DatasetSheet(
+                name=s.name,
+                columns=row_codec.sheet_columns(s.column_names, first_row.data if first_row else None),
+                rows=rows_list
+            ))
             
         result.append(schemas.Dataset(
             id=d.id,
@@ -36,11 +93,111 @@ def get_datasets(db: Session, skip: int = 0, limit: int = 100):
         ))
     return result
 
+def get_dataset_summaries(db: Session, skip: int = 0, limit: int = 100):
+    """Sheet names, headers and row counts only, for dataset pickers."""
+    datasets, sheets_by_dataset, first_rows, counts = _load_dataset_sheets(db, skip, limit, with_first_row=False)
+
+    result = []
+    for d in datasets:
+        sheets_data = []
+        for s in sheets_by_dataset.get(d.id, []):
+            first_row = first_rows.get(s.id)
+            sheets_data.append(schemas.DatasetSheetSummary(
+                name=s.name,
+                columns=row_codec.sheet_columns(s.column_names, first_row.data if first_row else None),
+                row_count=s.row_count if s.row_count is not None else counts.get(s.id, 0),
+            ))
+        result.append(schemas.DatasetSummary(id=d.id, name=d.name, created_at=d.created_at, sheets=sheets_data))
+    return result
+
 def get_dataset(db: Session, dataset_id: int):
     # Eager load sheets -> rows might be too heavy?
     # For now, let's trust lazy loading or default relationship loading.
     return db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
 
+def get_dataset_with_rows(db: Session, dataset_id: int):
+    d = get_dataset(db, dataset_id)
+    if d is None:
+        return None
+
+    sheets_data = []
+    for s in d.sheets:
+        rows = db.query(models.DatasetRow).filter(models.DatasetRow.sheet_id == s.id).order_by(models.DatasetRow.row_index).all()
+        sheets_data.append(schemas.DatasetSheet(
+            name=s.name,
+            columns=row_codec.sheet_columns(s.column_names, rows[0].data if rows else None),
+            rows=[
+                schemas.DatasetRow(id=r.id, row_index=r.row_index, data=row_codec.decode_row(s.column_names, r.data))
+                for r in rows
+            ]
+        ))
+    return schemas.Dataset(id=d.id, name=d.name, created_at=d.created_at, sheets=sheets_data)
+
+def get_dataset_overview(db: Session, dataset_id: int):
+    """Dataset with sheet headers and row counts but no rows; rows are paged via ``get_sheet_rows``."""
+    d = get_dataset(db, dataset_id)
+    if d is None:
+        return None
+
+    sheets = db.query(models.DatasetSheet).filter(
+        models.DatasetSheet.dataset_id == dataset_id
+    ).order_by(models.DatasetSheet.id).all()
+    first_rows = _first_rows(db, [s.id for s in sheets if not s.column_names])
+    counts = _row_counts(db, [s.id for s in sheets if s.row_count is None])
+
+    sheets_data = []
+    for s in sheets:
+        first_row = first_rows.get(s.id)
+        sheets_data.append(schemas.DatasetSheet(
+            name=s.name,
+            columns=row_codec.sheet_columns(s.column_names, first_row.data if first_row else None),
+            row_count=s.row_count if s.row_count is not None else counts.get(s.id, 0),
+        ))
+    return schemas.Dataset(id=d.id, name=d.name, created_at=d.created_at, sheets=sheets_data)
+
+def get_sheet(db: Session, dataset_id: int, sheet_name: str):
+    return db.query(models.DatasetSheet).filter(
+        models.DatasetSheet.dataset_id == dataset_id,
+        models.DatasetSheet.name == sheet_name
+    ).first()
+
+def get_sheet_columns(db: Session, sheet: models.DatasetSheet):
+    if sheet.column_names:
+        return list(sheet.column_names)
+    # Legacy sheet: headers are the keys of its first dict row
+    first_row = _first_rows(db, [sheet.id]).get(sheet.id)
+    return row_codec.sheet_columns(None, first_row.data if first_row else None)
+
+def get_sheet_rows(db: Session, sheet_id: int, after: int = -1, limit: int = 500):
+    """One keyset page of ``(id, row_index, data)`` with ``row_index > after``, served by ix_dataset_rows_sheet_row."""
+    Row = models.DatasetRow
+    return db.query(Row.id, Row.row_index, Row.data).filter(
+        Row.sheet_id == sheet_id,
+        Row.row_index > after
+    ).order_by(Row.row_index).limit(limit).all()
+
+def iter_sheet_rows(db: Session, sheet_id: int, after: int = -1, page_size: int = 1000, limit: Optional[int] = None):
+    """Yield rows page by page so a full export never holds more than one page in memory."""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page = get_sheet_rows(db, sheet_id, after=after, limit=size)
+        if not page:
+            return
+        yield from page
+        after = page[-1].row_index
+        if remaining is not None:
+            remaining -= len(page)
+        if len(page) < size:
+            return
+
+def project_row(columns, data, selected=None):
+    """Decode a stored row, optionally keeping only ``selected`` columns."""
+    row = row_codec.decode_row(columns, data)
+    if selected is None:
+        return row
+    return {c: row.get(c) for c in selected}
+
 def create_dataset(db: Session, dataset: schemas.DatasetCreate):
     db_dataset = models.Dataset(name=dataset.name)
     db.add(db_dataset)
@@ -49,36 +206,82 @@ def create_dataset(db: Session, dataset: schemas.DatasetCreate):
     # Note: sheets/rows creation is complex, usually handled by seed script or specialized upload endpoint.
     return db_dataset
 
+def get_column_profiles(db: Session, dataset_id: int, sheet_name: str = None):
+    """Precomputed column statistics per sheet (empty for sheets imported before profiling)."""
+    query = db.query(models.DatasetSheet).options(joinedload(models.DatasetSheet.profiles)).filter(
+        models.DatasetSheet.dataset_id == dataset_id
+    )
+    if sheet_name is not None:
+        query = query.filter(models.DatasetSheet.name == sheet_name)
+
+    result = []
+    for s in query.order_by(models.DatasetSheet.id).all():
+        result.append(schemas.SheetProfile(
+            sheet_name=s.name,
+            row_count=s.profiles[0].row_count if s.profiles else 0,
+            columns=[schemas.ColumnProfile.model_validate(p) for p in s.profiles]
+        ))
+    return result
+
 def get_dataset_column_sample(db: Session, dataset_id: int, sheet_name: str, column_name: str, limit: int = 10):
     # 1. Find the sheet
-    sheet = db.query(models.DatasetSheet).filter(
-        models.DatasetSheet.dataset_id == dataset_id,
-        models.DatasetSheet.name == sheet_name
-    ).first()
-    
+    sheet = get_sheet(db, dataset_id, sheet_name)
     if not sheet:
         return []
 
-    # 2. Query rows and extract JSON value
-    # Utilizing JSON access in SQL (PostgreSQL/SQLite dependent, but here using Python side for safety/simplicity)
-    # Fetch more rows than limit to ensure distinctness
-    rows = db.query(models.DatasetRow).filter(
-        models.DatasetRow.sheet_id == sheet.id
-    ).limit(500).all()
-    
+    # Cached values stay valid for as long as the sheet has not been re-imported
+    key = (dataset_id, sheet_name, column_name, limit)
+    token = (sheet.id, sheet.content_hash)
+    cached = preview_cache.column_previews.get(key, token)
+    if cached is not None:
+        return cached
+
+    result = _column_sample(db, sheet, column_name, limit)
+    preview_cache.column_previews.put(key, result, token)
+    return result
+
+def _column_sample(db: Session, sheet: models.DatasetSheet, column_name: str, limit: int):
+    # Prefer the import-time profile: its top values cover the whole sheet, not just the first rows
+    profile = db.query(models.ColumnProfile).filter(
+        models.ColumnProfile.sheet_id == sheet.id,
+        models.ColumnProfile.column_name == column_name
+    ).first()
+    if profile is not None:
+        values = [str(v["value"]) for v in (profile.top_values or [])]
+        if len(values) >= limit or profile.distinct_count <= len(values):
+            return values[:limit]
+
+    # 2. Let the database extract the cell and deduplicate (JSON_EXTRACT + DISTINCT + LIMIT)
+    if sheet.column_names:
+        position = row_codec.column_position(sheet.column_names, column_name)
+        if position is None:
+            return []
+        cell = models.DatasetRow.data[position]
+    else:
+        cell = models.DatasetRow.data[column_name] # legacy {column: value} rows
+
+    # Nulls, blanks and values differing only in surrounding spaces are DISTINCT in SQL but
+    # dropped or merged below; keep paging (growing pages) until ``limit`` values survive
+    query = db.query(cell).filter(models.DatasetRow.sheet_id == sheet.id).distinct()
+
     distinct_values = set()
     result = []
-    
-    for row in rows:
-        val = row.data.get(column_name)
-        if val is not None:
-            s_val = str(val).strip()
-            if s_val and s_val not in distinct_values:
-                distinct_values.add(s_val)
-                result.append(s_val)
-                if len(result) >= limit:
-                    break
-                    
+    offset, page = 0, limit + 2
+    while len(result) < limit:
+        values = query.offset(offset).limit(page).all()
+        for (val,) in values:
+            if val is not None:
+                s_val = str(val).strip()
+                if s_val and s_val not in distinct_values:
+                    distinct_values.add(s_val)
+                    result.append(s_val)
+                    if len(result) >= limit:
+                        break
+        if len(values) < page:
+            break
+        offset += page
+        page *= 2
+
     return result
 
 
@@ -125,7 +328,9 @@ def get_mappings(db: Session, skip: int = 0, limit: int = 100):
 def create_mapping(db: Session, mapping: schemas.MappingCreate):
     db_mapping = models.Mapping(
         dataset_id=mapping.dataset_id,
-        framework_id=mapping.framework_id
+        framework_id=mapping.framework_id,
+        status=OFFICIAL,
+        approved_at=datetime.utcnow()
     )
     db.add(db_mapping)
     db.commit()
@@ -147,6 +352,7 @@ def create_mapping(db: Session, mapping: schemas.MappingCreate):
         
     db.commit()
     db.refresh(db_mapping)
+    mapping_history.record(db_mapping)
     return db_mapping
 
 def update_mapping(db: Session, mapping_id: int, mapping: schemas.MappingCreate):
@@ -155,6 +361,9 @@ def update_mapping(db: Session, mapping_id: int, mapping: schemas.MappingCreate)
         return None
         
     db_mapping.saved_at = datetime.utcnow()
+    # Saving a generated draft approves it
+    db_mapping.status = OFFICIAL
+    db_mapping.approved_at = db_mapping.saved_at
     
     # Delete old entries
     db.query(models.MappingEntry).filter(models.MappingEntry.mapping_id == mapping_id).delete()
@@ -176,6 +385,7 @@ def update_mapping(db: Session, mapping_id: int, mapping: schemas.MappingCreate)
         
     db.commit()
     db.refresh(db_mapping)
+    mapping_history.record(db_mapping)
     return db_mapping
 
 def delete_mapping(db: Session, mapping_id: int):
@@ -188,6 +398,7 @@ def delete_mapping(db: Session, mapping_id: int):
     db.query(models.MappingEntry).filter(models.MappingEntry.mapping_id == mapping_id).delete()
     db.delete(mapping)
     db.commit()
+    mapping_history.forget(mapping_id)
     return True
 
 def get_saved_mappings(db: Session):
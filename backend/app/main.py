@@ -1,13 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from . import models
 from .database import engine
 from .api.v1.api import api_router
+from .services.generation_jobs import generation_jobs
+from .services.llm_factory import LLM_HEALTH_PROBE, check_llm_health, init_llms
 
 # Create tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="PV Mapping API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the LLM clients now rather than in the first generation (no network round trip)
+    await asyncio.to_thread(init_llms)
+    probe = asyncio.create_task(check_llm_health()) if LLM_HEALTH_PROBE else None
+    # Generation jobs interrupted by the previous shutdown continue where they stopped
+    generation_jobs.recover()
+    yield
+    if probe is not None and not probe.done():
+        probe.cancel()
+
+app = FastAPI(title="PV Mapping API", lifespan=lifespan)
 
 # Allow CORS for frontend
 app.add_middleware(
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Float, JSON
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Float, JSON, Index, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -9,6 +9,7 @@ class Dataset(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), index=True, unique=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    content_hash = Column(String(64), nullable=True) # SHA-256 of the source workbook, for incremental re-import
     
     sheets = relationship("DatasetSheet", back_populates="dataset", cascade="all, delete-orphan")
     mappings = relationship("Mapping", back_populates="dataset", cascade="all, delete-orphan")
@@ -19,23 +20,85 @@ class DatasetSheet(Base):
     id = Column(Integer, primary_key=True, index=True)
     dataset_id = Column(Integer, ForeignKey("datasets.id"))
     name = Column(String(255))
+    content_hash = Column(String(64), nullable=True) # Hash of headers + cell values
+    # Column headers, stored once per sheet; DatasetRow.data holds values in this order
+    column_names = Column(JSON, nullable=True)
+    row_count = Column(Integer, nullable=True)
     
     dataset = relationship("Dataset", back_populates="sheets")
     # Changed: Columns are less important now we store rows, but we can keep structure if needed.
     # Actually, removing DatasetColumn table to simplify, or keep for metadata?
     # Let's remove DatasetColumn and use DatasetRow with JSON.
     rows = relationship("DatasetRow", back_populates="sheet", cascade="all, delete-orphan")
+    profiles = relationship("ColumnProfile", back_populates="sheet", cascade="all, delete-orphan",
+                            order_by="ColumnProfile.position")
 
 class DatasetRow(Base):
     __tablename__ = "dataset_rows"
 
     id = Column(Integer, primary_key=True, index=True)
     sheet_id = Column(Integer, ForeignKey("dataset_sheets.id"))
-    data = Column(JSON) # Stores the row as a Dictionary
+    # Positional array aligned with DatasetSheet.column_names (legacy rows: a Dictionary).
+    # Always decode through services.row_codec.
+    data = Column(JSON)
     row_index = Column(Integer)
 
     sheet = relationship("DatasetSheet", back_populates="rows")
 
+    __table_args__ = (
+        # Ordered reads per sheet (samples, previews) walk this index instead of sorting
+        Index("ix_dataset_rows_sheet_row", "sheet_id", "row_index"),
+    )
+
+
+class ColumnProfile(Base):
+    """Per-column statistics computed at import time (see services.column_profiler)."""
+    __tablename__ = "column_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sheet_id = Column(Integer, ForeignKey("dataset_sheets.id"), index=True)
+    column_name = Column(String(255))
+    position = Column(Integer)
+
+    row_count = Column(Integer)
+    null_count = Column(Integer)
+    null_ratio = Column(Float)
+    distinct_count = Column(Integer)
+    top_values = Column(JSON) # [{"value": ..., "count": ...}], most frequent first
+    inferred_type = Column(String(20)) # date, time, numeric, code, text, empty
+    min_value = Column(String(255), nullable=True)
+    max_value = Column(String(255), nullable=True)
+
+    sheet = relationship("DatasetSheet", back_populates="profiles")
+
+
+class SearchEntry(Base):
+    """A searchable text of a sheet column: its header or one of its frequent values (see services.search_index)."""
+    __tablename__ = "search_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sheet_id = Column(Integer, ForeignKey("dataset_sheets.id"), index=True)
+    position = Column(Integer) # column position in the sheet
+    ordinal = Column(Integer) # 0 = column header, 1.. = values by frequency
+    column_name = Column(String(255))
+    kind = Column(String(10)) # column, value
+    text = Column(String(255))
+    example = Column(String(255), nullable=True) # value shown in search hits
+    frequency = Column(Integer, default=0)
+
+    __table_args__ = (Index("ix_search_entries_key", "sheet_id", "position", "ordinal"),)
+
+
+class SearchGram(Base):
+    """Inverted index posting: an n-gram of a ``SearchEntry`` text."""
+    __tablename__ = "search_grams"
+
+    id = Column(Integer, primary_key=True, index=True)
+    gram = Column(String(16), index=True)
+    sheet_id = Column(Integer, ForeignKey("dataset_sheets.id"), index=True)
+    position = Column(Integer)
+    ordinal = Column(Integer)
+
 
 class Framework(Base):
     __tablename__ = "frameworks"
@@ -44,6 +107,7 @@ class Framework(Base):
     name = Column(String(255), unique=True, index=True)
     version = Column(String(50))
     description = Column(Text)
+    content_hash = Column(String(64), nullable=True) # SHA-256 of the framework workbook
     
     sheets = relationship("FrameworkSheet", back_populates="framework", cascade="all, delete-orphan")
     mappings = relationship("Mapping", back_populates="framework")
@@ -72,6 +136,8 @@ class Mapping(Base):
     dataset_id = Column(Integer, ForeignKey("datasets.id"))
     framework_id = Column(Integer, ForeignKey("frameworks.id"))
     saved_at = Column(DateTime, default=datetime.utcnow)
+    status = Column(String(50), default="official") # draft while generated, official once saved; legacy = saved before review existed
+    approved_at = Column(DateTime, nullable=True) # when a user last saved it
     
     dataset = relationship("Dataset", back_populates="mappings")
     framework = relationship("Framework", back_populates="mappings")
@@ -96,6 +162,64 @@ class MappingEntry(Base):
     
     mapping = relationship("Mapping", back_populates="entries")
 
+class GenerationBatch(Base):
+    """Generation jobs for many dataset/framework pairs, scheduled and reported as one unit."""
+    __tablename__ = "generation_batches"
+
+    id = Column(String(32), primary_key=True)
+    requested_by = Column(String(100), default="anonymous")
+    use_cache = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class GenerationJob(Base):
+    """One AI mapping generation; survives client disconnects and can be resumed or retried."""
+    __tablename__ = "generation_jobs"
+
+    id = Column(String(32), primary_key=True)
+    batch_id = Column(String(32), ForeignKey("generation_batches.id"), nullable=True, index=True)
+    mapping_id = Column(Integer, ForeignKey("mappings.id"), nullable=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"))
+    framework_id = Column(Integer, ForeignKey("frameworks.id"))
+    requested_by = Column(String(100), default="anonymous") # jobs are scheduled fairly across users
+    status = Column(String(20), default="queued") # queued, running, succeeded, failed, cancelled
+    use_cache = Column(Boolean, default=True)
+    flight_key = Column(String(64), nullable=True, index=True) # identical concurrent requests share one job
+    llm_usage = Column(JSON, nullable=True) # per model tier: calls, cache hits, latency, tokens
+    error = Column(Text, nullable=True)
+    last_seq = Column(Integer, default=0) # sequence number of the latest event
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    groups = relationship("GenerationJobGroup", back_populates="job", cascade="all, delete-orphan")
+
+class GenerationJobGroup(Base):
+    """Progress of one standard sheet group within a generation job."""
+    __tablename__ = "generation_job_groups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(32), ForeignKey("generation_jobs.id"), index=True)
+    sheet_name = Column(String(255))
+    status = Column(String(20), default="pending") # pending, done, failed
+    total_columns = Column(Integer, default=0)
+    done_columns = Column(Integer, default=0)
+    failed_columns = Column(Integer, default=0) # placeholders returned after the LLM gave up
+    attempts = Column(Integer, default=0)
+
+    job = relationship("GenerationJob", back_populates="groups")
+
+class GenerationJobEvent(Base):
+    """Event log of a job, replayed to clients reconnecting with ``Last-Event-ID``."""
+    __tablename__ = "generation_job_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(32), ForeignKey("generation_jobs.id"))
+    seq = Column(Integer)
+    payload = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_generation_job_events_job_seq", "job_id", "seq", unique=True),)
+
 class ChangeLog(Base):
     __tablename__ = "change_logs"
 
@@ -13,6 +13,8 @@ class DatasetRow(BaseModel):
 
 class DatasetSheet(BaseModel):
     name: str
+    columns: List[str] = []
+    row_count: Optional[int] = None
     rows: List[DatasetRow] = [] # Note: Fetching all rows might be heavy
     class Config:
         from_attributes = True
@@ -32,6 +34,65 @@ class Dataset(BaseModel):
     class Config:
         from_attributes = True
 
+class RowPage(BaseModel):
+    sheet_name: str
+    columns: List[str] = []
+    rows: List[DatasetRow] = []
+    next_after: Optional[int] = None # row_index to pass as ``after`` for the next page; None on the last page
+
+class DatasetSheetSummary(BaseModel):
+    name: str
+    columns: List[str] = []
+    row_count: int = 0
+
+class DatasetSummary(BaseModel):
+    id: int
+    name: str
+    created_at: datetime
+    sheets: List[DatasetSheetSummary] = []
+
+class SearchHit(BaseModel):
+    dataset_id: int
+    dataset_name: str
+    sheet_name: str
+    column_name: str
+    example: Optional[str] = None
+    match: str # column (header matched) or value
+    score: float
+
+class ColumnProfile(BaseModel):
+    column_name: str
+    position: int
+    row_count: int
+    null_count: int
+    null_ratio: float
+    distinct_count: int
+    top_values: List[Dict[str, Any]] = [] # [{"value": ..., "count": ...}]
+    inferred_type: str
+    min_value: Optional[str] = None
+    max_value: Optional[str] = None
+    class Config:
+        from_attributes = True
+
+class SheetProfile(BaseModel):
+    sheet_name: str
+    row_count: int
+    columns: List[ColumnProfile] = []
+
+class ImportJob(BaseModel):
+    id: str
+    dataset_name: str
+    file_name: str
+    status: str
+    total_sheets: Optional[int] = None
+    sheets_done: int = 0
+    rows_parsed: int = 0
+    rows_per_sec: Optional[float] = None
+    dataset_id: Optional[int] = None
+    summary: Optional[str] = None
+    error: Optional[str] = None
+    version: int = 0
+
 # --- Frameworks ---
 
 class FrameworkSheetBase(BaseModel):
@@ -92,14 +153,71 @@ class Mapping(BaseModel):
     dataset_id: int
     framework_id: int
     saved_at: datetime
+    status: Optional[str] = None
     entries: List[MappingEntry] = []
     
     class Config:
         from_attributes = True
 
+class GenerationJobGroup(BaseModel):
+    sheet_name: str
+    status: str
+    total_columns: int = 0
+    done_columns: int = 0
+    failed_columns: int = 0
+    attempts: int = 0
+
+class GenerationJob(BaseModel):
+    id: str
+    mapping_id: Optional[int] = None
+    dataset_id: int
+    framework_id: int
+    requested_by: Optional[str] = None
+    batch_id: Optional[str] = None
+    subscribers: int = 0 # open event streams, including requests coalesced into this job
+    status: str
+    error: Optional[str] = None
+    last_event_id: str
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    total_columns: int = 0
+    done_columns: int = 0
+    failed_columns: int = 0
+    progress: Optional[float] = None
+    llm_usage: Optional[Dict[str, Any]] = None # per model tier (default, or fast/strong)
+    groups: List[GenerationJobGroup] = []
+
 class MappingGenerateRequest(BaseModel):
     dataset_id: int
     framework_id: int
+    use_cache: bool = True
+
+class GenerationPair(BaseModel):
+    dataset_id: int
+    framework_id: int
+
+class GenerationBatchRequest(BaseModel):
+    pairs: List[GenerationPair]
+    use_cache: bool = True
+
+class GenerationBatch(BaseModel):
+    id: str
+    requested_by: Optional[str] = None
+    status: str
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    total_jobs: int = 0
+    jobs_by_status: Dict[str, int] = {}
+    total_columns: int = 0
+    done_columns: int = 0
+    failed_columns: int = 0
+    progress: Optional[float] = None
+    elapsed_seconds: Optional[float] = None
+    columns_per_minute: Optional[float] = None # throughput since the first job started
+    llm_usage: Optional[Dict[str, Any]] = None # summed over the batch's jobs
+    jobs: List[GenerationJob] = []
 
 # --- Change Logs ---
 
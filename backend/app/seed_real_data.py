@@ -1,8 +1,9 @@
 
+import argparse
 import os
-import pandas as pd
 from sqlalchemy.orm import Session
 from . import models, database
+from .services import excel_ingestion, incremental_import, parallel_import
 
 # Force drop tables to apply new schema (Quick and dirty for dev)
 def reset_db():
@@ -10,18 +11,84 @@ def reset_db():
     models.Base.metadata.drop_all(bind=database.engine)
     models.Base.metadata.create_all(bind=database.engine)
 
-def seed_data_from_excels():
+def list_workbooks(folder):
+    """Excel files in ``folder``, sorted so imports are reproducible."""
+    if not os.path.exists(folder):
+        return []
+    return sorted(f for f in os.listdir(folder) if f.endswith((".xlsx", ".xls")))
+
+def get_excels_root():
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), "excels") # backend/excels
+
+def list_imp_dirs(excels_root):
+    return sorted(d for d in os.listdir(excels_root) if os.path.isdir(os.path.join(excels_root, d)) and d.upper().startswith("IMP"))
+
+def refresh_data_from_excels(workers: int = 1):
+    """Incremental import: keep existing tables and only re-import what changed.
+
+    Unchanged workbooks (by file hash) and unchanged sheets (by content hash)
+    are skipped; saved mappings and their history are never touched.
+    """
+    excels_root = get_excels_root()
+    if not os.path.exists(excels_root):
+        print(f"Error: {excels_root} does not exist.")
+        return
+
+    models.Base.metadata.create_all(bind=database.engine)
+    imp_dirs = list_imp_dirs(excels_root)
+
+    sources = [
+        (f"{imp_dir}: {file}", os.path.join(excels_root, imp_dir, "Source", file))
+        for imp_dir in imp_dirs
+        for file in list_workbooks(os.path.join(excels_root, imp_dir, "Source"))
+    ]
+    print(f"Refreshing {len(sources)} source workbooks...")
+    report = incremental_import.refresh_datasets(database.engine, sources, workers=workers)
+    print(f"  Datasets: {report}")
+
+    for imp_dir in imp_dirs:
+        mapping_path = os.path.join(excels_root, imp_dir, "Mapping")
+        for file in list_workbooks(mapping_path):
+            framework_name = f"{imp_dir}: {file}"
+            try:
+                status = incremental_import.refresh_framework(database.engine, framework_name, os.path.join(mapping_path, file))
+                print(f"  Framework {framework_name}: {status}")
+            except Exception as e:
+                print(f"    Error reading mapping excel {file}: {e}")
+
+    print("Refresh Complete!")
+
+def seed_data_from_excels(workers: int = 1):
+    """Reset the schema and import every IMP* folder.
+
+    With ``workers > 1`` source sheets are parsed in a process pool
+    (see ``services.parallel_import``); ids, sheet order and ``row_index``
+    are the same as in a serial import.
+    """
     reset_db()
     
     db = database.SessionLocal()
-    excels_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "excels") # backend/excels
+    excels_root = get_excels_root()
     
     if not os.path.exists(excels_root):
         print(f"Error: {excels_root} does not exist.")
         return
 
+    total_stats = excel_ingestion.IngestStats()
+
     try:
-        imp_dirs = [d for d in os.listdir(excels_root) if os.path.isdir(os.path.join(excels_root, d)) and d.upper().startswith("IMP")]
+        imp_dirs = list_imp_dirs(excels_root)
+
+        if workers > 1:
+            # Parse every source workbook of every IMP folder in one process pool
+            sources = [
+                (f"{imp_dir}: {file}", os.path.join(excels_root, imp_dir, "Source", file))
+                for imp_dir in imp_dirs
+                for file in list_workbooks(os.path.join(excels_root, imp_dir, "Source"))
+            ]
+            print(f"Importing {len(sources)} source workbooks with {workers} workers...")
+            total_stats = parallel_import.import_datasets_parallel(database.engine, sources, workers=workers)
+            print(f"  Imported {total_stats}")
         
         for imp_dir in imp_dirs:
             print(f"Processing {imp_dir}...")
@@ -29,79 +96,23 @@ def seed_data_from_excels():
             
             # 1. Processing Source (Datasets) - Now storing ROWS
             source_path = os.path.join(imp_path, "Source")
-            if os.path.exists(source_path):
-                for file in os.listdir(source_path):
-                    if not file.endswith((".xlsx", ".xls")):
-                        continue
-                        
+            if workers <= 1:
+                for file in list_workbooks(source_path):
                     file_path = os.path.join(source_path, file)
                     dataset_name = f"{imp_dir}: {file}"
                     
                     print(f"  Importing Dataset: {dataset_name}")
-                    dataset = models.Dataset(name=dataset_name)
+                    dataset = models.Dataset(name=dataset_name, content_hash=excel_ingestion.file_content_hash(file_path))
                     db.add(dataset)
                     db.commit()
                     db.refresh(dataset)
                     
                     try:
-                        # Read all sheets with data
-                        # Handle NaNs: fillna(None) or replace with "" because JSON doesn't like NaN
-                        
-                        xls = pd.ExcelFile(file_path)
-                        for sheet_name in xls.sheet_names:
-                            df = pd.read_excel(xls, sheet_name=sheet_name)
-                            # Convert NaNs to None/Null for JSON compatibility
-                            # Also handle inf/-inf just in case
-                            df = df.where(pd.notnull(df), None)
-                            
-                            import numpy as np
-                            from datetime import datetime, date, time
-
-                            def clean_for_json(data):
-                                """Recursively clean dictionary values for JSON compatibility."""
-                                if isinstance(data, dict):
-                                    return {k: clean_for_json(v) for k, v in data.items()}
-                                elif isinstance(data, list):
-                                    return [clean_for_json(v) for v in data]
-                                elif isinstance(data, float):
-                                    if pd.isna(data) or np.isinf(data):
-                                        return None
-                                    return data
-                                elif isinstance(data, (datetime, date, time)):
-                                    return str(data)
-                                elif pd.isna(data): # Handle NaT or other pandas nulls
-                                    return None
-                                return data
-                            
-                            ds_sheet = models.DatasetSheet(dataset_id=dataset.id, name=sheet_name)
-                            db.add(ds_sheet)
-                            db.commit()
-                            db.refresh(ds_sheet)
-                            
-                            # Bulk insert rows
-                            rows_data = []
-                            for idx, row in df.iterrows():
-                                # Convert row to dict, simple and stupid
-                                row_dict = row.to_dict()
-                                # Clean data
-                                row_dict = clean_for_json(row_dict)
-                                
-                                rows_data.append(models.DatasetRow(
-                                    sheet_id=ds_sheet.id,
-                                    row_index=idx,
-                                    data=row_dict
-                                ))
-                                
-                                # Batch commit every 1000 rows
-                                if len(rows_data) >= 1000:
-                                    db.bulk_save_objects(rows_data)
-                                    db.commit()
-                                    rows_data = []
-
-                            if rows_data:
-                                db.bulk_save_objects(rows_data)
-                                db.commit()
-                                
+                        # Stream sheets row by row and bulk insert with Core executemany
+                        stats = excel_ingestion.ingest_workbook(database.engine, dataset.id, file_path)
+                        total_stats.merge(stats)
+                        print(f"    Imported {stats}")
+
                     except Exception as e:
                         print(f"    Error reading source excel {file}: {e}")
                         import traceback
@@ -110,10 +121,7 @@ def seed_data_from_excels():
             # 2. Processing Frameworks - Using "数据源定位" sheet
             mapping_path = os.path.join(imp_path, "Mapping")
             if os.path.exists(mapping_path):
-                 for file in os.listdir(mapping_path):
-                    if not file.endswith((".xlsx", ".xls")):
-                        continue
-                    
+                 for file in list_workbooks(mapping_path):
                     file_path = os.path.join(mapping_path, file)
                     framework_name = f"{imp_dir}: {file}"
                     
@@ -129,36 +137,15 @@ def seed_data_from_excels():
                     
                     try:
                         # Specifically look for '数据源定位' sheet
-                        target_sheet = "数据源定位"
-                        
-                        xls = pd.ExcelFile(file_path)
-                        if target_sheet not in xls.sheet_names:
-                            print(f"    Warning: Sheet '{target_sheet}' not found in {file}. Skipping.")
+                        entries = excel_ingestion.read_framework_entries(file_path)
+                        if entries is None:
+                            print(f"    Warning: Sheet '数据源定位' not found in {file}. Skipping.")
                             continue
-                            
-                        df = pd.read_excel(xls, sheet_name=target_sheet)
-                        df = df.where(pd.notnull(df), None)
-                        
-                        # Expected columns based on user investigation:
-                        # Target_SheetName, Target_ColumnName, Standard_ColumnName, Standard_SheetName, 信息类型, 备注
-                        
-                        for _, row in df.iterrows():
-                            # Flexible column lookup
-                            s_sheet = row.get('Standard_SheetName') or row.get('Standard Sheet')
-                            s_col = row.get('Standard_ColumnName') or row.get('Standard Column') 
-                            info = row.get('信息类型') or row.get('Info Type')
-                            note = row.get('备注') or row.get('Note')
-                            
-                            # Standard columns are mandatory to define the framework
-                            if s_sheet and s_col:
-                                db.add(models.FrameworkSheet(
-                                    framework_id=framework.id,
-                                    standard_sheet_name=str(s_sheet),
-                                    standard_column_name=str(s_col),
-                                    info_type=str(info) if info else None,
-                                    note=str(note) if note else None
-                                ))
-                        
+
+                        for entry in entries:
+                            db.add(models.FrameworkSheet(framework_id=framework.id, **entry))
+
+                        framework.content_hash = excel_ingestion.file_content_hash(file_path)
                         db.commit()
                              
                     except Exception as e:
@@ -166,7 +153,7 @@ def seed_data_from_excels():
                         import traceback
                         traceback.print_exc()
 
-        print("Import Complete!")
+        print(f"Import Complete! Source rows: {total_stats}")
 
     except Exception as e:
         print(f"Global Error: {e}")
@@ -176,4 +163,13 @@ def seed_data_from_excels():
         db.close()
 
 if __name__ == "__main__":
-    seed_data_from_excels()
+    parser = argparse.ArgumentParser(description="Import IMP* Excel folders into the database")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes used to parse source workbooks (default: 1, serial)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-import changed workbooks/sheets instead of resetting the database")
+    args = parser.parse_args()
+    if args.incremental:
+        refresh_data_from_excels(workers=args.workers)
+    else:
+        seed_data_from_excels(workers=args.workers)
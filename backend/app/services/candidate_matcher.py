@@ -0,0 +1,315 @@
+"""
+候选列预筛选
+
+Deterministic lexical matcher that runs before the LLM. Source column names and
+target columns (``Standard_ColumnName`` + ``备注``) are expanded with the
+Chinese-English term and abbreviation tables below, split into character 2/3-grams
+and compared by TF-IDF cosine similarity (dense numpy matrices; a generation has
+at most a few thousand columns on either side). The source columns are vectorized
+once per generation; target columns are projected into their vocabulary, and
+the matchers of routed sheet selections (``subset``) reuse the same vectors.
+
+The result is used two ways:
+  * only the top-k candidates of a batch's targets are put into its prompt, and
+  * near-exact matches (same name/code, or a clear lexical winner) are resolved
+    directly, without an LLM call.
+"""
+import math
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Shared with the "Column Mapping Hints" prompt section
+TERM_TRANSLATIONS = {
+    "受试者编号": "Subject ID",
+    "项目编号": "Project ID",
+    "不良事件": "Adverse Event",
+    "开始日期": "Start Date",
+    "结束日期": "End Date",
+    "给药": "Drug Administration",
+    "剂量": "Dose",
+    "严重性": "Severity",
+    "转归": "Outcome",
+    "因果关系": "Causality",
+    "措施": "Action"
+}
+
+ABBREVIATIONS = {
+    "AE": "Adverse Event",
+    "SAE": "Serious Adverse Event",
+    "DM": "Demographics",
+    "EX": "Exposure",
+    "DAT": "Date",
+    "SER": "Serious",
+    "TERM": "Terminology",
+    "ACN": "Action",
+    "REL": "Relationship"
+}
+
+# Candidates per target column put into the prompt (0 disables the pre-filter)
+CANDIDATE_TOP_K = int(os.getenv("CANDIDATE_TOP_K", "8"))
+# Sheets with at most this many source columns are always sent in full
+CANDIDATE_MIN_COLUMNS = int(os.getenv("CANDIDATE_MIN_COLUMNS", "40"))
+CANDIDATE_AUTO_RESOLVE = os.getenv("CANDIDATE_AUTO_RESOLVE", "true").lower() not in ("0", "false", "no")
+# A lexical winner is auto-resolved above this cosine score and this lead over the runner-up
+AUTO_RESOLVE_SCORE = 0.9
+AUTO_RESOLVE_MARGIN = 0.15
+EXACT_CONFIDENCE = 0.95
+LEXICAL_CONFIDENCE = 0.9
+
+_CODE_IN_PARENS = re.compile(r"[(（]\s*([A-Za-z][A-Za-z0-9_]*)\s*[)）]")
+_NON_ALNUM = re.compile(r"[^A-Za-z0-9]+")
+_SPACES = re.compile(r"\s+")
+
+
+@dataclass
+class Candidate:
+    sheet: str
+    column: str
+    score: float
+    exact: bool = False
+
+
+def _normalize(text: str) -> str:
+    return _SPACES.sub(" ", str(text)).strip().lower()
+
+
+def expand_terms(text: str) -> str:
+    """Text plus the translations/expansions of the terms and abbreviations it contains."""
+    text = str(text or "")
+    lowered = text.lower()
+    extra = []
+    for chinese, english in TERM_TRANSLATIONS.items():
+        if chinese in text:
+            extra.append(english)
+        elif english.lower() in lowered:
+            extra.append(chinese)
+    for token in _NON_ALNUM.split(text.upper()):
+        if not token:
+            continue
+        if token in ABBREVIATIONS:
+            extra.append(ABBREVIATIONS[token])
+            continue
+        # Abbreviations glued into CDISC-style codes, e.g. AESTDAT -> AE ... DAT
+        for abbr, full in ABBREVIATIONS.items():
+            if len(abbr) >= 3 and abbr in token:
+                extra.append(full)
+    return _normalize(" ".join([text] + extra))
+
+
+def _char_ngrams(text: str) -> Dict[str, int]:
+    padded = f" {text} "
+    counts: Dict[str, int] = {}
+    for n in (2, 3):
+        for i in range(len(padded) - n + 1):
+            gram = padded[i:i + n]
+            if gram.strip():
+                counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def _term_frequencies(documents: List[str], vocabulary: Dict[str, int], grow: bool
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """Sublinear tf matrix over ``vocabulary`` (extended if ``grow``), and the squared tf of grams outside it."""
+    grams = [_char_ngrams(doc) for doc in documents]
+    if grow:
+        for counts in grams:
+            for gram in counts:
+                vocabulary.setdefault(gram, len(vocabulary))
+    matrix = np.zeros((len(documents), max(1, len(vocabulary))), dtype=np.float32)
+    unseen = np.zeros(len(documents), dtype=np.float32)
+    for row, counts in enumerate(grams):
+        for gram, count in counts.items():
+            index = vocabulary.get(gram)
+            if index is None:
+                unseen[row] += (1.0 + math.log(count)) ** 2
+            else:
+                matrix[row, index] = 1.0 + math.log(count)
+    return matrix, unseen
+
+
+def _normalize_rows(matrix: np.ndarray, extra_square: Optional[np.ndarray] = None) -> np.ndarray:
+    squares = (matrix * matrix).sum(axis=1)
+    if extra_square is not None:
+        squares = squares + extra_square
+    norms = np.sqrt(squares)
+    norms[norms == 0] = 1.0
+    return matrix / norms[:, None]
+
+
+def _tfidf(documents: List[str]) -> np.ndarray:
+    """Row-normalized TF-IDF matrix (sublinear tf) of character n-grams."""
+    matrix, _ = _term_frequencies(documents, {}, grow=True)
+    document_frequency = (matrix > 0).sum(axis=0)
+    return _normalize_rows(matrix * (np.log((1 + len(documents)) / (1 + document_frequency)) + 1.0))
+
+
+class _TfidfIndex:
+    """TF-IDF fitted on the source columns; other texts are projected into its vocabulary."""
+
+    def __init__(self, documents: List[str]):
+        self.vocabulary: Dict[str, int] = {}
+        matrix, _ = _term_frequencies(documents, self.vocabulary, grow=True)
+        self.idf = np.log((1 + len(documents)) / (1 + (matrix > 0).sum(axis=0))) + 1.0
+        # Weight of a gram no source column has; it still counts towards a target's norm
+        self.unseen_idf = math.log(1 + len(documents)) + 1.0
+        self.vectors = _normalize_rows(matrix * self.idf)
+
+    def transform(self, documents: List[str]) -> np.ndarray:
+        matrix, unseen = _term_frequencies(documents, self.vocabulary, grow=False)
+        return _normalize_rows(matrix * self.idf, unseen * self.unseen_idf ** 2)
+
+
+def _source_keys(column: str) -> set:
+    """Exact-match keys of a source column: full name, code in parentheses, name before the parentheses."""
+    keys = {_normalize(column)}
+    code = _CODE_IN_PARENS.search(column)
+    if code:
+        keys.add(code.group(1).lower())
+        keys.add(_normalize(_CODE_IN_PARENS.sub("", column)))
+    return {k for k in keys if k}
+
+
+def _target_keys(mapping: Dict[str, Any]) -> set:
+    keys = {_normalize(mapping.get("Standard_ColumnName") or ""), _normalize(mapping.get("备注") or "")}
+    return {k for k in keys if k}
+
+
+class CandidateMatcher:
+    """Scores every source column of ``source_data`` against target columns."""
+
+    def __init__(self, source_data: Dict[str, Any], parent: Optional["CandidateMatcher"] = None):
+        self.source_data = source_data
+        self.columns: List[Tuple[str, str]] = [
+            (sheet_name, col.get("name", ""))
+            for sheet_name, sheet_info in source_data.get("sheets", {}).items()
+            for col in sheet_info.get("columns", [])
+        ]
+        if parent is None:
+            self._index = _TfidfIndex([expand_terms(column) for _, column in self.columns])
+            self._sources = self._index.vectors
+            self._source_keys = [_source_keys(column) for _, column in self.columns]
+        else:
+            rows = {column: row for row, column in enumerate(parent.columns)}
+            rows = [rows[column] for column in self.columns]
+            self._index = parent._index
+            self._sources = parent._sources[rows]
+            self._source_keys = [parent._source_keys[row] for row in rows]
+
+    def subset(self, source_data: Dict[str, Any]) -> "CandidateMatcher":
+        """Matcher of ``source_data``, a sheet selection of this one's, reusing its vectors."""
+        if source_data is self.source_data:
+            return self
+        return CandidateMatcher(source_data, parent=self)
+
+    def _scores(self, sheet_mappings_dict: Dict[str, Dict[str, Any]]):
+        """Targets, their cosine scores against every source column, and their exact-match column indices."""
+        targets = list(sheet_mappings_dict.items())
+        target_texts = [
+            expand_terms(f"{mapping.get('Standard_ColumnName') or ''} {mapping.get('备注') or ''}")
+            for _, mapping in targets
+        ]
+        target_vectors = self._index.transform(target_texts)
+        exact = []
+        for _, mapping in targets:
+            keys = _target_keys(mapping)
+            exact.append([i for i, source_keys in enumerate(self._source_keys) if keys & source_keys])
+        return targets, target_vectors @ self._sources.T, exact
+
+    def match(self, sheet_mappings_dict: Dict[str, Dict[str, Any]], top_k: int = CANDIDATE_TOP_K
+              ) -> Dict[str, List[Candidate]]:
+        """Top-k candidates per ``Standard_ColumnName``, best first (exact name/code matches first)."""
+        if not self.columns or not sheet_mappings_dict:
+            return {col: [] for col in sheet_mappings_dict}
+        targets, scores, exact_matches = self._scores(sheet_mappings_dict)
+
+        result = {}
+        for row, (std_col, _) in enumerate(targets):
+            exact = exact_matches[row]
+            order = np.argsort(-scores[row])[:max(top_k, 1)]
+            ranked = exact + [int(i) for i in order if int(i) not in exact]
+            result[std_col] = [
+                Candidate(self.columns[i][0], self.columns[i][1], round(float(scores[row, i]), 4), i in exact)
+                for i in ranked[:max(top_k, len(exact))]
+            ]
+        return result
+
+    def sheet_scores(self, sheet_mappings_dict: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        """Best score per source sheet for every ``Standard_ColumnName`` (1.0 for an exact name/code match)."""
+        if not self.columns or not sheet_mappings_dict:
+            return {col: {} for col in sheet_mappings_dict}
+        targets, scores, exact_matches = self._scores(sheet_mappings_dict)
+        by_sheet: Dict[str, List[int]] = {}
+        for i, (sheet_name, _) in enumerate(self.columns):
+            by_sheet.setdefault(sheet_name, []).append(i)
+
+        result = {}
+        for row, (std_col, _) in enumerate(targets):
+            best = {sheet_name: float(scores[row, indexes].max()) for sheet_name, indexes in by_sheet.items()}
+            for i in exact_matches[row]:
+                best[self.columns[i][0]] = 1.0
+            result[std_col] = best
+        return result
+
+    def resolve(self, sheet_name: str, sheet_mappings_dict: Dict[str, Dict[str, Any]],
+                candidates: Dict[str, List[Candidate]]) -> List[Dict[str, Any]]:
+        """Mappings for targets with an unambiguous near-exact source column."""
+        resolved = []
+        for std_col, mapping in sheet_mappings_dict.items():
+            choice = _unambiguous(sheet_name, candidates.get(std_col, []))
+            if choice is None:
+                continue
+            best, how = choice
+            if how == "exact":
+                confidence = EXACT_CONFIDENCE
+                rationale = f"列名/编码与标准列完全一致 ({best.column})，词法直接匹配，未调用LLM"
+            else:
+                confidence = LEXICAL_CONFIDENCE
+                rationale = f"词法高度相似 (score {best.score:.2f})，明显优于其他候选，未调用LLM"
+            resolved.append({
+                "Source_ColumnName": best.column,
+                "Source_SheetName": best.sheet,
+                "Standard_ColumnName": std_col,
+                "Standard_SheetName": mapping.get("Standard_SheetName", sheet_name),
+                "信息类型": mapping.get("信息类型", ""),
+                "备注": mapping.get("备注", ""),
+                "Confidence": confidence,
+                "Rationale": rationale,
+                "Provenance": {"source": "lexical", "match": how, "score": best.score}
+            })
+        return resolved
+
+    def restrict(self, candidates: Dict[str, List[Candidate]], std_cols, min_columns: int = CANDIDATE_MIN_COLUMNS
+                 ) -> Dict[str, Any]:
+        """``source_data`` limited to the candidates of ``std_cols`` (unchanged if it is small already)."""
+        if len(self.columns) <= min_columns:
+            return self.source_data
+        keep = {(c.sheet, c.column) for col in std_cols for c in candidates.get(col, [])}
+        sheets = {}
+        for sheet_name, sheet_info in self.source_data.get("sheets", {}).items():
+            columns = [c for c in sheet_info.get("columns", []) if (sheet_name, c.get("name", "")) in keep]
+            if columns:
+                sheets[sheet_name] = dict(sheet_info, columns=columns)
+        if not sheets:
+            return self.source_data
+        return {"description": self.source_data.get("description", ""), "sheets": sheets}
+
+
+def _unambiguous(sheet_name: str, candidates: List[Candidate]) -> Optional[Tuple[Candidate, str]]:
+    exact = [c for c in candidates if c.exact]
+    if len(exact) > 1:
+        # The same column in several sheets: prefer the sheet named like the standard sheet
+        same_sheet = [c for c in exact if c.sheet.lower() == sheet_name.lower()]
+        exact = same_sheet if len(same_sheet) == 1 else []
+    if len(exact) == 1:
+        return exact[0], "exact"
+    if exact or not candidates:
+        return None
+    best = candidates[0]
+    runner_up = candidates[1].score if len(candidates) > 1 else 0.0
+    if best.score >= AUTO_RESOLVE_SCORE and best.score - runner_up >= AUTO_RESOLVE_MARGIN:
+        return best, "lexical"
+    return None
@@ -0,0 +1,157 @@
+"""
+列画像 (column profiling)
+
+Accumulates per-column statistics while a sheet is being streamed in, one batch
+at a time, using vectorized pandas operations: row count, null ratio, distinct
+count, top-k values, an inferred type (date/time/numeric/code/text) and min/max.
+The result is persisted as ``ColumnProfile`` rows so readers never have to scan
+``DatasetRow`` to learn what a column looks like.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+TOP_K = 20
+# Distinct values tracked per column; beyond this only already-seen values are counted,
+# so distinct_count becomes a lower bound but memory stays bounded on ID-like columns.
+MAX_TRACKED_DISTINCT = 20000
+# Share of non-empty values that must match a pattern for the column to get that type
+TYPE_THRESHOLD = 0.9
+
+DATE_PATTERN = r"^\d{4}[-/.年]\d{1,2}[-/.月]\d{1,2}日?(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$"
+TIME_PATTERN = r"^\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?$"
+CODE_PATTERN = r"^[A-Za-z0-9][A-Za-z0-9_\-./]{0,19}$"
+# Low-cardinality columns with short values are treated as coded lists (e.g. 是/否, Y/N, 1/2)
+CODE_MAX_DISTINCT = 30
+CODE_MAX_AVG_LENGTH = 12
+
+
+class _ColumnStats:
+    __slots__ = (
+        "non_empty", "values", "overflow", "numeric", "num_min", "num_max",
+        "dates", "times", "codes", "text_min", "text_max", "total_length",
+    )
+
+    def __init__(self):
+        self.non_empty = 0
+        self.values: Counter = Counter()
+        self.overflow = False
+        self.numeric = 0
+        self.num_min: Optional[float] = None
+        self.num_max: Optional[float] = None
+        self.dates = 0
+        self.times = 0
+        self.codes = 0
+        self.text_min: Optional[str] = None
+        self.text_max: Optional[str] = None
+        self.total_length = 0
+
+
+class ColumnProfiler:
+    """Streaming profiler for one sheet; feed it the same batches that get inserted."""
+
+    def __init__(self, columns: List[str], top_k: int = TOP_K, max_tracked_distinct: int = MAX_TRACKED_DISTINCT):
+        self.columns = list(columns)
+        self.top_k = top_k
+        self.max_tracked_distinct = max_tracked_distinct
+        self.row_count = 0
+        self._stats = [_ColumnStats() for _ in self.columns]
+
+    def update(self, batch: List[List[Any]]) -> None:
+        if not batch or not self.columns:
+            return
+        self.row_count += len(batch)
+        frame = pd.DataFrame(batch, columns=range(len(self.columns)), dtype=object)
+
+        for position, stats in enumerate(self._stats):
+            series = frame[position].dropna()
+            if series.empty:
+                continue
+            text = series.astype(str).str.strip()
+            text = text[text != ""]
+            if text.empty:
+                continue
+
+            stats.non_empty += len(text)
+            stats.total_length += int(text.str.len().sum())
+            self._merge_counts(stats, text.value_counts())
+
+            numeric = pd.to_numeric(text, errors="coerce").dropna()
+            if not numeric.empty:
+                stats.numeric += len(numeric)
+                low, high = float(numeric.min()), float(numeric.max())
+                stats.num_min = low if stats.num_min is None else min(stats.num_min, low)
+                stats.num_max = high if stats.num_max is None else max(stats.num_max, high)
+
+            stats.dates += int(text.str.match(DATE_PATTERN).sum())
+            stats.times += int(text.str.match(TIME_PATTERN).sum())
+            stats.codes += int(text.str.match(CODE_PATTERN).sum())
+
+            low, high = text.min(), text.max()
+            stats.text_min = low if stats.text_min is None else min(stats.text_min, low)
+            stats.text_max = high if stats.text_max is None else max(stats.text_max, high)
+
+    def _merge_counts(self, stats: _ColumnStats, counts: pd.Series) -> None:
+        values = stats.values
+        room = self.max_tracked_distinct - len(values)
+        for value, count in counts.items():
+            if value in values:
+                values[value] += int(count)
+            elif room > 0:
+                values[value] = int(count)
+                room -= 1
+            else:
+                stats.overflow = True
+
+    @staticmethod
+    def _infer_type(stats: _ColumnStats) -> str:
+        if stats.non_empty == 0:
+            return "empty"
+        threshold = stats.non_empty * TYPE_THRESHOLD
+        if stats.dates >= threshold:
+            return "date"
+        if stats.times >= threshold:
+            return "time"
+        distinct = len(stats.values)
+        avg_length = stats.total_length / stats.non_empty
+        if not stats.overflow and distinct <= CODE_MAX_DISTINCT and avg_length <= CODE_MAX_AVG_LENGTH \
+                and stats.non_empty > distinct:
+            return "code"
+        if stats.numeric >= threshold:
+            return "numeric"
+        if stats.codes >= threshold:
+            return "code"
+        return "text"
+
+    def distinct_values(self, position: int) -> Counter:
+        """Tracked ``{value: count}`` for a column (used by the search indexer)."""
+        return self._stats[position].values
+
+    def results(self) -> List[Dict[str, Any]]:
+        """One dict per column, shaped like ``models.ColumnProfile``."""
+        profiles = []
+        for position, (name, stats) in enumerate(zip(self.columns, self._stats)):
+            inferred = self._infer_type(stats)
+            if inferred == "numeric":
+                min_value, max_value = stats.num_min, stats.num_max
+                min_value = None if min_value is None else f"{min_value:g}"
+                max_value = None if max_value is None else f"{max_value:g}"
+            else:
+                min_value, max_value = stats.text_min, stats.text_max
+            nulls = self.row_count - stats.non_empty
+            profiles.append({
+                "column_name": name,
+                "position": position,
+                "row_count": self.row_count,
+                "null_count": nulls,
+                "null_ratio": round(nulls / self.row_count, 4) if self.row_count else 0.0,
+                "distinct_count": len(stats.values),
+                "top_values": [
+                    {"value": value, "count": count} for value, count in stats.values.most_common(self.top_k)
+                ],
+                "inferred_type": inferred,
+                "min_value": None if min_value is None else str(min_value)[:255],
+                "max_value": None if max_value is None else str(max_value)[:255],
+            })
+        return profiles
@@ -0,0 +1,847 @@
+"""
+映射生成任务
+
+AI mapping generation runs as a persisted job on a background event-loop thread
+instead of inside the HTTP request, so a browser disconnect no longer kills it
+and an open stream holds neither an API worker thread nor a DB connection.
+
+* ``generation_jobs`` holds the job, one ``generation_job_groups`` row per
+  standard sheet (pending / done / failed) and a numbered event log
+  (``generation_job_events``).
+* Jobs are queued per user and dispatched round-robin, user with the fewest
+  running jobs first, at most ``GENERATION_MAX_JOBS`` at a time. Queued and
+  running jobs can be cancelled.
+* Identical requests are coalesced (single-flight): a submit whose dataset,
+  framework, their content versions and ``use_cache`` match a job queued or
+  running in this process attaches to that job instead of starting a second
+  LLM run, and every subscriber follows the same event log.
+* SSE events carry ``id: <job_id>:<seq>``; a client reconnecting with
+  ``Last-Event-ID`` gets the events after ``seq`` replayed, then follows live.
+  Live subscribers are woken with ``call_soon_threadsafe`` instead of polling.
+* With a fast tier configured (``LLM_FAST_MODEL``) low-confidence columns are
+  escalated to the strong model; calls, latency and tokens per tier are kept
+  in ``llm_usage`` and reported with the job.
+* A batch (``submit_batch``) is one job per (dataset, framework) pair, queued
+  and scheduled as a single unit: its jobs run together and their sheet groups
+  share one pool of ``GENERATION_BATCH_CONCURRENCY`` slots (by default what a
+  single job gets), source summaries and target schemas are built once per
+  dataset/framework, and ``get_batch`` reports aggregate progress and
+  throughput. For fair scheduling every unfinished job of a running batch
+  counts against its user.
+* A run always generates "target columns without a saved entry", so the same
+  code resumes jobs interrupted by a restart (``recover``) and re-generates the
+  groups that came back as failed placeholders (``retry_failed``).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .. import models
+from ..database import SessionLocal
+from . import mapping_generation_service, process_mappings_with_llm
+from .llm_factory import get_default_llm, get_fast_llm
+from .mapping_history import mapping_history, remove_resolved
+
+logger = logging.getLogger(__name__)
+
+# Generation jobs running at the same time (their LLM calls share the rate limiter)
+GENERATION_MAX_JOBS = int(os.getenv("GENERATION_MAX_JOBS", "4"))
+# Sheet groups of one batch waiting on the LLM at the same time, across all of its pairs;
+# a batch takes one job slot, so by default it gets one job's share of the rate limiter
+GENERATION_BATCH_CONCURRENCY = int(os.getenv(
+    "GENERATION_BATCH_CONCURRENCY", str(process_mappings_with_llm.SHEET_GROUP_CONCURRENCY)
+))
+# How often a subscriber re-checks a job that another process is running
+EVENT_POLL_SECONDS = 1.0
+# Finished jobs whose events are kept in memory (older ones are replayed from the database)
+MAX_LIVE_JOBS = 200
+ACTIVE_STATUSES = ("queued", "running")
+ANONYMOUS = "anonymous"
+
+
+def format_event_id(job_id: str, seq: int) -> str:
+    return f"{job_id}:{seq}"
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+    """``(job_id, seq)`` from a ``Last-Event-ID`` header, ``None`` if absent or malformed."""
+    if not event_id or ":" not in event_id:
+        return None
+    job_id, _, seq = event_id.strip().rpartition(":")
+    if not job_id or not seq.isdigit():
+        return None
+    return job_id, int(seq)
+
+
+def flight_key(db, dataset: models.Dataset, framework: models.Framework, use_cache: bool) -> str:
+    """Single-flight key: the pair plus the content versions of both sides (re-imports change it)."""
+    sheets = db.query(models.DatasetSheet.name, models.DatasetSheet.content_hash).filter(
+        models.DatasetSheet.dataset_id == dataset.id
+    ).order_by(models.DatasetSheet.name).all()
+    fingerprint = [
+        dataset.id, dataset.content_hash, [list(sheet) for sheet in sheets],
+        framework.id, framework.version, framework.content_hash, bool(use_cache),
+    ]
+    return hashlib.sha256(json.dumps(fingerprint, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _LiveJob:
+    """Events of a job emitted by this process; ``base_seq`` is the last seq persisted before it.
+
+    Once the job finishes its events are dropped and ``base_seq`` moves to its
+    last event, so only running jobs keep their events in memory.
+    """
+
+    def __init__(self, base_seq: int, user: str):
+        self.base_seq = base_seq
+        self.user = user
+        self.events: List[Tuple[int, Dict[str, Any]]] = []
+        self.finished = False
+        self.touched = time.time()
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def notify(self) -> None:
+        for loop, event in self.waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+class GenerationJobManager:
+    def __init__(self, max_jobs: int = GENERATION_MAX_JOBS):
+        self.max_jobs = max(1, max_jobs)
+        self._lock = threading.Lock()
+        # Serializes submit's "find in-flight job, else create one"
+        self._submit_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._live: Dict[str, _LiveJob] = {}
+        self._seq: Dict[str, int] = {}
+        # user -> queued (job_ids, retry_failed, batch_id), in submission order per user; a batch is one entry
+        self._queues: "OrderedDict[str, Deque[Tuple[Tuple[str, ...], bool, Optional[str]]]]" = OrderedDict()
+        # job_id (or batch_id) -> running task, and who submitted it
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._task_users: Dict[str, str] = {}
+        # batch_id -> its job ids, while the batch is running
+        self._batch_jobs: Dict[str, Tuple[str, ...]] = {}
+        # job_id -> task of a job running inside a batch
+        self._batch_job_tasks: Dict[str, asyncio.Task] = {}
+        # user -> dispatch counter value when the user last got a job started (round-robin)
+        self._served: Dict[str, int] = {}
+        self._dispatched = 0
+        self._coalesced = 0
+        # job_id -> open follow() iterators (SSE subscribers)
+        self._followers: Dict[str, int] = {}
+
+    # --- scheduling ---
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="mapping-generation", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _enqueue(self, job_id: str, last_seq: int, user: str, retry_failed: bool = False) -> None:
+        self._enqueue_run([(job_id, last_seq)], user, retry_failed)
+
+    def _enqueue_run(self, jobs: List[Tuple[str, int]], user: str, retry_failed: bool = False,
+                     batch_id: Optional[str] = None) -> None:
+        """Queue ``(job_id, last_seq)`` pairs as one scheduling unit (a single job, or a batch)."""
+        with self._lock:
+            job_ids = []
+            for job_id, last_seq in jobs:
+                live = self._live.get(job_id)
+                if live is not None and not live.finished:
+                    continue  # already queued or running in this process
+                if live is None:
+                    self._live[job_id] = _LiveJob(last_seq, user)
+                else:
+                    live.finished, live.base_seq = False, last_seq
+                self._seq[job_id] = last_seq
+                job_ids.append(job_id)
+            if not job_ids:
+                return
+            self._queues.setdefault(user, deque()).append((tuple(job_ids), retry_failed, batch_id))
+            self._prune()
+        self._ensure_loop().call_soon_threadsafe(self._dispatch)
+
+    def _unqueue(self, job_ids: set) -> set:
+        """Remove queued jobs (also from queued batches); returns the ones that were queued."""
+        removed = set()
+        for user, queue in list(self._queues.items()):
+            for entry in list(queue):
+                hit = job_ids.intersection(entry[0])
+                if not hit:
+                    continue
+                removed |= hit
+                rest = tuple(j for j in entry[0] if j not in hit)
+                if rest:
+                    queue[queue.index(entry)] = (rest,) + entry[1:]
+                else:
+                    queue.remove(entry)
+            if not queue:
+                del self._queues[user]
+        return removed
+
+    def _running_by_user(self) -> Dict[str, int]:
+        """Running jobs per user; a running batch counts each of its unfinished jobs."""
+        counts: Dict[str, int] = {}
+        for key, user in self._task_users.items():
+            jobs = self._batch_jobs.get(key)
+            running = 1 if jobs is None else sum(
+                1 for job_id in jobs if job_id in self._live and not self._live[job_id].finished
+            )
+            counts[user] = counts.get(user, 0) + max(1, running)
+        return counts
+
+    def _dispatch(self) -> None:
+        """Start queued jobs while slots are free (runs on the generation loop)."""
+        while True:
+            with self._lock:
+                if len(self._tasks) >= self.max_jobs or not self._queues:
+                    return
+                # Fair share: the user with the fewest running jobs, then the one served longest ago
+                running = self._running_by_user()
+                user = min(self._queues, key=lambda u: (running.get(u, 0), self._served.get(u, 0)))
+                job_ids, retry_failed, batch_id = self._queues[user].popleft()
+                if not self._queues[user]:
+                    del self._queues[user]
+                self._dispatched += 1
+                self._served[user] = self._dispatched
+                if batch_id is None:
+                    key, run = job_ids[0], self._run(job_ids[0], retry_failed)
+                else:
+                    key, run = batch_id, self._run_batch(batch_id, job_ids)
+                    self._batch_jobs[batch_id] = job_ids
+                task = self._loop.create_task(run)
+                self._tasks[key] = task
+                self._task_users[key] = user
+            task.add_done_callback(lambda _t, key=key: self._finished(key))
+
+    def _finished(self, key: str) -> None:
+        with self._lock:
+            self._tasks.pop(key, None)
+            self._task_users.pop(key, None)
+            self._batch_jobs.pop(key, None)
+        self._dispatch()
+
+    def _prune(self) -> None:
+        finished = sorted((k for k, v in self._live.items() if v.finished), key=lambda k: self._live[k].touched)
+        for job_id in finished[:max(0, len(finished) - MAX_LIVE_JOBS)]:
+            del self._live[job_id]
+            self._seq.pop(job_id, None)
+
+    def submit(self, dataset_id: int, framework_id: int, use_cache: bool = True,
+               user: Optional[str] = None) -> Optional[str]:
+        """Create a job (and its draft Mapping) and queue it; ``None`` if the dataset or framework is missing.
+
+        If an identical job (same ``flight_key``) is queued or running, its id is
+        returned instead and the caller subscribes to that job's events.
+        """
+        user = user or ANONYMOUS
+        with self._submit_lock, SessionLocal() as db:
+            dataset = db.get(models.Dataset, dataset_id)
+            framework = db.get(models.Framework, framework_id)
+            if dataset is None or framework is None:
+                return None
+            key = flight_key(db, dataset, framework, use_cache)
+            candidates = db.query(models.GenerationJob.id).filter(
+                models.GenerationJob.flight_key == key,
+                models.GenerationJob.status.in_(ACTIVE_STATUSES),
+            ).order_by(models.GenerationJob.created_at).all()
+            with self._lock:
+                # Only jobs this process is still running; a row merely marked active may never finish
+                in_flight = next((
+                    job_id for job_id, in candidates
+                    if job_id in self._live and not self._live[job_id].finished
+                ), None)
+                if in_flight is not None:
+                    self._coalesced += 1
+            if in_flight is not None:
+                logger.info("Generation request by %s attached to in-flight job %s", user, in_flight)
+                return in_flight
+            mapping = mapping_generation_service.create_draft_mapping(db, dataset_id, framework_id)
+            job = models.GenerationJob(
+                id=uuid.uuid4().hex, mapping_id=mapping.id, dataset_id=dataset_id, framework_id=framework_id,
+                requested_by=user, use_cache=use_cache, flight_key=key, status="queued", last_seq=0,
+            )
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        self._enqueue(job_id, 0, user)
+        return job_id
+
+    def retry_failed(self, job_id: str) -> bool:
+        """Re-run the LLM for the groups that came back as placeholders; ``False`` if there are none."""
+        with SessionLocal() as db:
+            job = db.get(models.GenerationJob, job_id)
+            if job is None or job.status in ACTIVE_STATUSES:
+                return False
+            if not any(g.status == "failed" for g in job.groups):
+                return False
+            job.status = "queued"
+            db.commit()
+            last_seq, user = job.last_seq or 0, job.requested_by or ANONYMOUS
+        self._enqueue(job_id, last_seq, user, retry_failed=True)
+        return True
+
+    def submit_batch(self, pairs: List[Tuple[int, int]], use_cache: bool = True,
+                     user: Optional[str] = None) -> Tuple[Optional[str], List[Tuple[int, int]]]:
+        """Create a batch with one job per distinct pair and queue it as one unit.
+
+        Returns ``(batch_id, [])``, or ``(None, missing pairs)`` if a dataset or
+        framework does not exist. Batch jobs are not coalesced with in-flight
+        jobs, but later identical requests can attach to them.
+        """
+        user = user or ANONYMOUS
+        pairs = list(OrderedDict.fromkeys(pairs))
+        with self._submit_lock, SessionLocal() as db:
+            datasets = {d.id: d for d in db.query(models.Dataset).filter(
+                models.Dataset.id.in_({d for d, _ in pairs})).all()}
+            frameworks = {f.id: f for f in db.query(models.Framework).filter(
+                models.Framework.id.in_({f for _, f in pairs})).all()}
+            missing = [(d, f) for d, f in pairs if d not in datasets or f not in frameworks]
+            if missing:
+                return None, missing
+            batch = models.GenerationBatch(id=uuid.uuid4().hex, requested_by=user, use_cache=use_cache)
+            db.add(batch)
+            job_ids = []
+            for dataset_id, framework_id in pairs:
+                mapping = mapping_generation_service.create_draft_mapping(db, dataset_id, framework_id)
+                job = models.GenerationJob(
+                    id=uuid.uuid4().hex, batch_id=batch.id, mapping_id=mapping.id,
+                    dataset_id=dataset_id, framework_id=framework_id, requested_by=user, use_cache=use_cache,
+                    flight_key=flight_key(db, datasets[dataset_id], frameworks[framework_id], use_cache),
+                    status="queued", last_seq=0,
+                )
+                db.add(job)
+                job_ids.append(job.id)
+            db.commit()
+            batch_id = batch.id
+        self._enqueue_run([(job_id, 0) for job_id in job_ids], user, batch_id=batch_id)
+        return batch_id, []
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; ``False`` if it is not active in this process."""
+        with self._lock:
+            task = self._tasks.get(job_id) or self._batch_job_tasks.get(job_id)
+            live = self._live.get(job_id)
+            queued = bool(self._unqueue({job_id}))
+        if task is not None:
+            # _run records the cancellation itself
+            self._loop.call_soon_threadsafe(task.cancel)
+            return True
+        if queued or (live is not None and not live.finished):
+            self._persist(job_id, [{"type": "cancelled", "job_id": job_id}],
+                          status="cancelled", finished_at=datetime.utcnow())
+            return True
+        return False
+
+    def cancel_batch(self, batch_id: str) -> int:
+        """Cancel the queued and running jobs of a batch; returns how many were active."""
+        with SessionLocal() as db:
+            job_ids = [job_id for job_id, in db.query(models.GenerationJob.id).filter(
+                models.GenerationJob.batch_id == batch_id,
+                models.GenerationJob.status.in_(ACTIVE_STATUSES),
+            ).all()]
+        return sum(1 for job_id in job_ids if self.cancel(job_id))
+
+    def recover(self) -> int:
+        """Re-queue the jobs a previous process left queued or running; returns how many."""
+        with SessionLocal() as db:
+            jobs = db.query(
+                models.GenerationJob.id, models.GenerationJob.last_seq, models.GenerationJob.requested_by,
+                models.GenerationJob.batch_id,
+            ).filter(models.GenerationJob.status.in_(ACTIVE_STATUSES)).order_by(models.GenerationJob.created_at).all()
+        batches: "OrderedDict[str, List[Tuple[str, int]]]" = OrderedDict()
+        for job_id, last_seq, user, batch_id in jobs:
+            logger.info("Resuming generation job %s", job_id)
+            if batch_id is None:
+                self._enqueue(job_id, last_seq or 0, user or ANONYMOUS)
+            else:
+                batches.setdefault(batch_id, []).append((job_id, last_seq or 0))
+        users = {job_id: user for job_id, _, user, _ in jobs}
+        for batch_id, batch_jobs in batches.items():
+            self._enqueue_run(batch_jobs, users[batch_jobs[0][0]] or ANONYMOUS, batch_id=batch_id)
+        return len(jobs)
+
+    # --- queries ---
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with SessionLocal() as db:
+            job = db.get(models.GenerationJob, job_id)
+            return self._snapshot(job) if job is not None else None
+
+    def list(self, user: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        with SessionLocal() as db:
+            query = db.query(models.GenerationJob)
+            if user:
+                query = query.filter(models.GenerationJob.requested_by == user)
+            jobs = query.order_by(models.GenerationJob.created_at.desc()).limit(limit).all()
+            return [self._snapshot(job) for job in jobs]
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Aggregate progress, throughput and LLM usage of a batch, with its jobs."""
+        with SessionLocal() as db:
+            batch = db.get(models.GenerationBatch, batch_id)
+            if batch is None:
+                return None
+            jobs = [self._snapshot(job) for job in db.query(models.GenerationJob).filter(
+                models.GenerationJob.batch_id == batch_id
+            ).order_by(models.GenerationJob.created_at, models.GenerationJob.id).all()]
+            created_at, requested_by = batch.created_at, batch.requested_by
+
+        statuses: Dict[str, int] = {}
+        for job in jobs:
+            statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        if statuses.get("running"):
+            status = "running"
+        elif statuses.get("queued"):
+            status = "queued"
+        elif statuses.get("failed"):
+            status = "failed"
+        elif statuses.get("cancelled"):
+            status = "cancelled"
+        else:
+            status = "succeeded"
+        total = sum(job["total_columns"] for job in jobs)
+        done = sum(job["done_columns"] for job in jobs)
+        failed = sum(job["failed_columns"] for job in jobs)
+        started = [job["started_at"] for job in jobs if job["started_at"]]
+        finished = [job["finished_at"] for job in jobs if job["finished_at"]]
+        started_at = min(started) if started else None
+        finished_at = max(finished) if status not in ACTIVE_STATUSES and finished else None
+        elapsed = ((finished_at or datetime.utcnow()) - started_at).total_seconds() if started_at else None
+        return {
+            "id": batch_id,
+            "requested_by": requested_by,
+            "status": status,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "total_jobs": len(jobs),
+            "jobs_by_status": statuses,
+            "total_columns": total,
+            "done_columns": done,
+            "failed_columns": failed,
+            "progress": round((done + failed) / total, 4) if total else None,
+            "elapsed_seconds": round(elapsed, 1) if elapsed is not None else None,
+            "columns_per_minute": round((done + failed) * 60 / elapsed, 1) if elapsed else None,
+            "llm_usage": _merge_usage(job["llm_usage"] for job in jobs),
+            "jobs": jobs,
+        }
+
+    def _snapshot(self, job: models.GenerationJob) -> Dict[str, Any]:
+        groups = sorted(job.groups, key=lambda g: g.id)
+        total = sum(g.total_columns or 0 for g in groups)
+        done = sum(g.done_columns or 0 for g in groups)
+        failed = sum(g.failed_columns or 0 for g in groups)
+        return {
+            "id": job.id,
+            "mapping_id": job.mapping_id,
+            "dataset_id": job.dataset_id,
+            "framework_id": job.framework_id,
+            "requested_by": job.requested_by,
+            "batch_id": job.batch_id,
+            "subscribers": self._followers.get(job.id, 0),
+            "llm_usage": job.llm_usage,
+            "status": job.status,
+            "error": job.error,
+            "last_event_id": format_event_id(job.id, job.last_seq or 0),
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "total_columns": total,
+            "done_columns": done,
+            "failed_columns": failed,
+            "progress": round((done + failed) / total, 4) if total else None,
+            "groups": [
+                {
+                    "sheet_name": g.sheet_name,
+                    "status": g.status,
+                    "total_columns": g.total_columns,
+                    "done_columns": g.done_columns,
+                    "failed_columns": g.failed_columns,
+                    "attempts": g.attempts,
+                }
+                for g in groups
+            ],
+        }
+
+    def queue_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = self._running_by_user()
+            queued = {user: sum(len(entry[0]) for entry in queue) for user, queue in self._queues.items()}
+            return {
+                "max_jobs": self.max_jobs,
+                "running": len(self._tasks),
+                "running_batch_jobs": len(self._batch_job_tasks),
+                "queued": sum(queued.values()),
+                # Submits that attached to an identical in-flight job instead of starting one
+                "coalesced": self._coalesced,
+                "subscribers": sum(self._followers.values()),
+                "users": {
+                    user: {"running": running.get(user, 0), "queued": queued.get(user, 0)}
+                    for user in sorted(set(running) | set(queued))
+                },
+            }
+
+    def _stored_events(self, job_id: str, after_seq: int, up_to: Optional[int]) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        """Events from the database, and whether the job has finished (for jobs not live here)."""
+        with SessionLocal() as db:
+            query = db.query(models.GenerationJobEvent.seq, models.GenerationJobEvent.payload).filter(
+                models.GenerationJobEvent.job_id == job_id, models.GenerationJobEvent.seq > after_seq
+            )
+            if up_to is not None:
+                query = query.filter(models.GenerationJobEvent.seq <= up_to)
+            events = [(seq, payload) for seq, payload in query.order_by(models.GenerationJobEvent.seq).all()]
+            job = db.get(models.GenerationJob, job_id)
+            return events, job is None or job.status not in ACTIVE_STATUSES
+
+    async def follow(self, job_id: str, after_seq: int = 0):
+        """Async iterator of ``(seq, payload)`` from ``after_seq`` on; ends when the job finishes."""
+        with self._lock:
+            self._followers[job_id] = self._followers.get(job_id, 0) + 1
+        try:
+            async for item in self._follow(job_id, after_seq):
+                yield item
+        finally:
+            with self._lock:
+                self._followers[job_id] -= 1
+                if not self._followers[job_id]:
+                    del self._followers[job_id]
+
+    async def _follow(self, job_id: str, after_seq: int):
+        while True:
+            with self._lock:
+                live = self._live.get(job_id)
+                if live is not None:
+                    live.touched = time.time()
+            if live is None or after_seq < live.base_seq:
+                # Replay from the database: older events, or a job this process is not running
+                events, finished = await asyncio.to_thread(
+                    self._stored_events, job_id, after_seq, live.base_seq if live else None
+                )
+                for seq, payload in events:
+                    after_seq = seq
+                    yield seq, payload
+                if live is None:
+                    if finished:
+                        return
+                    await asyncio.sleep(EVENT_POLL_SECONDS)
+                else:
+                    after_seq = max(after_seq, live.base_seq)
+                continue
+
+            event = asyncio.Event()
+            with self._lock:
+                if after_seq < live.base_seq:
+                    continue  # the job finished meanwhile and its events are only in the database now
+                events = [e for e in live.events if e[0] > after_seq]
+                finished = live.finished
+                if not events and not finished:
+                    live.waiters.append((asyncio.get_running_loop(), event))
+            for seq, payload in events:
+                after_seq = seq
+                yield seq, payload
+            if events:
+                continue
+            if finished:
+                return
+            try:
+                await event.wait()
+            finally:
+                with self._lock:
+                    live.waiters = [w for w in live.waiters if w[1] is not event]
+
+    # --- running ---
+
+    def _persist(self, job_id: str, payloads: List[Dict[str, Any]], groups: Dict[str, Dict[str, Any]] = None,
+                 **job_changes) -> List[Tuple[int, Dict[str, Any]]]:
+        """Append events and store group/job changes in one transaction."""
+        with self._lock:
+            events = []
+            for payload in payloads:
+                self._seq[job_id] += 1
+                events.append((self._seq[job_id], payload))
+            last_seq = self._seq[job_id]
+        with SessionLocal() as db:
+            for seq, payload in events:
+                db.add(models.GenerationJobEvent(job_id=job_id, seq=seq, payload=payload))
+            if groups:
+                for row in db.query(models.GenerationJobGroup).filter(
+                    models.GenerationJobGroup.job_id == job_id,
+                    models.GenerationJobGroup.sheet_name.in_(list(groups))
+                ).all():
+                    state = groups[row.sheet_name]
+                    row.status, row.done_columns, row.failed_columns = state["status"], state["done"], state["failed"]
+            db.query(models.GenerationJob).filter(models.GenerationJob.id == job_id).update(
+                dict(job_changes, last_seq=last_seq)
+            )
+            db.commit()
+        with self._lock:
+            live = self._live.get(job_id)
+            if live is not None:
+                live.events.extend(events)
+                if job_changes.get("status") not in (None, *ACTIVE_STATUSES):
+                    # Followers replay a finished job from the database; only its live state stays in memory
+                    live.finished = True
+                    live.base_seq, live.events = last_seq, []
+                live.notify()
+        return events
+
+    async def _emit(self, job_id: str, *payloads: Dict[str, Any], groups=None, **job_changes) -> None:
+        await asyncio.to_thread(self._persist, job_id, list(payloads), groups, **job_changes)
+
+    def _prepare(self, job_id: str, retry_failed: bool,
+                 requests: Optional[mapping_generation_service.RequestDataCache] = None) -> Optional[Dict[str, Any]]:
+        """Mark the job running and work out what is left to generate.
+
+        ``None`` if the dataset or framework is gone, ``False`` if the job was
+        cancelled (or otherwise finished) while this ran.
+        """
+        with SessionLocal() as db:
+            job = db.get(models.GenerationJob, job_id)
+            request_data = mapping_generation_service.load_request_data(
+                db, job.dataset_id, job.framework_id, cache=requests
+            )
+            if request_data is None:
+                return None
+
+            retried = []
+            if retry_failed:
+                retried = [g.sheet_name for g in job.groups if g.status == "failed"]
+                mapping_generation_service.delete_failed_placeholders(db, job.mapping_id, retried)
+
+            saved = mapping_generation_service.saved_columns(db, job.mapping_id)
+            sheet_groups = process_mappings_with_llm.group_target_mappings(request_data["target"])
+            rows = {g.sheet_name: g for g in job.groups}
+            groups = {}
+            for sheet_name, columns in sheet_groups.items():
+                row = rows.get(sheet_name)
+                if row is None:
+                    row = models.GenerationJobGroup(job_id=job_id, sheet_name=sheet_name, total_columns=len(columns))
+                    db.add(row)
+                remaining = {col for col in columns if (sheet_name, col) not in saved}
+                failed = sum(
+                    1 for col in columns
+                    if process_mappings_with_llm.is_failed_placeholder(saved.get((sheet_name, col)))
+                )
+                if remaining:
+                    row.attempts = (row.attempts or 0) + 1
+                groups[sheet_name] = {
+                    "remaining": remaining,
+                    "done": len(columns) - len(remaining) - failed,
+                    "failed": failed,
+                    "status": "pending" if remaining else ("failed" if failed else "done"),
+                }
+                row.status, row.done_columns, row.failed_columns = (
+                    groups[sheet_name]["status"], groups[sheet_name]["done"], failed
+                )
+
+            request_data["target"]["mappings"] = [
+                m for m in request_data["target"]["mappings"]
+                if (m.get("Standard_SheetName", "Unknown"), m.get("Standard_ColumnName")) not in saved
+            ]
+            plan = {
+                "mapping_id": job.mapping_id,
+                "framework_id": job.framework_id,
+                "use_cache": job.use_cache is not False,
+                "first_run": not job.last_seq,
+                "total_sheets": sum(len(columns) for columns in sheet_groups.values()),
+                "request_data": request_data,
+                "groups": groups,
+                "retried": retried,
+                "llm_usage": job.llm_usage,
+            }
+            # Conditional, so a cancellation recorded meanwhile is not overwritten
+            started = db.query(models.GenerationJob).filter(
+                models.GenerationJob.id == job_id,
+                models.GenerationJob.status.in_(ACTIVE_STATUSES),
+            ).update({
+                "status": "running",
+                "error": None,
+                "started_at": job.started_at or datetime.utcnow(),
+                "finished_at": None,
+            }, synchronize_session=False)
+            if not started:
+                db.rollback()
+                return False
+            db.commit()
+            return plan
+
+    async def _save_chunk(self, job_id: str, plan: Dict[str, Any], chunk: List[Dict[str, Any]]) -> None:
+        entries = await asyncio.to_thread(mapping_generation_service.save_generated_chunk, plan["mapping_id"], chunk)
+        changed, finished = {}, []
+        for m in chunk:
+            sheet_name = m.get("Standard_SheetName", "Unknown")
+            group = plan["groups"].get(sheet_name)
+            if group is None or m.get("Standard_ColumnName") not in group["remaining"]:
+                continue
+            group["remaining"].discard(m.get("Standard_ColumnName"))
+            if process_mappings_with_llm.is_failed_placeholder(m.get("Rationale")):
+                group["failed"] += 1
+            else:
+                group["done"] += 1
+            if not group["remaining"]:
+                group["status"] = "failed" if group["failed"] else "done"
+                finished.append(sheet_name)
+            changed[sheet_name] = group
+        group_events = [
+            {
+                "type": "group",
+                "sheet_name": sheet_name,
+                "status": plan["groups"][sheet_name]["status"],
+                "done_columns": plan["groups"][sheet_name]["done"],
+                "failed_columns": plan["groups"][sheet_name]["failed"],
+            }
+            for sheet_name in finished
+        ]
+        await self._emit(job_id, {"type": "data", "entries": entries}, *group_events, groups=changed)
+
+    async def _run_batch(self, batch_id: str, job_ids: Tuple[str, ...]) -> None:
+        """Run a batch's jobs at once; their sheet groups share one semaphore and one request cache.
+
+        The jobs are prepared one at a time, so the first ones are already
+        generating while the later ones load their data.
+        """
+        semaphore = asyncio.Semaphore(max(1, GENERATION_BATCH_CONCURRENCY))
+        prepare_gate = asyncio.Semaphore(1)
+        requests = mapping_generation_service.RequestDataCache()
+        tasks = {
+            job_id: asyncio.ensure_future(self._run(
+                job_id, False, semaphore=semaphore, requests=requests, prepare_gate=prepare_gate
+            ))
+            for job_id in job_ids
+        }
+        with self._lock:
+            self._batch_job_tasks.update(tasks)
+        try:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            print(f"📦 Batch {batch_id}: {len(tasks)} jobs done, {requests.hits} source/target summaries reused")
+        finally:
+            for task in tasks.values():
+                task.cancel()  # only still-running jobs, when the batch itself was cancelled
+            with self._lock:
+                for job_id in tasks:
+                    self._batch_job_tasks.pop(job_id, None)
+
+    async def _run(self, job_id: str, retry_failed: bool, semaphore: Optional[asyncio.Semaphore] = None,
+                   requests: Optional[mapping_generation_service.RequestDataCache] = None,
+                   prepare_gate: Optional[asyncio.Semaphore] = None) -> None:
+        usage = None
+        prepare = None
+        try:
+            if prepare_gate is not None:
+                await prepare_gate.acquire()
+            prepare = asyncio.ensure_future(asyncio.to_thread(self._prepare, job_id, retry_failed, requests))
+            if prepare_gate is not None:
+                prepare.add_done_callback(lambda _f: prepare_gate.release())
+            plan = await asyncio.shield(prepare)
+            if plan is False:
+                logger.info("Generation job %s finished before it started", job_id)
+                with self._lock:
+                    if job_id in self._live:
+                        self._live[job_id].finished = True
+                        self._live[job_id].notify()
+                return
+            if plan is None:
+                await self._emit(job_id, {"type": "error", "message": "Dataset or Framework not found"},
+                                 status="failed", error="Dataset or Framework not found",
+                                 finished_at=datetime.utcnow())
+                return
+
+            request_data = plan["request_data"]
+            if plan["first_run"]:
+                await self._emit(job_id, {
+                    "type": "start",
+                    "job_id": job_id,
+                    "mapping_id": plan["mapping_id"],
+                    "total_sheets": plan["total_sheets"],
+                    "message": "Mapping session started"
+                })
+                # Columns resolved from saved mappings need no LLM call
+                history = await asyncio.to_thread(mapping_history.resolve, plan["framework_id"], request_data)
+                if history:
+                    print(f"📚 Reusing {len(history)} historical mappings, "
+                          f"{len(request_data['target']['mappings']) - len(history)} columns left for the LLM")
+                    request_data = remove_resolved(request_data, history)
+                    await self._save_chunk(job_id, plan, history)
+            elif plan["retried"]:
+                await self._emit(job_id, {"type": "retry", "job_id": job_id, "sheets": plan["retried"]})
+            else:
+                await self._emit(job_id, {
+                    "type": "resume", "job_id": job_id, "remaining_columns": len(request_data["target"]["mappings"])
+                })
+
+            usage = process_mappings_with_llm.LLMUsage(plan["llm_usage"])
+            if request_data["target"]["mappings"]:
+                logger.info("Starting LLM stream for job %s...", job_id)
+                llm = await asyncio.to_thread(get_default_llm)
+                fast_llm = await asyncio.to_thread(get_fast_llm)
+                stream = process_mappings_with_llm.process_request_with_llm_stream(
+                    request_data, fast_llm or llm, use_cache=plan["use_cache"],
+                    strong_llm=llm if fast_llm is not None else None, usage=usage, semaphore=semaphore,
+                )
+                try:
+                    async for chunk in stream:
+                        await self._save_chunk(job_id, plan, chunk)
+                finally:
+                    # On cancellation this stops the batches still waiting on the LLM right away
+                    await stream.aclose()
+
+            failed = sorted(name for name, g in plan["groups"].items() if g["status"] == "failed")
+            llm_usage = usage.summary()
+            for tier, stats in llm_usage.items():
+                print(f"📊 {tier} tier ({stats['model']}): {stats['calls']} calls ({stats['avg_seconds'] or 0}s avg), "
+                      f"{stats['cache_hits']} cache hits, {stats['tokens']} tokens")
+            await self._emit(job_id, {"type": "done", "status": "success", "failed_sheets": failed,
+                                      "llm_usage": llm_usage},
+                             status="succeeded", llm_usage=llm_usage, finished_at=datetime.utcnow())
+        except asyncio.CancelledError:
+            logger.info("Generation job %s cancelled", job_id)
+            if prepare is not None and not prepare.done():
+                # Record the cancellation only after the prepare thread is done with the job row
+                await asyncio.wait({prepare})
+            await self._emit(job_id, {"type": "cancelled", "job_id": job_id}, status="cancelled",
+                             finished_at=datetime.utcnow(), **_usage_changes(usage))
+        except Exception as e:
+            logger.error(f"Generation job {job_id} failed: {e}")
+            try:
+                await self._emit(job_id, {"type": "error", "message": str(e)}, status="failed", error=str(e),
+                                 finished_at=datetime.utcnow(), **_usage_changes(usage))
+            except Exception:
+                logger.exception("Could not record the failure of generation job %s", job_id)
+                with self._lock:
+                    if job_id in self._live:
+                        self._live[job_id].finished = True
+                        self._live[job_id].notify()
+
+
+def _merge_usage(usages) -> Dict[str, Any]:
+    """Sum of several jobs' ``llm_usage`` per tier."""
+    merged = process_mappings_with_llm.LLMUsage()
+    for usage in usages:
+        for tier, stats in (usage or {}).items():
+            total = merged._tier(tier, stats.get("model"))
+            for field in merged.FIELDS:
+                if field == "max_seconds":
+                    total[field] = max(total[field], stats.get(field) or 0)
+                else:
+                    total[field] += stats.get(field) or 0
+    return merged.summary()
+
+
+def _usage_changes(usage: Optional[process_mappings_with_llm.LLMUsage]) -> Dict[str, Any]:
+    """Job columns recording the LLM usage of an interrupted run, if it got that far."""
+    return {"llm_usage": usage.summary()} if usage is not None and usage.tiers else {}
+
+
+generation_jobs = GenerationJobManager()
@@ -0,0 +1,157 @@
+"""
+LLM 对冲请求
+
+Hedged requests against tail latency. When a call has been running longer than
+the ``LLM_HEDGE_PERCENTILE`` latency of its model (tracked over the model's last
+``LATENCY_WINDOW`` successful calls), the same request is sent once more. The
+first response ``accept`` takes wins and the other call is cancelled.
+
+At most ``LLM_HEDGE_MAX_FRACTION`` of all calls are hedged, so a provider that is
+slow across the board does not get twice the load. The timer starts when the
+call is actually sent, not while it waits for the rate limiter, and the hedge
+goes through the limiter like any other call. When the hedge wins, the time the
+cancelled primary had been running is recorded as its (censored) latency, so
+the slow tail stays in the window. Hedging is off unless ``LLM_HEDGE_ENABLED``
+is set.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Upper bound of hedged calls / all calls
+LLM_HEDGE_MAX_FRACTION = float(os.getenv("LLM_HEDGE_MAX_FRACTION", "0.1"))
+# Successful calls of a model needed before its percentile is trusted
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Never hedge calls faster than this (seconds)
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "5"))
+LATENCY_WINDOW = 200
+
+# ``call(sent)`` runs one request and invokes ``sent()`` once it is actually sent
+Call = Callable[[Callable[[], None]], Awaitable[Any]]
+
+
+class HedgePolicy:
+    def __init__(self, enabled: bool = LLM_HEDGE_ENABLED, percentile: float = LLM_HEDGE_PERCENTILE,
+                 max_fraction: float = LLM_HEDGE_MAX_FRACTION, min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 min_delay: float = LLM_HEDGE_MIN_DELAY):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.min_samples = max(1, min_samples)
+        self.min_delay = min_delay
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.capped = 0  # calls past their percentile that were not hedged because of the cap
+
+    def record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def delay(self, model: str) -> Optional[float]:
+        """Seconds after which a call to ``model`` is hedged, ``None`` without enough samples."""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(self.percentile / 100 * len(samples)) - 1))
+        return max(self.min_delay, samples[index])
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.max_fraction * self.calls:
+                self.capped += 1
+                return False
+            self.hedged += 1
+            return True
+
+    def _launch(self, model: str, call: Call):
+        """Start ``call``; returns its task and a future resolved with the time it was sent."""
+        sent = asyncio.get_running_loop().create_future()
+
+        def mark_sent():
+            if not sent.done():
+                sent.set_result(time.monotonic())
+
+        async def timed():
+            result = await call(mark_sent)
+            if sent.done():
+                self.record(model, time.monotonic() - sent.result())
+            return result
+
+        return asyncio.ensure_future(timed()), sent
+
+    async def run(self, model: str, call: Call, accept: Callable[[Any], bool]) -> Any:
+        """Result of ``call``, or of its hedge if that produces an accepted result first."""
+        with self._lock:
+            self.calls += 1
+        primary, sent = self._launch(model, call)
+        tasks = {primary}
+        try:
+            delay = self.delay(model) if self.enabled else None
+            if delay is not None:
+                await asyncio.wait({primary, sent}, return_when=asyncio.FIRST_COMPLETED)
+                if not primary.done():
+                    await asyncio.wait({primary}, timeout=delay)
+                if not primary.done() and self._take_hedge():
+                    print(f"    🔀 Hedging a {model} call running over {delay:.1f}s")
+                    hedge, _ = self._launch(model, call)
+                    tasks.add(hedge)
+
+            error, rejected = None, None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    if accept(task.result()):
+                        if len(tasks) > 1:
+                            with self._lock:
+                                if task is primary:
+                                    self.primary_wins += 1
+                                else:
+                                    self.hedge_wins += 1
+                        if task is not primary and not primary.done():
+                            # A lower bound of the primary's latency; leaving it out would drift the percentile low
+                            self.record(model, time.monotonic() - sent.result())
+                        return task.result()
+                    rejected = task
+            if rejected is not None:
+                return rejected.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            sent.cancel()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            models = {model: len(samples) for model, samples in self._latencies.items()}
+            stats = {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "max_fraction": self.max_fraction,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "primary_wins": self.primary_wins,
+                "capped": self.capped,
+            }
+        stats["models"] = {model: {"samples": count, "hedge_after": self.delay(model)} for model, count in models.items()}
+        return stats
+
+
+hedge_policy = HedgePolicy()
@@ -0,0 +1,157 @@
+"""
+后台导入任务
+
+Uploaded workbooks are imported on a small local worker pool so API workers
+return immediately. Each job goes through the incremental importer (a re-upload
+of an existing dataset only replaces changed sheets and keeps its mappings) and
+reports progress that the frontend can poll or subscribe to.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from .. import database, models
+from . import incremental_import
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv(
+    "UPLOAD_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "uploads"),
+)
+# Concurrent import jobs, and parser processes used by each job
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", "2"))
+IMPORT_PARSE_WORKERS = int(os.getenv("IMPORT_PARSE_WORKERS", "2"))
+# Finished jobs kept in memory for status queries
+MAX_FINISHED_JOBS = 200
+
+
+@dataclass
+class ImportJob:
+    id: str
+    dataset_name: str
+    file_name: str
+    file_path: str
+    status: str = "queued" # queued, running, succeeded, failed
+    total_sheets: Optional[int] = None
+    sheets_done: int = 0
+    rows_parsed: int = 0
+    dataset_id: Optional[int] = None
+    summary: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    version: int = 0 # bumped on every change, lets subscribers skip unchanged snapshots
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def snapshot(self) -> dict:
+        elapsed = None
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "dataset_name": self.dataset_name,
+            "file_name": self.file_name,
+            "status": self.status,
+            "total_sheets": self.total_sheets,
+            "sheets_done": self.sheets_done,
+            "rows_parsed": self.rows_parsed,
+            "rows_per_sec": round(self.rows_parsed / elapsed, 1) if elapsed else None,
+            "dataset_id": self.dataset_id,
+            "summary": self.summary,
+            "error": self.error,
+            "version": self.version,
+        }
+
+
+class ImportJobManager:
+    """In-process registry and worker pool for upload imports."""
+
+    def __init__(self, max_workers: int = IMPORT_JOB_WORKERS, parse_workers: int = IMPORT_PARSE_WORKERS):
+        self.parse_workers = parse_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dataset-import")
+        self._jobs: Dict[str, ImportJob] = {}
+        self._lock = threading.Lock()
+
+    def new_upload_path(self, file_name: str) -> str:
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        safe_name = os.path.basename(file_name).replace(os.sep, "_")
+        return os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}_{safe_name}")
+
+    def submit(self, dataset_name: str, file_name: str, file_path: str) -> ImportJob:
+        job = ImportJob(id=uuid.uuid4().hex, dataset_name=dataset_name, file_name=file_name, file_path=file_path)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[ImportJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def _prune(self) -> None:
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.created_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def _update(self, job: ImportJob, **changes) -> None:
+        with self._lock:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            job.version += 1
+
+    def _progress(self, job: ImportJob):
+        def progress(rows: int = 0, sheets: int = 0, total_sheets: Optional[int] = None) -> None:
+            with self._lock:
+                job.rows_parsed += rows
+                job.sheets_done += sheets
+                if total_sheets is not None:
+                    job.total_sheets = total_sheets
+                job.version += 1
+        return progress
+
+    def _run(self, job: ImportJob) -> None:
+        self._update(job, status="running", started_at=time.time())
+        try:
+            report = incremental_import.refresh_datasets(
+                database.engine,
+                [(job.dataset_name, job.file_path)],
+                workers=self.parse_workers,
+                progress=self._progress(job),
+            )
+            with database.engine.connect() as conn:
+                dataset_id = conn.execute(
+                    select(models.Dataset.id).where(models.Dataset.name == job.dataset_name)
+                ).scalar()
+            if report.failed_sheets:
+                raise RuntimeError(f"{report.failed_sheets} sheet(s) failed to import")
+            self._update(job, status="succeeded", dataset_id=dataset_id, summary=str(report), finished_at=time.time())
+            logger.info("Import job %s finished: %s", job.id, report)
+        except Exception as exc:
+            logger.exception("Import job %s failed", job.id)
+            self._update(job, status="failed", error=str(exc), finished_at=time.time())
+        finally:
+            # Rows are in the database now; the uploaded copy is no longer needed
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+
+
+import_jobs = ImportJobManager()
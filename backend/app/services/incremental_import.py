@@ -0,0 +1,228 @@
+"""
+增量导入
+
+Refreshes datasets and frameworks from their workbooks without dropping any
+table. Files whose SHA-256 is unchanged are skipped outright; inside a changed
+workbook only sheets whose content hash differs get their ``DatasetRow`` rows
+replaced. Dataset and framework ids never change, so saved ``Mapping`` /
+``MappingEntry`` history stays attached.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Engine
+
+from .. import models
+from . import excel_ingestion, parallel_import, preview_cache, search_index
+
+logger = logging.getLogger(__name__)
+
+datasets_table = models.Dataset.__table__
+sheets_table = models.DatasetSheet.__table__
+rows_table = models.DatasetRow.__table__
+profiles_table = models.ColumnProfile.__table__
+frameworks_table = models.Framework.__table__
+framework_sheets_table = models.FrameworkSheet.__table__
+
+
+@dataclass
+class RefreshReport:
+    """What an incremental run touched."""
+    unchanged_files: int = 0
+    changed_files: int = 0
+    new_files: int = 0
+    unchanged_sheets: int = 0
+    replaced_sheets: int = 0
+    added_sheets: int = 0
+    removed_sheets: int = 0
+    failed_sheets: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    refreshed_dataset_ids: List[int] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f"files: {self.new_files} new, {self.changed_files} changed, {self.unchanged_files} unchanged; "
+            f"sheets: {self.added_sheets} added, {self.replaced_sheets} replaced, {self.removed_sheets} removed, "
+            f"{self.unchanged_sheets} unchanged, {self.failed_sheets} failed; "
+            f"{self.rows} rows in {self.seconds:.2f}s"
+        )
+
+
+def _plan_dataset(engine: Engine, dataset_name: str, file_path: str, report: RefreshReport):
+    """Diff one source workbook against the database.
+
+    Returns ``(dataset_id, file_hash, sheets_to_fill)`` or ``None`` when the file
+    is unchanged. Removed sheets are deleted here; changed sheets are emptied
+    when they are refilled.
+    """
+    file_hash = excel_ingestion.file_content_hash(file_path)
+
+    with engine.connect() as conn:
+        dataset = conn.execute(
+            select(datasets_table.c.id, datasets_table.c.content_hash).where(datasets_table.c.name == dataset_name)
+        ).first()
+        existing = {}
+        if dataset is not None:
+            existing = {
+                r.name: (r.id, r.content_hash)
+                for r in conn.execute(
+                    select(sheets_table.c.id, sheets_table.c.name, sheets_table.c.content_hash)
+                    .where(sheets_table.c.dataset_id == dataset.id)
+                )
+            }
+
+    if dataset is not None and dataset.content_hash == file_hash:
+        report.unchanged_files += 1
+        return None
+
+    sheet_names = excel_ingestion.list_sheet_names(file_path)
+    to_fill: List[Tuple[int, str]] = []
+
+    # Parse the kept sheets before opening the write transaction, so its locks are held only for the writes
+    unchanged = set()
+    with excel_ingestion.WorkbookReader(file_path) as reader:
+        for sheet_name in sheet_names:
+            old_hash = existing.get(sheet_name, (None, None))[1]
+            if old_hash and excel_ingestion.sheet_content_hash(reader, sheet_name) == old_hash:
+                unchanged.add(sheet_name)
+
+    with engine.begin() as conn:
+        if dataset is None:
+            report.new_files += 1
+            dataset_id = conn.execute(insert(datasets_table).values(name=dataset_name)).inserted_primary_key[0]
+        else:
+            report.changed_files += 1
+            dataset_id = dataset.id
+
+        removed = [sheet_id for name, (sheet_id, _) in existing.items() if name not in sheet_names]
+        if removed:
+            conn.execute(delete(rows_table).where(rows_table.c.sheet_id.in_(removed)))
+            conn.execute(delete(profiles_table).where(profiles_table.c.sheet_id.in_(removed)))
+            search_index.delete_index(conn, removed)
+            conn.execute(delete(sheets_table).where(sheets_table.c.id.in_(removed)))
+            report.removed_sheets += len(removed)
+
+        for sheet_name in sheet_names:
+            if sheet_name not in existing:
+                sheet_id = excel_ingestion.create_sheet(conn, dataset_id, sheet_name)
+                to_fill.append((sheet_id, sheet_name))
+                report.added_sheets += 1
+            elif sheet_name in unchanged:
+                report.unchanged_sheets += 1
+            else:
+                to_fill.append((existing[sheet_name][0], sheet_name))
+                report.replaced_sheets += 1
+
+    return dataset_id, file_hash, to_fill
+
+
+def refresh_datasets(engine: Engine, datasets: List[Tuple[str, str]], workers: int = 1,
+                     progress: Optional[excel_ingestion.ProgressCallback] = None) -> RefreshReport:
+    """Incrementally import ``(dataset_name, file_path)`` pairs.
+
+    Sheets that need (re)filling are parsed serially or, with ``workers > 1``,
+    through the process pool of ``parallel_import``.
+    """
+    report = RefreshReport()
+    started = time.perf_counter()
+
+    planned: Dict[int, str] = {}
+    fills_by_file: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+    dataset_of_sheet: Dict[int, int] = {}
+
+    for dataset_name, file_path in datasets:
+        try:
+            plan = _plan_dataset(engine, dataset_name, file_path, report)
+        except Exception as exc:
+            logger.error("Cannot diff workbook %s: %s", file_path, exc)
+            print(f"    Error reading source excel {file_path}: {exc}")
+            continue
+        if plan is None:
+            continue
+        dataset_id, file_hash, to_fill = plan
+        planned[dataset_id] = file_hash
+        fills_by_file[file_path].extend(to_fill)
+        for sheet_id, _ in to_fill:
+            dataset_of_sheet[sheet_id] = dataset_id
+
+    if progress:
+        progress(total_sheets=sum(len(sheets) for sheets in fills_by_file.values()))
+
+    if workers > 1:
+        tasks = [
+            parallel_import.SheetTask(sheet_id, file_path, sheet_name)
+            for file_path, sheets in fills_by_file.items()
+            for sheet_id, sheet_name in sheets
+        ]
+        if tasks:
+            with engine.begin() as conn:
+                conn.execute(delete(rows_table).where(rows_table.c.sheet_id.in_([t.sheet_id for t in tasks])))
+        stats = parallel_import.run_sheet_tasks(engine, tasks, workers=workers, progress=progress)
+    else:
+        stats = excel_ingestion.IngestStats()
+        for file_path, sheets in fills_by_file.items():
+            stats.merge(excel_ingestion.refill_sheets(engine, file_path, sheets, progress=progress))
+
+    report.rows = stats.rows
+    report.failed_sheets = len(stats.failed_sheet_ids)
+
+    # Only mark a dataset as current once all of its sheets made it in
+    failed_datasets = {dataset_of_sheet[sheet_id] for sheet_id in stats.failed_sheet_ids}
+    with engine.begin() as conn:
+        for dataset_id, file_hash in planned.items():
+            if dataset_id not in failed_datasets:
+                conn.execute(update(datasets_table).where(datasets_table.c.id == dataset_id).values(content_hash=file_hash))
+    report.refreshed_dataset_ids = sorted(planned)
+    for dataset_id in planned:
+        preview_cache.invalidate_dataset(dataset_id)
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def refresh_framework(engine: Engine, framework_name: str, file_path: str) -> str:
+    """Incrementally import one framework workbook.
+
+    Returns ``"unchanged"``, ``"created"``, ``"updated"`` or ``"skipped"`` (no
+    ``数据源定位`` sheet). Updated frameworks keep their id; only their
+    ``FrameworkSheet`` rows are replaced.
+    """
+    file_hash = excel_ingestion.file_content_hash(file_path)
+    with engine.connect() as conn:
+        framework = conn.execute(
+            select(frameworks_table.c.id, frameworks_table.c.content_hash)
+            .where(frameworks_table.c.name == framework_name)
+        ).first()
+
+    if framework is not None and framework.content_hash == file_hash:
+        return "unchanged"
+
+    entries = excel_ingestion.read_framework_entries(file_path)
+    if entries is None:
+        return "skipped"
+
+    with engine.begin() as conn:
+        if framework is None:
+            framework_id = conn.execute(insert(frameworks_table).values(
+                name=framework_name,
+                version="1.0",
+                description=f"Imported from {os.path.basename(file_path)}",
+                content_hash=file_hash,
+            )).inserted_primary_key[0]
+            status = "created"
+        else:
+            framework_id = framework.id
+            conn.execute(delete(framework_sheets_table).where(framework_sheets_table.c.framework_id == framework_id))
+            conn.execute(update(frameworks_table).where(frameworks_table.c.id == framework_id).values(content_hash=file_hash))
+            status = "updated"
+
+        if entries:
+            conn.execute(insert(framework_sheets_table), [dict(e, framework_id=framework_id) for e in entries])
+
+    return status
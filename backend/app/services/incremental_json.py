@@ -0,0 +1,85 @@
+"""
+增量 JSON 解析
+
+Scans streamed LLM output character by character and hands back every JSON
+object as soon as its closing brace arrives, without waiting for the rest of the
+document. Used to emit ``{"mappings": [{...}, {...}]}`` entries one by one while
+the model is still generating. Text outside JSON (e.g. a ```json fence) is
+skipped, and strings are tracked so braces inside values do not confuse it.
+"""
+import bisect
+import json
+from typing import Any, Dict, List, Optional
+
+
+class IncrementalObjectParser:
+    """Feed text chunks; ``feed`` returns the objects completed by that chunk.
+
+    With ``required_key`` set, only objects containing that key are returned
+    (the enclosing ``{"mappings": [...]}`` wrapper is not). Only the new chunk is
+    scanned, and an object is sliced from the chunks it spans, so a response
+    streamed in many small pieces is parsed in linear time.
+    """
+
+    def __init__(self, required_key: Optional[str] = None):
+        self.required_key = required_key
+        self._chunks: List[str] = []
+        self._offsets: List[int] = [] # start offset of each chunk
+        self._length = 0
+        self._stack: List[tuple] = [] # (opening char, start offset)
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        if len(self._chunks) > 1:
+            self._chunks, self._offsets = ["".join(self._chunks)], [0]
+        return self._chunks[0] if self._chunks else ""
+
+    def _slice(self, start: int, end: int) -> str:
+        """``text[start:end]`` for an ``end`` inside the last chunk, joining only the chunks it spans."""
+        first = bisect.bisect_right(self._offsets, start) - 1
+        return "".join(self._chunks[first:])[start - self._offsets[first]:end - self._offsets[first]]
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        if not chunk:
+            return []
+        base = self._length
+        self._chunks.append(chunk)
+        self._offsets.append(base)
+        self._length += len(chunk)
+        completed = []
+
+        for offset, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"' and self._stack:
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append((char, base + offset))
+            elif char in "}]" and self._stack:
+                opening, start = self._stack.pop()
+                if opening == "{" and char == "}":
+                    obj = self._load(self._slice(start, base + offset + 1))
+                    if obj is not None:
+                        completed.append(obj)
+
+        return completed
+
+    def _load(self, fragment: str) -> Optional[Dict[str, Any]]:
+        try:
+            obj = json.loads(fragment)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict):
+            return None
+        if self.required_key is not None and self.required_key not in obj:
+            return None
+        return obj
@@ -0,0 +1,170 @@
+"""
+LLM 响应缓存
+
+Disk-backed (SQLite) cache of LLM responses for mapping generation. The key is
+a SHA-256 of the model name, temperature and full prompt, so regenerating an
+unchanged dataset/framework pair replays the stored responses without any API
+call. Only responses that parsed into valid mappings are stored.
+
+Entries expire after ``LLM_CACHE_TTL_SECONDS`` and the least recently used ones
+are evicted beyond ``LLM_CACHE_MAX_ENTRIES``. Set ``LLM_CACHE_ENABLED=false`` to
+turn the cache off, or pass ``use_cache=False`` to bypass it for one run.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "llm_cache.sqlite3"),
+)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+# Expired/overflow entries are purged every N writes rather than on each one
+PURGE_EVERY = 50
+
+
+def describe_llm(llm: Any) -> Tuple[str, Optional[float]]:
+    """``(model name, temperature)`` of a LangChain chat model (or anything shaped like one)."""
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    return str(model), getattr(llm, "temperature", None)
+
+
+def cache_key(model: str, temperature: Optional[float], prompt: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{model}\x00{temperature}\x00".encode("utf-8"))
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """Thread-safe SQLite store of ``key -> response text``."""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the module never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                " key TEXT PRIMARY KEY, model TEXT, content TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_used_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_responses_last_used ON llm_responses (last_used_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, use_cache: bool = True) -> Optional[str]:
+        if not (self.enabled and use_cache):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT content, created_at FROM llm_responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.ttl_seconds:
+                    self.misses += 1
+                    return None
+                conn.execute(
+                    "UPDATE llm_responses SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (now, key)
+                )
+                conn.commit()
+                self.hits += 1
+                return row[0]
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache read failed: %s", exc)
+            return None
+
+    def put(self, key: str, content: str, model: str = "", use_cache: bool = True) -> None:
+        if not (self.enabled and use_cache):
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, model, content, created_at, last_used_at, hits)"
+                    " VALUES (?, ?, ?, ?, ?, 0)",
+                    (key, model, content, now, now),
+                )
+                self.writes += 1
+                if self.writes % PURGE_EVERY == 1:
+                    self._purge(conn, now)
+                conn.commit()
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache write failed: %s", exc)
+
+    def discard(self, key: str) -> None:
+        """Forget one entry (e.g. a stored response that no longer parses)."""
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                conn.commit()
+        except sqlite3.Error as exc:
+            logger.warning("LLM cache delete failed: %s", exc)
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM llm_responses WHERE key IN ("
+            " SELECT key FROM llm_responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self) -> int:
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM llm_responses").rowcount
+            conn.commit()
+            return removed
+
+    def stats(self) -> dict:
+        entries = None
+        if self.enabled:
+            try:
+                with self._lock:
+                    entries = self._connection().execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            except sqlite3.Error as exc:
+                logger.warning("LLM cache stats failed: %s", exc)
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+llm_cache = LLMCache()
@@ -2,61 +2,206 @@
 LLM 工厂
 
 提供当前架构使用的默认 LLM 实例。
+
+Two-tier mode: when ``LLM_FAST_MODEL`` is set, a cheaper/faster model does the
+first pass of every sheet group and only low-confidence columns are re-asked to
+the default (strong) model ``LLM_MODEL``.
+
+The clients are built once at application startup (``init_llms``), without a
+network round trip, and share one keep-alive HTTP connection pool per sync/async
+side sized to ``LLM_MAX_CONCURRENCY``, so a sheet-group call reuses an open
+TLS connection. The async client is only used from the generation event loop.
+``check_llm_health`` is an optional, cached probe (``GET /models``, no tokens).
 """
+import asyncio
 import logging
 import os
-from typing import Any
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+import openai
 from dotenv import load_dotenv
 from langchain_community.chat_models import ChatOpenAI
 
+from .rate_limiter import AdaptiveRateLimiter
+
 # Load .env from backend directory (3 levels up)
 backend_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
 load_dotenv(backend_env_path)
 
 logger = logging.getLogger(__name__)
 
+# Provider limits, shared by every LLM call in the process (see rate_limiter)
+LLM_RPM = int(os.getenv("LLM_RPM", "60"))
+LLM_TPM = int(os.getenv("LLM_TPM", "400000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "90"))
+# Attempts per call, with exponential backoff + jitter between them
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+# Target-schema + expected-output tokens per prompt; larger sheet groups are split into batches
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "4000"))
+# Fast first-pass tier (disabled unless LLM_FAST_MODEL is set); endpoint and key default to LLM_*
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL")
+LLM_FAST_BASE_URL = os.getenv("LLM_FAST_BASE_URL")
+LLM_FAST_API_KEY = os.getenv("LLM_FAST_API_KEY")
+# Fast-tier mappings below this confidence (and placeholders) are re-asked to the strong model
+LLM_ESCALATION_THRESHOLD = float(os.getenv("LLM_ESCALATION_THRESHOLD", "0.8"))
+
+# Idle keep-alive connections are closed after this many seconds
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+# Seconds before an LLM request is abandoned (the openai SDK default), and for opening a connection
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "600"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+# Probe the providers once at startup (and on /llm-health); results are cached for LLM_HEALTH_TTL seconds
+LLM_HEALTH_PROBE = os.getenv("LLM_HEALTH_PROBE", "false").lower() in ("1", "true", "yes")
+LLM_HEALTH_TTL = float(os.getenv("LLM_HEALTH_TTL", "300"))
+
 _llm_instance: Any = None
+_fast_llm_instance: Any = None
+_init_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+# tier -> sync OpenAI client of that tier's endpoint (used by the health probe)
+_api_clients: Dict[str, Any] = {}
+_health: Dict[str, Dict[str, Any]] = {}
+_rate_limiter: Any = None
+
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """Process-wide limiter configured from the LLM_* environment variables."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = AdaptiveRateLimiter(
+            rpm=LLM_RPM,
+            tpm=LLM_TPM,
+            max_concurrency=LLM_MAX_CONCURRENCY,
+            min_concurrency=LLM_MIN_CONCURRENCY,
+            latency_target=LLM_LATENCY_TARGET,
+        )
+    return _rate_limiter
+
+
+def _http_clients():
+    """Process-wide keep-alive pools; at most LLM_MAX_CONCURRENCY calls are in flight (rate limiter)."""
+    global _http_client, _async_http_client
+    if _http_client is None:
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONCURRENCY * 2, # headroom for the probe and streams still closing
+            max_keepalive_connections=LLM_MAX_CONCURRENCY,
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+        )
+        # The SDK takes the pool's timeout as its own: a hung call must still end and free its slots
+        timeout = httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        _http_client = httpx.Client(limits=limits, timeout=timeout)
+        _async_http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return _http_client, _async_http_client
+
+
+def _create_llm(tier: str, model: str, base_url: Optional[str], api_key: Optional[str]) -> Any:
+    http_client, async_http_client = _http_clients()
+    # Retries are paced by the shared rate limiter instead
+    api_params = {"api_key": api_key, "base_url": base_url, "max_retries": 0}
+    _api_clients[tier] = openai.OpenAI(http_client=http_client, **api_params)
+    return ChatOpenAI(
+        model=model,
+        base_url=base_url,
+        api_key=api_key,
+        temperature=0.2,
+        max_retries=0,
+        max_tokens=32000,
+        model_kwargs={
+            "response_format": {"type": "json_object"}
+        },
+        client=_api_clients[tier].chat.completions,
+        async_client=openai.AsyncOpenAI(http_client=async_http_client, **api_params).chat.completions,
+    )
 
 
 def get_default_llm() -> Any:
     """获取或创建默认的 LLM 实例。
 
     该实现使用标准的LLM配置，保证行为一致。
-    使用单例模式避免重复初始化。
+    使用单例模式避免重复初始化；通常已在应用启动时 (``init_llms``) 创建。
     """
     global _llm_instance
     if _llm_instance is not None:
         return _llm_instance
 
+    with _init_lock:
+        if _llm_instance is not None:
+            return _llm_instance
+        try:
+            # 使用ChatOpenAI作为通用LLM接口
+            api_key = os.getenv("LLM_API_KEY")
+            base_url = os.getenv("LLM_BASE_URL")
+            model = os.getenv("LLM_MODEL", "deepseek-chat")
+
+            if not api_key:
+                raise ValueError("LLM_API_KEY env var not found")
+
+            _llm_instance = _create_llm("default", model, base_url, api_key)
+            logger.info("Default LLM instance initialized successfully")
+        except Exception as exc:
+            logger.error(f"Failed to initialize default LLM instance: {exc}")
+            print(f"LLM initialization error: {exc}")
+            # 直接抛出异常，不使用MockLLM
+            raise Exception(f"LLM初始化失败: {exc}")
+
+    return _llm_instance
+
+
+def get_fast_llm() -> Optional[Any]:
+    """Fast first-pass model of the two-tier mode, ``None`` if ``LLM_FAST_MODEL`` is not set."""
+    global _fast_llm_instance
+    if not LLM_FAST_MODEL:
+        return None
+    with _init_lock:
+        if _fast_llm_instance is None:
+            api_key = LLM_FAST_API_KEY or os.getenv("LLM_API_KEY")
+            if not api_key:
+                raise Exception("LLM初始化失败: LLM_FAST_API_KEY / LLM_API_KEY env var not found")
+            _fast_llm_instance = _create_llm(
+                "fast", LLM_FAST_MODEL, LLM_FAST_BASE_URL or os.getenv("LLM_BASE_URL"), api_key
+            )
+            logger.info("Fast-tier LLM %s initialized", LLM_FAST_MODEL)
+    return _fast_llm_instance
+
+
+def init_llms() -> bool:
+    """Build the LLM clients ahead of the first generation (application startup); ``False`` if not configured."""
     try:
-        # 使用ChatOpenAI作为通用LLM接口
-        api_key = os.getenv("LLM_API_KEY")
-        base_url = os.getenv("LLM_BASE_URL")
-        model = os.getenv("LLM_MODEL", "deepseek-chat")
-
-        if not api_key:
-            raise ValueError("LLM_API_KEY env var not found")
-            
-        _llm_instance = ChatOpenAI(
-            model=model,
-            base_url=base_url,
-            api_key=api_key,
-            temperature=0.2,
-            max_retries=1,
-            max_tokens=32000,
-            model_kwargs={
-                "response_format": {"type": "json_object"}
-            },
-        )
-        logger.info("Default LLM instance initialized successfully")
-        # Test the connection
-        print("Testing LLM connection...")
-        test_response = _llm_instance.invoke("Hello")
-        print(f"LLM test response: {test_response}")
+        get_default_llm()
+        get_fast_llm()
+        return True
     except Exception as exc:
-        logger.error(f"Failed to initialize default LLM instance: {exc}")
-        print(f"LLM initialization error: {exc}")
-        # 直接抛出异常，不使用MockLLM
-        raise Exception(f"LLM初始化失败: {exc}")
-    
-    return _llm_instance
+        logger.warning("LLM clients not initialized at startup: %s", exc)
+        return False
+
+
+def _probe(tier: str) -> Dict[str, Any]:
+    started = time.monotonic()
+    try:
+        _api_clients[tier].models.list()
+        result = {"ok": True, "error": None}
+    except Exception as exc:
+        result = {"ok": False, "error": str(exc)}
+    result.update(latency=round(time.monotonic() - started, 3), checked_at=time.time())
+    return result
+
+
+async def check_llm_health(refresh: bool = False) -> Dict[str, Any]:
+    """Reachability of each configured tier's endpoint, re-probed after ``LLM_HEALTH_TTL`` seconds."""
+    if not _api_clients and not await asyncio.to_thread(init_llms):
+        return {"configured": False, "tiers": {}}
+    for tier in list(_api_clients):
+        cached = _health.get(tier)
+        if refresh or cached is None or time.time() - cached["checked_at"] > LLM_HEALTH_TTL:
+            _health[tier] = await asyncio.to_thread(_probe, tier)
+            if not _health[tier]["ok"]:
+                logger.warning("LLM health probe of the %s tier failed: %s", tier, _health[tier]["error"])
+    return {"configured": True, "tiers": dict(_health)}
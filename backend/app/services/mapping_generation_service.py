@@ -1,50 +1,47 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from .. import models
-from . import process_mappings_with_llm
-from .llm_factory import get_default_llm
-from fastapi import HTTPException
+from ..database import SessionLocal
+from . import process_mappings_with_llm, row_codec
+from .mapping_history import DRAFT
 import logging
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-def generate_ai_mapping_stream(db: Session, dataset_id: int, framework_id: int):
-    """
-    Generate mappings using LLM for a given dataset and framework (Streaming Version).
-    Yields chunks of generated mappings as they are processed.
-    """
-    
-    # 1. Fetch Data
-    dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
-    framework = db.query(models.Framework).filter(models.Framework.id == framework_id).first()
-
-    if not dataset or not framework:
-        yield {"type": "error", "message": "Dataset or Framework not found"}
-        return
-
-    print(f"Generating AI Mapping Stream for Dataset: {dataset.name} -> Framework: {framework.name}")
-
-    # 2. Build Request Data
-    # 2a. Source Summary
+def build_source_summary(db: Session, dataset: models.Dataset) -> Dict[str, Any]:
+    """Source side of the LLM request: per-sheet column names, sample values and stats."""
     sheets_summary = {}
     
     for sheet in dataset.sheets:
-        sample_rows = db.query(models.DatasetRow).filter(models.DatasetRow.sheet_id == sheet.id).limit(5).all()
-        
         columns_info = []
-        if sample_rows:
-            first_row = sample_rows[0]
-            if first_row and first_row.data:
-                headers = list(first_row.data.keys())
-                
+        row_count = "Unknown"
+
+        if sheet.profiles:
+            # Column statistics were computed at import time, no row scan needed
+            row_count = sheet.profiles[0].row_count
+            for profile in sheet.profiles:
+                columns_info.append({
+                    "name": profile.column_name,
+                    "sample_values": [str(v["value"]) for v in (profile.top_values or [])[:3]],
+                    "data_type": profile.inferred_type,
+                    "null_ratio": profile.null_ratio,
+                    "distinct_count": profile.distinct_count
+                })
+        else:
+            # Sheets imported before profiling: fall back to sampling a few rows
+            sample_rows = db.query(models.DatasetRow).filter(models.DatasetRow.sheet_id == sheet.id).order_by(models.DatasetRow.row_index).limit(5).all()
+            if sample_rows:
+                decoded_rows = [row_codec.decode_row(sheet.column_names, row.data) for row in sample_rows]
+                headers = row_codec.sheet_columns(sheet.column_names, sample_rows[0].data)
+
                 for header in headers:
                     samples = []
-                    for row in sample_rows:
-                        if row.data:
-                            val = row.data.get(header)
-                            if val is not None:
-                                samples.append(str(val))
-                    
+                    for row_data in decoded_rows:
+                        val = row_data.get(header)
+                        if val is not None:
+                            samples.append(str(val))
+
                     columns_info.append({
                         "name": header,
                         "sample_values": samples[:3],
@@ -53,16 +50,16 @@ def generate_ai_mapping_stream(db: Session, dataset_id: int, framework_id: int):
 
         sheets_summary[sheet.name] = {
             "description": f"Sheet {sheet.name}",
-            "row_count": "Unknown",
+            "row_count": row_count,
             "columns": columns_info
         }
     
-    source_summary = {
+    return {
         "description": f"Source data from {dataset.name}",
         "sheets": sheets_summary
     }
 
-    # 2b. Target Schema
+def build_target_schema(framework: models.Framework) -> Dict[str, Any]:
     target_mappings = []
     for sheet in framework.sheets:
         target_mappings.append({
@@ -72,94 +69,137 @@ def generate_ai_mapping_stream(db: Session, dataset_id: int, framework_id: int):
             "备注": sheet.note
         })
     
-    target_schema = {
+    return {
         "description": f"Target schema: {framework.name}",
         "total_mappings": len(target_mappings),
         "mappings": target_mappings
     }
 
-    request_data = {
-        "source": source_summary,
-        "target": target_schema
+def _load_dataset(db: Session, dataset_id: int) -> Optional[models.Dataset]:
+    return db.query(models.Dataset).options(
+        selectinload(models.Dataset.sheets).selectinload(models.DatasetSheet.profiles)
+    ).filter(models.Dataset.id == dataset_id).first()
+
+def load_request_data(db: Session, dataset_id: int, framework_id: int,
+                      cache: Optional["RequestDataCache"] = None) -> Optional[Dict[str, Any]]:
+    """Build the LLM request (source summary + target schema) for a dataset/framework pair.
+
+    Returns ``None`` when either side does not exist. With ``cache`` the two
+    halves are shared with the other pairs of a batch.
+    """
+    if cache is not None:
+        return cache.load(db, dataset_id, framework_id)
+    dataset = _load_dataset(db, dataset_id)
+    framework = db.query(models.Framework).filter(models.Framework.id == framework_id).first()
+
+    if not dataset or not framework:
+        return None
+
+    print(f"Generating AI Mapping Stream for Dataset: {dataset.name} -> Framework: {framework.name}")
+    return {
+        "source": build_source_summary(db, dataset),
+        "target": build_target_schema(framework)
     }
 
-    # 3. Create Mapping Record Immediately
+class RequestDataCache:
+    """Source summaries and target schemas built once per dataset/framework for a batch of pairs.
+
+    The summaries are shared as-is (the pipeline only reads them); every request
+    gets its own target mapping list because jobs trim it to the columns left to generate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources: Dict[int, Dict[str, Any]] = {}
+        self._targets: Dict[int, Dict[str, Any]] = {}
+        self.hits = 0
+
+    def load(self, db: Session, dataset_id: int, framework_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            source, target = self._sources.get(dataset_id), self._targets.get(framework_id)
+            self.hits += (source is not None) + (target is not None)
+            if source is None:
+                dataset = _load_dataset(db, dataset_id)
+                if dataset is None:
+                    return None
+                source = self._sources[dataset_id] = build_source_summary(db, dataset)
+            if target is None:
+                framework = db.query(models.Framework).filter(models.Framework.id == framework_id).first()
+                if framework is None:
+                    return None
+                target = self._targets[framework_id] = build_target_schema(framework)
+        return {"source": source, "target": dict(target, mappings=list(target["mappings"]))}
+
+def create_draft_mapping(db: Session, dataset_id: int, framework_id: int) -> models.Mapping:
+    """The Mapping record generated entries are saved into (a draft until the user saves it)."""
     new_mapping = models.Mapping(
         dataset_id=dataset_id,
-        framework_id=framework_id
+        framework_id=framework_id,
+        status=DRAFT
     )
     db.add(new_mapping)
-    db.commit()
-    db.refresh(new_mapping)
-    
-    # Yield Start Event
-    yield {
-        "type": "start", 
-        "mapping_id": new_mapping.id, 
-        "total_sheets": len(framework.sheets),
-        "message": "Mapping session started"
-    }
+    db.flush()
+    return new_mapping
+
+def saved_columns(db: Session, mapping_id: int) -> Dict[Tuple[str, str], Optional[str]]:
+    """``(standard sheet, standard column) -> rationale`` of the entries already saved for a mapping."""
+    rows = db.query(
+        models.MappingEntry.standard_sheet_name, models.MappingEntry.standard_column_name,
+        models.MappingEntry.rationale
+    ).filter(models.MappingEntry.mapping_id == mapping_id).all()
+    return {(sheet or "", col): rationale for sheet, col, rationale in rows}
 
-    # 4. Call LLM Stream
-    logger.info("Starting LLM stream...")
-    llm = get_default_llm()
+def delete_failed_placeholders(db: Session, mapping_id: int, sheet_names: List[str]) -> int:
+    """Drop the placeholders left by failed LLM calls in ``sheet_names`` so they can be generated again."""
+    return db.query(models.MappingEntry).filter(
+        models.MappingEntry.mapping_id == mapping_id,
+        models.MappingEntry.standard_sheet_name.in_(sheet_names),
+        models.MappingEntry.rationale.like(f"{process_mappings_with_llm.FAILED_PLACEHOLDER_PREFIX}%")
+    ).delete(synchronize_session=False)
+
+def save_generated_chunk(mapping_id: int, chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Persist one sheet group's mappings and return them in the frontend's entry format."""
+    entries_to_add = []
+    frontend_entries = []
     
-    try:
-        # Use the streaming version we just added
-        for chunk in process_mappings_with_llm.process_request_with_llm_stream(request_data, llm):
-            entries_to_add = []
-            frontend_entries = []
-            
-            for m in chunk:
-                # Extract fields
-                source_sheet = m.get('Source_SheetName', '')
-                source_col = m.get('Source_ColumnName', '')
-                std_sheet = m.get('Standard_SheetName', '')
-                std_col = m.get('Standard_ColumnName', '')
-                info_type = m.get('信息类型')
-                note = m.get('备注')
-                conf = m.get('Confidence')
-                rationale = m.get('Rationale')
-
-                entry = models.MappingEntry(
-                    mapping_id=new_mapping.id,
-                    source_sheet_name=source_sheet,
-                    source_column_name=source_col,
-                    standard_sheet_name=std_sheet,
-                    standard_column_name=std_col,
-                    info_type=info_type,
-                    note=note,
-                    confidence=conf,
-                    rationale=rationale
-                )
-                entries_to_add.append(entry)
-                
-                frontend_entries.append({
-                    "source_sheet_name": source_sheet,
-                    "source_column_name": source_col,
-                    "standard_sheet_name": std_sheet,
-                    "standard_column_name": std_col,
-                    "info_type": info_type,
-                    "note": note,
-                    "confidence": conf,
-                    "rationale": rationale
-                })
+    for m in chunk:
+        # Extract fields
+        source_sheet = m.get('Source_SheetName', '')
+        source_col = m.get('Source_ColumnName', '')
+        std_sheet = m.get('Standard_SheetName', '')
+        std_col = m.get('Standard_ColumnName', '')
+        info_type = m.get('信息类型')
+        note = m.get('备注')
+        conf = m.get('Confidence')
+        rationale = m.get('Rationale')
 
-            # Save batch to DB
-            if entries_to_add:
-                db.bulk_save_objects(entries_to_add)
-                db.commit()
-            
-            # Yield Data Event
-            yield {
-                "type": "data",
-                "entries": frontend_entries
-            }
-            
-        yield {"type": "done", "status": "success"}
+        entries_to_add.append(models.MappingEntry(
+            mapping_id=mapping_id,
+            source_sheet_name=source_sheet,
+            source_column_name=source_col,
+            standard_sheet_name=std_sheet,
+            standard_column_name=std_col,
+            info_type=info_type,
+            note=note,
+            confidence=conf,
+            rationale=rationale
+        ))
         
-    except Exception as e:
-        logger.error(f"Streaming failed: {e}")
-        yield {"type": "error", "message": str(e)}
-
+        frontend_entries.append({
+            "source_sheet_name": source_sheet,
+            "source_column_name": source_col,
+            "standard_sheet_name": std_sheet,
+            "standard_column_name": std_col,
+            "info_type": info_type,
+            "note": note,
+            "confidence": conf,
+            "rationale": rationale,
+            "provenance": m.get('Provenance') or {"source": "llm"}
+        })
 
+    # Save batch to DB
+    if entries_to_add:
+        with SessionLocal() as db:
+            db.bulk_save_objects(entries_to_add)
+            db.commit()
+    return frontend_entries
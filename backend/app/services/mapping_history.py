@@ -0,0 +1,216 @@
+"""
+历史映射复用
+
+In-memory index of saved ("official") mapping entries per framework:
+``(standard sheet, standard column) -> source column name -> votes``. Studies
+mapped against the same framework mostly reuse the same source column names, so
+before a generation calls the LLM, every target column whose historical source
+column exists in the new dataset is resolved from the index, with provenance.
+
+The index is built from the database on first use and kept current by the
+mapping CRUD functions (``record`` / ``forget``); each mapping's contribution is
+tracked so a re-save replaces it instead of counting twice. Generated mappings
+stay ``draft`` until the user saves them and are not indexed before that;
+``legacy`` rows (see ``migrate_db.py``) are never indexed.
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .. import models
+from ..database import SessionLocal
+from .search_index import normalize
+
+HISTORY_ENABLED = os.getenv("MAPPING_HISTORY_ENABLED", "true").lower() not in ("0", "false", "no")
+# Saved mappings that must agree on a source column before it is reused
+HISTORY_MIN_VOTES = int(os.getenv("MAPPING_HISTORY_MIN_VOTES", "1"))
+HISTORY_CONFIDENCE = 0.95
+OFFICIAL = "official"
+DRAFT = "draft"
+LEGACY = "legacy"
+
+Key = Tuple[str, str]  # (standard sheet, standard column)
+
+
+class MappingHistory:
+    """Thread-safe ``framework_id -> key -> normalized source column -> vote`` index."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._index: Dict[int, Dict[Key, Dict[str, Dict[str, Any]]]] = {}
+        # mapping_id -> (framework_id, [(key, normalized source column, source sheet)])
+        self._contributions: Dict[int, Tuple[int, List[Tuple[Key, str, str]]]] = {}
+
+    # --- maintenance ---
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with SessionLocal() as db:
+            rows = db.query(
+                models.Mapping.id, models.Mapping.framework_id, models.Mapping.dataset_id,
+                models.MappingEntry.standard_sheet_name, models.MappingEntry.standard_column_name,
+                models.MappingEntry.source_sheet_name, models.MappingEntry.source_column_name,
+            ).join(models.MappingEntry, models.MappingEntry.mapping_id == models.Mapping.id).filter(
+                models.Mapping.status == OFFICIAL
+            ).all()
+        grouped: Dict[int, Tuple[int, int, List[tuple]]] = {}
+        for mapping_id, framework_id, dataset_id, *entry in rows:
+            grouped.setdefault(mapping_id, (framework_id, dataset_id, []))[2].append(entry)
+        with self._lock:
+            if self._loaded:
+                return
+            for mapping_id, (framework_id, dataset_id, entries) in grouped.items():
+                self._add(mapping_id, framework_id, dataset_id, entries)
+            self._loaded = True
+            print(f"📚 Mapping history: indexed {len(grouped)} saved mappings")
+
+    def _add(self, mapping_id: int, framework_id: int, dataset_id: int, entries) -> None:
+        contributed = []
+        framework_index = self._index.setdefault(framework_id, {})
+        for std_sheet, std_col, src_sheet, src_col in entries:
+            if not std_col or not src_col:
+                continue
+            key, source = (std_sheet or "", std_col), normalize(src_col)
+            vote = framework_index.setdefault(key, {}).setdefault(source, {
+                "source_column": src_col, "sheets": {}, "mappings": {},
+            })
+            vote["mappings"][mapping_id] = dataset_id
+            vote["sheets"][src_sheet or ""] = vote["sheets"].get(src_sheet or "", 0) + 1
+            contributed.append((key, source, src_sheet or ""))
+        self._contributions[mapping_id] = (framework_id, contributed)
+
+    def _remove(self, mapping_id: int) -> None:
+        framework_id, contributed = self._contributions.pop(mapping_id, (None, []))
+        framework_index = self._index.get(framework_id, {})
+        for key, source, src_sheet in contributed:
+            vote = framework_index.get(key, {}).get(source)
+            if vote is None:
+                continue
+            vote["mappings"].pop(mapping_id, None)
+            vote["sheets"][src_sheet] -= 1
+            if vote["sheets"][src_sheet] <= 0:
+                del vote["sheets"][src_sheet]
+            if not vote["mappings"]:
+                del framework_index[key][source]
+                if not framework_index[key]:
+                    del framework_index[key]
+
+    def record(self, mapping: models.Mapping) -> None:
+        """(Re-)index a saved mapping; drafts and legacy mappings are only removed."""
+        with self._lock:
+            if not self._loaded:
+                return  # the first lookup loads everything from the database
+            self._remove(mapping.id)
+            if mapping.status == OFFICIAL:
+                self._add(mapping.id, mapping.framework_id, mapping.dataset_id, [
+                    (e.standard_sheet_name, e.standard_column_name, e.source_sheet_name, e.source_column_name)
+                    for e in mapping.entries
+                ])
+
+    def forget(self, mapping_id: int) -> None:
+        with self._lock:
+            if self._loaded:
+                self._remove(mapping_id)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._index, self._contributions, self._loaded = {}, {}, False
+
+    # --- lookup ---
+
+    def candidates(self, framework_id: int, std_sheet: str, std_col: str) -> List[Dict[str, Any]]:
+        """Historical source columns of a standard column, most votes first."""
+        self._ensure_loaded()
+        with self._lock:
+            votes = self._index.get(framework_id, {}).get((std_sheet or "", std_col), {})
+            ranked = [
+                {
+                    "source_column": v["source_column"],
+                    "sheets": sorted(v["sheets"], key=lambda s: -v["sheets"][s]),
+                    "votes": len(v["mappings"]),
+                    "mapping_ids": sorted(v["mappings"], reverse=True),
+                    "dataset_ids": sorted(set(v["mappings"].values())),
+                }
+                for v in votes.values()
+            ]
+        return sorted(ranked, key=lambda c: (-c["votes"], -c["mapping_ids"][0]))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": HISTORY_ENABLED,
+                "loaded": self._loaded,
+                "mappings": len(self._contributions),
+                "frameworks": len(self._index),
+                "standard_columns": sum(len(keys) for keys in self._index.values()),
+            }
+
+    def resolve(self, framework_id: int, request_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Mappings for the target columns whose historical source column exists in ``request_data['source']``."""
+        if not HISTORY_ENABLED:
+            return []
+        source_sheets = request_data.get("source", {}).get("sheets", {})
+        # normalized column name -> source sheets that contain it
+        located: Dict[str, List[Tuple[str, str]]] = {}
+        for sheet_name, sheet_info in source_sheets.items():
+            for col in sheet_info.get("columns", []):
+                located.setdefault(normalize(col.get("name", "")), []).append((sheet_name, col.get("name", "")))
+
+        resolved = []
+        for target in request_data.get("target", {}).get("mappings", []):
+            std_sheet, std_col = target.get("Standard_SheetName", ""), target.get("Standard_ColumnName")
+            for candidate in self.candidates(framework_id, std_sheet, std_col):
+                if candidate["votes"] < HISTORY_MIN_VOTES:
+                    break
+                match = _pick_sheet(located.get(normalize(candidate["source_column"]), []),
+                                    candidate["sheets"], std_sheet)
+                if match is None:
+                    continue
+                src_sheet, src_col = match
+                resolved.append({
+                    "Source_ColumnName": src_col,
+                    "Source_SheetName": src_sheet,
+                    "Standard_ColumnName": std_col,
+                    "Standard_SheetName": std_sheet,
+                    "信息类型": target.get("信息类型", ""),
+                    "备注": target.get("备注", ""),
+                    "Confidence": HISTORY_CONFIDENCE,
+                    "Rationale": f"沿用历史映射: {candidate['votes']} 个已保存映射使用该源列 "
+                                 f"(最近: 映射 #{candidate['mapping_ids'][0]})，未调用LLM",
+                    "Provenance": {
+                        "source": "history",
+                        "votes": candidate["votes"],
+                        "mapping_ids": candidate["mapping_ids"][:5],
+                        "dataset_ids": candidate["dataset_ids"][:5],
+                    },
+                })
+                break
+        return resolved
+
+
+def _pick_sheet(found: List[Tuple[str, str]], history_sheets: List[str], std_sheet: str) -> Optional[Tuple[str, str]]:
+    """Where the historical column lives in the new dataset; ``None`` if ambiguous."""
+    if len(found) <= 1:
+        return found[0] if found else None
+    for sheet in history_sheets:
+        same = [f for f in found if f[0] == sheet]
+        if same:
+            return same[0]
+    named = [f for f in found if std_sheet and std_sheet.lower() in f[0].lower()]
+    return named[0] if len(named) == 1 else None
+
+
+def remove_resolved(request_data: Dict[str, Any], resolved: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """``request_data`` without the target columns in ``resolved``."""
+    done = {(m["Standard_SheetName"], m["Standard_ColumnName"]) for m in resolved}
+    target = dict(request_data.get("target", {}))
+    target["mappings"] = [
+        m for m in target.get("mappings", [])
+        if (m.get("Standard_SheetName", ""), m.get("Standard_ColumnName")) not in done
+    ]
+    return dict(request_data, target=target)
+
+
+mapping_history = MappingHistory()
@@ -0,0 +1,255 @@
+"""
+并行导入
+
+Parses source workbooks in a process pool, each task a run of sheets of one
+workbook (opened once), while a single writer stage in the parent process
+batches the inserts. Datasets and sheets are created up front in a stable order,
+and each worker numbers its own rows, so ``row_index`` and sheet order are
+identical to a serial import.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Text, bindparam, delete, insert, update
+from sqlalchemy.engine import Engine
+
+from .. import models
+from . import search_index
+from .column_profiler import ColumnProfiler
+from .excel_ingestion import (
+    BATCH_SIZE, IngestStats, ProgressCallback, SheetHasher, WorkbookReader, encode_row, file_content_hash,
+    list_sheet_names, write_profiles,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows buffered by the writer before one executemany + commit
+WRITE_BATCH_SIZE = 10000
+# Parsed batches allowed in flight between workers and the writer (bounds memory)
+QUEUE_MAX_BATCHES = 64
+
+_insert_encoded_rows = insert(models.DatasetRow.__table__).values(
+    sheet_id=bindparam("sheet_id"),
+    row_index=bindparam("row_index"),
+    # Workers serialize rows themselves, so the writer passes the JSON text through untouched
+    data=bindparam("data", type_=Text()),
+)
+
+_sheets_table = models.DatasetSheet.__table__
+_set_sheet_meta = update(_sheets_table).where(_sheets_table.c.id == bindparam("sheet_id")).values(
+    column_names=bindparam("sheet_columns", type_=_sheets_table.c.column_names.type),
+    row_count=bindparam("sheet_rows"),
+    content_hash=bindparam("sheet_hash"),
+)
+
+
+@dataclass
+class SheetTask:
+    sheet_id: int
+    file_path: str
+    sheet_name: str
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _mp_context():
+    # Forking a multi-threaded process (e.g. the API server) can deadlock the children; spawn there
+    if threading.current_thread() is not threading.main_thread():
+        return multiprocessing.get_context("spawn")
+    return multiprocessing.get_context()
+
+
+# Set in every pool process by ``_init_worker``: a plain queue can only be handed over at process start
+_out_queue = None
+
+
+def _init_worker(out_queue) -> None:
+    global _out_queue
+    _out_queue = out_queue
+
+
+def worker_batches(tasks: List[SheetTask], workers: int) -> List[List[SheetTask]]:
+    """Split ``tasks`` into about ``workers`` runs of consecutive sheets of the same workbook.
+
+    Each run is parsed by one pool task that opens its workbook once (shared
+    strings and styles are parsed once), instead of once per sheet.
+    """
+    per_batch = max(1, -(-len(tasks) // max(1, workers)))
+    batches: List[List[SheetTask]] = []
+    for task in tasks:
+        current = batches[-1] if batches else None
+        if current and current[0].file_path == task.file_path and len(current) < per_batch:
+            current.append(task)
+        else:
+            batches.append([task])
+    return batches
+
+
+def _parse_sheets_worker(tasks: List[SheetTask], batch_size: int) -> int:
+    """Process-pool entry point: stream sheets of one workbook and push encoded batches to the writer."""
+    total = 0
+    try:
+        reader = WorkbookReader(tasks[0].file_path)
+    except Exception as exc:
+        for task in tasks:
+            _out_queue.put(("error", task.sheet_id, 0, f"{type(exc).__name__}: {exc}"))
+        return total
+    with reader:
+        for task in tasks:
+            row_count = 0
+            try:
+                columns, batches = reader.iter_sheet(task.sheet_name, batch_size=batch_size)
+                hasher = SheetHasher(columns)
+                profiler = ColumnProfiler(columns)
+                for batch in batches:
+                    hasher.update(batch)
+                    profiler.update(batch)
+                    encoded = [json.dumps(encode_row(columns, row), ensure_ascii=False) for row in batch]
+                    _out_queue.put(("rows", task.sheet_id, row_count, encoded))
+                    row_count += len(batch)
+                profiles = profiler.results()
+                entries = search_index.build_entries(columns, profiler, profiles)
+                _out_queue.put(("done", task.sheet_id, row_count, (columns, hasher.hexdigest(), profiles, entries)))
+            except Exception as exc:
+                _out_queue.put(("error", task.sheet_id, row_count, f"{type(exc).__name__}: {exc}"))
+            total += row_count
+    return total
+
+
+def create_dataset_sheets(engine: Engine, datasets: List[Tuple[str, str]]) -> Tuple[Dict[str, int], List[SheetTask]]:
+    """Create every dataset and its sheets in one transaction, in input order.
+
+    ``datasets`` is a list of ``(dataset_name, file_path)``. Returns the dataset ids
+    by name and the sheet tasks to hand to the pool.
+    """
+    dataset_ids: Dict[str, int] = {}
+    tasks: List[SheetTask] = []
+    with engine.begin() as conn:
+        for dataset_name, file_path in datasets:
+            try:
+                sheet_names = list_sheet_names(file_path)
+            except Exception as exc:
+                logger.error("Cannot read workbook %s: %s", file_path, exc)
+                print(f"    Error reading source excel {os.path.basename(file_path)}: {exc}")
+                continue
+            result = conn.execute(insert(models.Dataset.__table__).values(
+                name=dataset_name, content_hash=file_content_hash(file_path)
+            ))
+            dataset_id = result.inserted_primary_key[0]
+            dataset_ids[dataset_name] = dataset_id
+            for sheet_name in sheet_names:
+                result = conn.execute(
+                    insert(models.DatasetSheet.__table__).values(dataset_id=dataset_id, name=sheet_name)
+                )
+                tasks.append(SheetTask(result.inserted_primary_key[0], file_path, sheet_name))
+    return dataset_ids, tasks
+
+
+def _flush(engine: Engine, buffered: List[dict]) -> None:
+    if buffered:
+        with engine.begin() as conn:
+            conn.execute(_insert_encoded_rows, buffered)
+
+
+def run_sheet_tasks(engine: Engine, tasks: List[SheetTask], workers: Optional[int] = None,
+                    batch_size: int = BATCH_SIZE, write_batch_size: int = WRITE_BATCH_SIZE,
+                    progress: Optional[ProgressCallback] = None) -> IngestStats:
+    """Parse ``tasks`` in a process pool and write their rows from this process."""
+    workers = max(1, workers or default_workers())
+    stats = IngestStats()
+    started = time.perf_counter()
+    if not tasks:
+        return stats
+
+    pending = {t.sheet_id: t for t in tasks}
+    failed: List[SheetTask] = []
+    buffered: List[dict] = []
+    sheet_meta: List[dict] = []
+    profiles_by_sheet: Dict[int, List[dict]] = {}
+    entries_by_sheet: Dict[int, List[dict]] = {}
+
+    ctx = _mp_context()
+    out_queue = ctx.Queue(maxsize=QUEUE_MAX_BATCHES)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(out_queue,)) as pool:
+            futures = [pool.submit(_parse_sheets_worker, batch, batch_size) for batch in worker_batches(tasks, workers)]
+
+            while pending:
+                try:
+                    kind, sheet_id, start_index, payload = out_queue.get(timeout=0.5)
+                except queue_module.Empty:
+                    # A worker that returned has reported all its sheets (they may still be in transit);
+                    # one that died (e.g. killed) breaks the pool and its sheets never arrive
+                    if all(f.done() for f in futures) and any(f.exception() is not None for f in futures):
+                        for sheet_id in list(pending):
+                            failed.append(pending.pop(sheet_id))
+                    continue
+
+                if kind == "rows":
+                    buffered.extend(
+                        {"sheet_id": sheet_id, "row_index": start_index + i, "data": data}
+                        for i, data in enumerate(payload)
+                    )
+                    if progress:
+                        progress(rows=len(payload))
+                    if len(buffered) >= write_batch_size:
+                        _flush(engine, buffered)
+                        stats.rows += len(buffered)
+                        buffered = []
+                elif kind == "done":
+                    task = pending.pop(sheet_id)
+                    stats.sheets += 1
+                    columns, content_hash, profiles, entries = payload
+                    sheet_meta.append({
+                        "sheet_id": sheet_id, "sheet_columns": columns, "sheet_rows": start_index, "sheet_hash": content_hash,
+                    })
+                    profiles_by_sheet[sheet_id] = profiles
+                    entries_by_sheet[sheet_id] = entries
+                    if progress:
+                        progress(sheets=1)
+                    logger.info("Parsed sheet %s (%d rows) from %s", task.sheet_name, start_index,
+                                os.path.basename(task.file_path))
+                else:
+                    task = pending.pop(sheet_id)
+                    failed.append(task)
+                    print(f"    Error reading sheet '{task.sheet_name}' of {os.path.basename(task.file_path)}: {payload}")
+
+            _flush(engine, buffered)
+            stats.rows += len(buffered)
+    finally:
+        out_queue.close()
+
+    with engine.begin() as conn:
+        if sheet_meta:
+            conn.execute(_set_sheet_meta, sheet_meta)
+        write_profiles(conn, profiles_by_sheet)
+        search_index.write_index(conn, entries_by_sheet)
+        if failed:
+            # Never leave half-imported sheets behind; a missing hash makes the next incremental run retry them
+            failed_ids = [t.sheet_id for t in failed]
+            conn.execute(delete(models.DatasetRow.__table__).where(models.DatasetRow.sheet_id.in_(failed_ids)))
+            conn.execute(delete(models.ColumnProfile.__table__).where(models.ColumnProfile.sheet_id.in_(failed_ids)))
+            search_index.delete_index(conn, failed_ids)
+            conn.execute(update(_sheets_table).where(_sheets_table.c.id.in_(failed_ids)).values(content_hash=None, row_count=0))
+            stats.failed_sheet_ids.extend(failed_ids)
+
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def import_datasets_parallel(engine: Engine, datasets: List[Tuple[str, str]], workers: Optional[int] = None,
+                             batch_size: int = BATCH_SIZE) -> IngestStats:
+    """Import ``(dataset_name, file_path)`` pairs, parsing sheets with ``workers`` processes."""
+    _, tasks = create_dataset_sheets(engine, datasets)
+    return run_sheet_tasks(engine, tasks, workers=workers, batch_size=batch_size)
@@ -0,0 +1,66 @@
+"""
+列预览缓存
+
+Process-local LRU cache for column preview values, keyed by
+``(dataset_id, sheet_name, column_name, limit)``. Every entry remembers the sheet
+id and content hash it was computed from, so a re-import done by another process
+(e.g. the seed script) is noticed on the next read; imports running inside the
+API process also drop a dataset's entries eagerly via ``invalidate_dataset``.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE", "2048"))
+
+
+class LRUCache:
+    """Thread-safe LRU map of ``key -> (token, value)``; a hit requires a matching token."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, token: Any = None) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != token:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, token: Any = None) -> None:
+        with self._lock:
+            self._entries[key] = (token, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate) -> int:
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+column_previews = LRUCache(PREVIEW_CACHE_SIZE)
+
+
+def invalidate_dataset(dataset_id: int) -> int:
+    """Drop every cached preview of one dataset (keys start with its id)."""
+    return column_previews.invalidate(lambda key: key[0] == dataset_id)
@@ -1,89 +1,444 @@
+import asyncio
+import functools
 import json
+from contextlib import contextmanager
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from .llm_factory import get_default_llm
+import math
+import time
+from .llm_factory import (
+    LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_BATCH_TOKEN_BUDGET, LLM_ESCALATION_THRESHOLD, LLM_MAX_ATTEMPTS,
+    get_default_llm, get_rate_limiter,
+)
+from .candidate_matcher import (
+    ABBREVIATIONS, CANDIDATE_AUTO_RESOLVE, CANDIDATE_TOP_K, TERM_TRANSLATIONS,
+)
+from .incremental_json import IncrementalObjectParser
+from .sheet_router import SHEET_MEANINGS, SheetRouter
+from .hedging import hedge_policy
+from .llm_cache import cache_key, describe_llm, llm_cache
+from .rate_limiter import backoff_delay, estimate_tokens
+
+# Sheet groups of one generation queued for the LLM at the same time (the shared
+# rate limiter decides how many actually run across all generations)
+SHEET_GROUP_CONCURRENCY = 5
+# Output tokens reserved per target column (one mapping object)
+OUTPUT_TOKENS_PER_COLUMN = 80
+# Rationale of the placeholders emitted when the LLM gave up on a batch ("retry failed sheets" looks for it)
+FAILED_PLACEHOLDER_PREFIX = "Processing failed"
+# Mappings below this confidence keep their standard column but get no source column
+MIN_CONFIDENCE = 0.8
+
+class LLMUsage:
+    """Per-tier LLM calls, latency and tokens of one generation (``previous`` continues a resumed job's totals)"""
+
+    FIELDS = ("calls", "cache_hits", "seconds", "max_seconds", "tokens", "escalated_columns")
+
+    def __init__(self, previous=None):
+        self.tiers = {}
+        for tier, stats in (previous or {}).items():
+            self._tier(tier, stats.get("model")).update({k: stats.get(k, 0) for k in self.FIELDS})
+
+    def _tier(self, tier, model=None):
+        stats = self.tiers.setdefault(tier, dict({k: 0 for k in self.FIELDS}, model=model))
+        stats["model"] = model or stats["model"]
+        return stats
+
+    def cache_hit(self, tier, model):
+        self._tier(tier, model)["cache_hits"] += 1
+
+    def escalated(self, tier, columns):
+        self._tier(tier)["escalated_columns"] += columns
+
+    @contextmanager
+    def call(self, tier, model, prompt, permit):
+        """Times one LLM call; set ``call["response"]`` so tokens can be estimated if the provider reports none"""
+        call = {"response": ""}
+        started = time.perf_counter()
+        try:
+            yield call
+        finally:
+            seconds = time.perf_counter() - started
+            stats = self._tier(tier, model)
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["tokens"] += permit.used_tokens or estimate_tokens(prompt) + estimate_tokens(call["response"])
+
+    def summary(self):
+        return {
+            tier: dict(
+                stats,
+                seconds=round(stats["seconds"], 3),
+                max_seconds=round(stats["max_seconds"], 3),
+                avg_seconds=round(stats["seconds"] / stats["calls"], 3) if stats["calls"] else None,
+            )
+            for tier, stats in self.tiers.items()
+        }
 
-def process_request_with_llm_stream(request_data, llm):
-    """Process a single request file using LLM and yield results per sheet group in parallel"""
-    
-    source_data = request_data.get('source', {})
-    target_data = request_data.get('target', {})
-    
-    # Group target mappings by Standard_SheetName
+def group_target_mappings(target_data):
+    """Group target mappings by Standard_SheetName -> {Standard_ColumnName: mapping}"""
     sheet_groups = {}
     for mapping in target_data.get('mappings', []):
         sheet_name = mapping.get('Standard_SheetName', 'Unknown')
         if sheet_name not in sheet_groups:
             sheet_groups[sheet_name] = {}
         sheet_groups[sheet_name][mapping.get('Standard_ColumnName')] = mapping
-    
-    # Process sheet groups concurrently
-    # Use max_workers=5 to avoid hitting rate limits too hard while getting speedup
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_sheet = {
-            executor.submit(_process_single_sheet_task, sheet_name, sheet_mappings_dict, source_data, llm): sheet_name
-            for sheet_name, sheet_mappings_dict in sheet_groups.items()
-        }
-        
-        for future in as_completed(future_to_sheet):
-            sheet_name = future_to_sheet[future]
-            try:
-                sheet_result = future.result()
-                if sheet_result:
-                    yield sheet_result
-            except Exception as e:
-                print(f"    ❌ Critical error in thread for sheet {sheet_name}: {e}")
-                # Yield error placeholders as fallback
-                yield _generate_placeholders(sheet_name, sheet_groups[sheet_name], str(e))
-
-def _process_single_sheet_task(sheet_name, sheet_mappings_dict, source_data, llm):
-    """Helper function to process a single sheet group (runs in thread)"""
-    sheet_mappings = list(sheet_mappings_dict.values())
-    print(f"  📋 Processing sheet: {sheet_name} ({len(sheet_mappings)} columns)")
-    
-    # Optimization: Filter Source Data
-    source_sheets = source_data.get('sheets', {})
-    matching_source_sheets = []
-    
-    for src_sheet in source_sheets.keys():
-        # Check if standard sheet name is part of source sheet name (case-insensitive)
-        if sheet_name.lower() in src_sheet.lower():
-            matching_source_sheets.append(src_sheet)
-    
-    filtered_source_data = source_data
-    if matching_source_sheets:
-        print(f"    🔍 Optimization: Found matching source sheets: {matching_source_sheets}")
-        filtered_source_data = {
-            "description": source_data.get("description", ""),
-            "sheets": {k: v for k, v in source_sheets.items() if k in matching_source_sheets}
-        }
-    else:
-         print(f"    ⚠️ No direct sheet match found for '{sheet_name}', using all source sheets.")
+    return sheet_groups
+
+def chunk_sheet_group(sheet_name, sheet_mappings_dict, token_budget=LLM_BATCH_TOKEN_BUDGET):
+    """Split one sheet group into batches whose schema + expected output fit ``token_budget``
+
+    Batches are balanced (similar cost each) and keep the framework's column order.
+    Returns a list of ``{Standard_ColumnName: mapping}`` dicts.
+    """
+    costs = [
+        (col, mapping, estimate_tokens(build_sheet_target_schema(sheet_name, [mapping])) + OUTPUT_TOKENS_PER_COLUMN)
+        for col, mapping in sheet_mappings_dict.items()
+    ]
+    total = sum(cost for _, _, cost in costs)
+    if total <= token_budget:
+        return [sheet_mappings_dict]
+
+    target = total / math.ceil(total / token_budget)
+    batches, current, current_cost = [], {}, 0
+    for col, mapping, cost in costs:
+        if current and (current_cost + cost > token_budget or current_cost >= target):
+            batches.append(current)
+            current, current_cost = {}, 0
+        current[col] = mapping
+        current_cost += cost
+    if current:
+        batches.append(current)
+    return batches
+
+async def process_request_with_llm_stream(request_data, llm, use_cache=True, concurrency=SHEET_GROUP_CONCURRENCY,
+                                          strong_llm=None, usage=None, semaphore=None):
+    """Process a single request using LLM and yield mappings as soon as they are generated
+
+    Every sheet group is split into token-budgeted batches (``chunk_sheet_group``);
+    batches run concurrently on the event loop, at most ``concurrency`` at a time,
+    and stream their output through an incremental JSON parser, so each mapping
+    is yielded once its object has closed. A yielded chunk is every mapping that
+    became available since the previous one. Each standard column is yielded
+    exactly once (a placeholder if it could not be mapped).
+    ``use_cache=False`` skips the response cache and always calls the model.
+
+    Each group only sees the source sheets ``SheetRouter`` ranks highest for it.
+    Before any LLM call, ``CandidateMatcher`` resolves near-exact column matches
+    directly (yielded first) and narrows each batch's prompt to the top-k
+    candidate source columns of its targets.
+
+    With ``strong_llm`` (two-tier mode) ``llm`` is the fast tier: its mappings
+    below ``LLM_ESCALATION_THRESHOLD`` and its placeholders are held back and
+    only those columns are re-asked to ``strong_llm``; the more confident answer
+    is yielded. ``usage`` (an ``LLMUsage``) collects calls, latency and tokens per tier.
+    A ``semaphore`` shared by several generations (a batch) replaces the
+    per-generation ``concurrency`` limit.
+    """
+    source_data = request_data.get('source', {})
+    sheet_groups = group_target_mappings(request_data.get('target', {}))
+    if not sheet_groups:
+        return
+
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    tasks = []
+    # Routing and candidate matching are CPU-bound; keep them off the shared event loop
+    plans, resolved = await asyncio.to_thread(_plan_sheet_groups, source_data, sheet_groups)
+    for sheet_name, sheet_mappings_dict, filtered_source_data, matcher, candidates in plans:
+        batches = chunk_sheet_group(sheet_name, sheet_mappings_dict)
+        for index, batch in enumerate(batches, start=1):
+            label = sheet_name if len(batches) == 1 else f"{sheet_name} [{index}/{len(batches)}]"
+            if strong_llm is not None:
+                emitter = _BatchEmitter(batch, queue, tier="fast", hold_below=LLM_ESCALATION_THRESHOLD)
+            else:
+                emitter = _BatchEmitter(batch, queue)
+            tasks.append(asyncio.create_task(_guarded_sheet_task(
+                sheet_name, emitter, filtered_source_data, llm, semaphore, use_cache, label,
+                matcher=matcher, candidates=candidates, strong_llm=strong_llm, usage=usage,
+            )))
+
+    if resolved:
+        yield resolved
+
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            chunk = []
+            while True:
+                if item is _BATCH_DONE:
+                    remaining -= 1
+                else:
+                    chunk.extend(item)
+                if queue.empty():
+                    break
+                item = queue.get_nowait()
+            if chunk:
+                yield chunk
+    finally:
+        # Client went away (or we failed): stop the batches still waiting on the LLM
+        for task in tasks:
+            task.cancel()
+
+def _plan_sheet_groups(source_data, sheet_groups):
+    """Route every sheet group and resolve its near-exact columns
+
+    Returns ``(plans, resolved)``: a ``(sheet_name, columns left for the LLM,
+    routed source_data, matcher, candidates)`` tuple per group that still needs
+    the LLM, and the lexically resolved mappings. The source columns are
+    vectorized once, by the router; each group's matcher is a subset of it.
+    """
+    plans = []
+    resolved = []
+    router = SheetRouter(source_data)
+    for sheet_name, sheet_mappings_dict in sheet_groups.items():
+        filtered_source_data = router.route(sheet_name, sheet_mappings_dict)
+        matcher = router.matcher.subset(filtered_source_data)
+        candidates = matcher.match(sheet_mappings_dict) if CANDIDATE_TOP_K > 0 else None
+        if candidates and CANDIDATE_AUTO_RESOLVE:
+            sheet_resolved = matcher.resolve(sheet_name, sheet_mappings_dict, candidates)
+            if sheet_resolved:
+                print(f"  🎯 Resolved {len(sheet_resolved)}/{len(sheet_mappings_dict)} columns of {sheet_name} "
+                      f"lexically, no LLM call")
+                done = {m["Standard_ColumnName"] for m in sheet_resolved}
+                sheet_mappings_dict = {k: v for k, v in sheet_mappings_dict.items() if k not in done}
+                resolved.extend(sheet_resolved)
+        if sheet_mappings_dict:
+            plans.append((sheet_name, sheet_mappings_dict, filtered_source_data, matcher, candidates))
+    return plans, resolved
+
+_BATCH_DONE = object()
+
+class _BatchEmitter:
+    """Forwards a batch's validated mappings to the stream, each standard column only once
+
+    ``tier`` is recorded in the mappings' provenance. With ``hold_below``,
+    mappings under that confidence are kept in ``held`` for the strong tier
+    instead of being forwarded; ``fallback`` (the fast tier's held mappings)
+    replaces a strong-tier answer that is less confident.
+    """
+
+    def __init__(self, sheet_mappings_dict, queue, tier=None, hold_below=None, fallback=None):
+        self.sheet_mappings_dict = sheet_mappings_dict
+        self.queue = queue
+        self.tier = tier or "default"
+        self.hold_below = hold_below
+        self.fallback = fallback or {}
+        self.emitted = set()
+        self.held = {}
+
+    def pending(self):
+        return {col: m for col, m in self.sheet_mappings_dict.items() if col not in self.emitted}
+
+    def emit(self, mappings):
+        fresh = []
+        for m in mappings:
+            col = m.get("Standard_ColumnName")
+            if col not in self.sheet_mappings_dict or col in self.emitted:
+                continue
+            self.emitted.add(col)
+            if self.tier != "default" and "Provenance" not in m:
+                m = dict(m, Provenance={"source": "llm", "tier": self.tier})
+            if self.hold_below is not None and m.get("Confidence", 0.0) < self.hold_below:
+                self.held[col] = m
+                continue
+            previous = self.fallback.get(col)
+            if previous is not None and previous.get("Confidence", 0.0) > m.get("Confidence", 0.0):
+                m = previous
+            fresh.append(m)
+        if fresh:
+            self.queue.put_nowait(fresh)
+        return len(fresh)
+
+    def escalation(self):
+        """Emitter for re-asking the held columns to the strong tier"""
+        held = {col: self.sheet_mappings_dict[col] for col in self.held}
+        return _BatchEmitter(held, self.queue, tier="strong", fallback=self.held)
+
+    def release_held(self, answered=()):
+        """Forward the held mappings the strong tier did not answer"""
+        rest = [m for col, m in self.held.items() if col not in answered]
+        if rest:
+            self.queue.put_nowait(rest)
+
+    def done(self):
+        self.queue.put_nowait(_BATCH_DONE)
+
+class _AttemptStage:
+    """Mappings streamed by one LLM call, forwarded to the emitter only while no hedge races it
+
+    Once a hedge is sent both calls buffer what they parse, and only the call
+    whose response is taken gets its buffer committed, so the stream never
+    mixes two responses.
+    """
+
+    def __init__(self, emitter, live=True):
+        self.emitter = emitter
+        self.live = live
+        self.buffered = []
+
+    def emit(self, mappings):
+        if self.live:
+            return self.emitter.emit(mappings)
+        self.buffered.extend(mappings)
+        return 0
+
+    def commit(self):
+        buffered, self.buffered = self.buffered, []
+        return self.emitter.emit(buffered)
+
+async def _guarded_sheet_task(sheet_name, emitter, source_data, llm, semaphore, use_cache, label=None,
+                              matcher=None, candidates=None, strong_llm=None, usage=None):
+    label = label or sheet_name
+    escalation = None
+    try:
+        await _process_single_sheet_task(
+            sheet_name, emitter, source_data, llm, semaphore, use_cache, label, matcher, candidates, usage
+        )
+        if strong_llm is not None and emitter.held:
+            escalation = emitter.escalation()
+            print(f"    ⬆️ Escalating {len(emitter.held)} low-confidence columns of {label} to the strong model")
+            if usage is not None:
+                usage.escalated("strong", len(emitter.held))
+            await _process_single_sheet_task(
+                sheet_name, escalation, source_data, strong_llm, semaphore, use_cache, f"{label} (strong)",
+                matcher, candidates, usage
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"    ❌ Critical error for sheet {label}: {e}")
+        # Placeholders for whatever was not emitted yet
+        emitter.emit(_generate_placeholders(sheet_name, emitter.pending(), str(e)))
+    finally:
+        emitter.release_held(escalation.emitted if escalation else ())
+        emitter.done()
+
+def _cached_sheet_result(key, sheet_name, sheet_mappings_dict, use_cache):
+    cached = llm_cache.get(key, use_cache=use_cache)
+    if cached is None:
+        return None
+    sheet_result = parse_llm_response(cached, sheet_mappings_dict)
+    if sheet_result:
+        print(f"    ⚡ Cache hit: {len(sheet_result)} mappings for {sheet_name}")
+        return sheet_result
+    llm_cache.discard(key)
+    return None
+
+async def _stream_sheet_response(llm, prompt, pending, stage, permit):
+    """Stream one LLM call, emitting every valid mapping as soon as its JSON object closes
+
+    A standard column the response answers twice keeps its first mapping, since
+    that one has already been streamed (``parse_llm_response``, used for cache
+    replays, keeps the most confident). Returns the full response text.
+    """
+    parser = IncrementalObjectParser(required_key="Standard_ColumnName")
+    async for message in llm.astream(prompt):
+        content = message.content if hasattr(message, 'content') else str(message)
+        candidates = [validate_mapping(obj, pending) for obj in parser.feed(content)]
+        stage.emit([c for c in candidates if c is not None])
+        usage = response_token_usage(message)
+        if usage:
+            permit.used_tokens = usage
+    return parser.text
+
+async def _process_single_sheet_task(sheet_name, emitter, source_data, llm, semaphore, use_cache=True, label=None,
+                                     matcher=None, candidates=None, usage=None):
+    """Process a single sheet group (or batch of one): cached response if any, otherwise up to LLM_MAX_ATTEMPTS LLM calls
+
+    ``source_data`` is already limited to the sheets routed to it (``SheetRouter``);
+    with ``matcher``/``candidates`` the prompt only lists the candidate source
+    columns of the pending targets. Mappings are emitted while the response
+    streams in; a retry only asks for the columns that have not been emitted yet.
+    A hedge likewise only asks for the columns the slow call has not emitted, and
+    from then on only the response that is taken reaches the stream (``_AttemptStage``).
+    """
+    label = label or sheet_name
+    print(f"  📋 Processing sheet: {label} ({len(emitter.sheet_mappings_dict)} columns)")
+    model_name, temperature = describe_llm(llm)
+    limiter = get_rate_limiter()
+    usage = usage if usage is not None else LLMUsage()
+
+    def sheet_prompt(pending):
+        # Create prompt for the columns still missing
+        prompt_source = matcher.restrict(candidates, pending) if matcher and candidates else source_data
+        return create_sheet_group_prompt(prompt_source, sheet_name, list(pending.values()))
 
-    # Create prompt for this sheet group
-    prompt = create_sheet_group_prompt(filtered_source_data, sheet_name, sheet_mappings)
-    
-    max_attempts = 3
     last_error = None
-    
-    for attempt in range(1, max_attempts + 1):
-        try:
-            response = llm.invoke(prompt)
-            sheet_result = parse_llm_response(response, sheet_mappings_dict)
-            
+    for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+        # A permit per attempt: a batch backing off does not hold a slot other batches could use
+        async with semaphore:
+            pending = emitter.pending()
+            if not pending:
+                return
+
+            prompt = sheet_prompt(pending)
+            # Identical prompt for the same model and temperature: replay the stored response
+            key = cache_key(model_name, temperature, prompt)
+            # The cache is SQLite behind a process-wide lock: keep it off the shared event loop
+            sheet_result = await asyncio.to_thread(_cached_sheet_result, key, label, pending, use_cache)
             if sheet_result:
-                print(f"    ✅ Generated {len(sheet_result)} mappings for {sheet_name}")
-                return sheet_result
-            
-            if attempt < max_attempts:
-                print(f"    ⚠️ Parse failed (attempt {attempt}/{max_attempts}) for {sheet_name}, retrying...")
-        except Exception as e:
-            last_error = str(e)
-            if attempt < max_attempts:
-                print(f"    ⚠️ Error processing sheet {sheet_name}: {e}, retrying...")
-    
-    print(f"    ❌ Failed to process sheet {sheet_name}. Returning placeholders.")
-    return _generate_placeholders(sheet_name, sheet_mappings_dict, last_error)
+                usage.cache_hit(emitter.tier, model_name)
+                emitter.emit(sheet_result)
+                return
+
+            stages = []
+
+            async def sheet_call(sent, prompt=prompt, pending=pending, key=key, stages=stages):
+                if stages:
+                    # A hedge: the slow call stops streaming and the hedge asks for what it has not emitted
+                    for stage in stages:
+                        stage.live = False
+                    pending = emitter.pending()
+                    if not pending:
+                        return "", [], _AttemptStage(emitter, live=False), key
+                    prompt = sheet_prompt(pending)
+                    key = cache_key(model_name, temperature, prompt)
+                stage = _AttemptStage(emitter, live=not stages)
+                stages.append(stage)
+                reserved_tokens = estimate_tokens(prompt) + OUTPUT_TOKENS_PER_COLUMN * len(pending)
+                async with limiter.slot(reserved_tokens) as permit:
+                    sent()
+                    with usage.call(emitter.tier, model_name, prompt, permit) as call:
+                        content = await _stream_sheet_response(llm, prompt, pending, stage, permit)
+                        call["response"] = content
+                # The whole document parsed: columns the LLM skipped get their placeholder now
+                return content, parse_llm_response(content, pending), stage, key
+
+            try:
+                # A call slower than the model's usual tail latency is raced against a duplicate
+                content, sheet_result, stage, call_key = await hedge_policy.run(
+                    model_name, sheet_call, accept=lambda r: bool(r[1])
+                )
+                stage.commit()
+                if sheet_result:
+                    # Only responses that parsed are worth replaying, under the prompt that produced them
+                    await asyncio.to_thread(llm_cache.put, call_key, content, model=model_name, use_cache=use_cache)
+                    emitter.emit(sheet_result)
+                    print(f"    ✅ Generated {len(sheet_result)} mappings for {label}")
+                    return
+
+                if attempt < LLM_MAX_ATTEMPTS:
+                    print(f"    ⚠️ Parse failed (attempt {attempt}/{LLM_MAX_ATTEMPTS}) for {label}, "
+                          f"retrying {len(emitter.pending())} columns...")
+            except Exception as e:
+                last_error = str(e)
+                if attempt < LLM_MAX_ATTEMPTS:
+                    print(f"    ⚠️ Error processing sheet {label}: {e}, retrying {len(emitter.pending())} columns...")
+        if attempt < LLM_MAX_ATTEMPTS:
+            await asyncio.sleep(backoff_delay(attempt, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX))
+
+    print(f"    ❌ Failed to process sheet {label}. Returning placeholders.")
+    emitter.emit(_generate_placeholders(sheet_name, emitter.pending(), last_error))
+
+def response_token_usage(response):
+    """Total tokens reported by the provider, if any (used to correct the limiter's estimate)"""
+    usage = getattr(response, 'usage_metadata', None) or {}
+    if usage.get('total_tokens'):
+        return usage['total_tokens']
+    metadata = getattr(response, 'response_metadata', None) or {}
+    return (metadata.get('token_usage') or {}).get('total_tokens')
 
 def _generate_placeholders(sheet_name, sheet_mappings_dict, error_msg):
     """Generate empty placeholder mappings when LLM fails"""
@@ -97,10 +452,15 @@ def _generate_placeholders(sheet_name, sheet_mappings_dict, error_msg):
             "信息类型": original.get("信息类型", ""),
             "备注": original.get("备注", ""),
             "Confidence": 0.0,
-            "Rationale": f"Processing failed: {error_msg}"
+            "Rationale": f"{FAILED_PLACEHOLDER_PREFIX}: {error_msg}",
+            "Provenance": {"source": "placeholder"}
          })
     return placeholders
 
+def is_failed_placeholder(rationale):
+    """Whether a mapping's Rationale marks it as a ``_generate_placeholders`` entry"""
+    return bool(rationale) and rationale.startswith(FAILED_PLACEHOLDER_PREFIX)
+
 def create_sheet_group_prompt(source_data, sheet_name, sheet_mappings):
     """Create focused prompt for a specific target sheet group"""
     
@@ -140,47 +500,65 @@ def build_sheet_context(source_data):
     context = []
     context.append("Business meaning of source sheets:")
     
-    sheet_meanings = {
-        "AE": "Adverse Events - Records of any adverse medical events occurring during the study",
-        "DA1": "Drug Administration - Records of drug exposure and administration details",
-        "DM": "Demographics - Subject demographics and basic study information",
-        "EX": "Exposure - Drug exposure information and administration details",
-        "CM": "Concomitant Medications - Other medications taken during the study",
-        "MH": "Medical History - Subject's pre-existing medical conditions",
-        "VS": "Vital Signs - Measurements of basic body functions",
-        "LB": "Laboratory - Clinical laboratory test results"
-    }
-    
     for sheet_name in source_data.get('sheets', {}).keys():
-        meaning = sheet_meanings.get(sheet_name, f"{sheet_name} - Study data sheet")
+        meaning = SHEET_MEANINGS.get(sheet_name, f"{sheet_name} - Study data sheet")
         context.append(f"- **{sheet_name}**: {meaning}")
     
     return "\n".join(context)
 
 def build_source_summary(source_data):
-    """Build formatted source data summary"""
+    """Build formatted source data summary
+
+    Each sheet's fragment is memoized on what it shows (``_sheet_summary``), so
+    groups and batch pairs sharing a source summary format it only once; the
+    source dicts themselves are left untouched.
+    """
     summary = []
     summary.append("Available source sheets and their columns:")
     
     for sheet_name, sheet_info in source_data.get('sheets', {}).items():
-        summary.append(f"\n### Sheet: {sheet_name}")
-        summary.append(f"Row Count: {sheet_info.get('row_count', 'N/A')}")
-        summary.append("Columns:")
+        summary.append(_sheet_summary(sheet_name, sheet_info.get('row_count', 'N/A'), _summary_columns(sheet_info)))
+    
+    return "\n".join(summary)
+
+def _summary_columns(sheet_info):
+    """``(name, data type, first samples, sample count, null ratio, distinct count)`` per column, hashable"""
+    columns = []
+    for col_info in sheet_info.get('columns', []):
+        sample_vals = col_info.get('sample_values') or []
+        columns.append((
+            col_info.get('name', ''), col_info.get('data_type', 'unknown'),
+            tuple(str(v) for v in sample_vals[:3]), len(sample_vals),
+            col_info.get('null_ratio'), col_info.get('distinct_count'),
+        ))
+    return tuple(columns)
+
+@functools.lru_cache(maxsize=1024)
+def _sheet_summary(sheet_name, row_count, columns):
+    """One sheet's part of ``build_source_summary``"""
+    summary = []
+    summary.append(f"\n### Sheet: {sheet_name}")
+    summary.append(f"Row Count: {row_count}")
+    summary.append("Columns:")
+    
+    for col_name, data_type, samples, sample_count, null_ratio, distinct_count in columns:
+        # Format sample values
+        if samples:
+            sample_str = ', '.join(samples)
+            if sample_count > 3:
+                sample_str += f", ... ({sample_count} total)"
+        else:
+            sample_str = "No data"
         
-        for col_info in sheet_info.get('columns', []):
-            col_name = col_info.get('name', '')
-            sample_vals = col_info.get('sample_values', [])
-            data_type = col_info.get('data_type', 'unknown')
-            
-            # Format sample values
-            if sample_vals:
-                sample_str = ', '.join(str(v) for v in sample_vals[:3])
-                if len(sample_vals) > 3:
-                    sample_str += f", ... ({len(sample_vals)} total)"
-            else:
-                sample_str = "No data"
-            
-            summary.append(f"  - `{col_name}` ({data_type}): {sample_str}")
+        # Import-time profile stats, when available
+        stats = []
+        if null_ratio is not None:
+            stats.append(f"{null_ratio:.0%} empty")
+        if distinct_count is not None:
+            stats.append(f"{distinct_count} distinct")
+        type_str = ", ".join([data_type] + stats)
+        
+        summary.append(f"  - `{col_name}` ({type_str}): {sample_str}")
     
     return "\n".join(summary)
 
@@ -201,45 +579,20 @@ def build_sheet_target_schema(sheet_name, sheet_mappings):
     
     return "\n".join(schema)
 
+@functools.lru_cache(maxsize=1)
 def build_column_hints():
-    """Build semantic mapping hints between source and target columns"""
+    """Build semantic mapping hints between source and target columns (static, built once per process)"""
     hints = []
     hints.append("Semantic mapping hints to help with column matching:")
     
     # Common Chinese-English mappings
-    common_mappings = {
-        "受试者编号": "Subject ID",
-        "项目编号": "Project ID", 
-        "不良事件": "Adverse Event",
-        "开始日期": "Start Date",
-        "结束日期": "End Date",
-        "给药": "Drug Administration",
-        "剂量": "Dose",
-        "严重性": "Severity",
-        "转归": "Outcome",
-        "因果关系": "Causality",
-        "措施": "Action"
-    }
-    
     hints.append("\n### Common Chinese-English Term Mappings:")
-    for chinese, english in common_mappings.items():
+    for chinese, english in TERM_TRANSLATIONS.items():
         hints.append(f"- {chinese} → {english}")
     
     # Abbreviation hints
     hints.append("\n### Common Abbreviations:")
-    abbr_hints = {
-        "AE": "Adverse Event",
-        "SAE": "Serious Adverse Event", 
-        "DM": "Demographics",
-        "EX": "Exposure",
-        "DAT": "Date",
-        "SER": "Serious",
-        "TERM": "Terminology",
-        "ACN": "Action",
-        "REL": "Relationship"
-    }
-    
-    for abbr, full in abbr_hints.items():
+    for abbr, full in ABBREVIATIONS.items():
         hints.append(f"- {abbr} → {full}")
     
     # Date/Time patterns
@@ -255,8 +608,70 @@ def build_column_hints():
     
     return "\n".join(hints)
 
+def validate_mapping(mapping, sheet_mappings_dict):
+    """Validate and enrich one mapping object from the LLM
+
+    Returns ``None`` for columns we did not ask for; blanks the source below the
+    confidence threshold.
+    """
+    if not isinstance(mapping, dict):
+        return None
+    source_col = mapping.get("Source_ColumnName")
+    source_sheet = mapping.get("Source_SheetName")
+    standard_col = mapping.get("Standard_ColumnName")
+    standard_sheet = mapping.get("Standard_SheetName")
+
+    # STRICT FILTER: Ignore mappings for columns we didn't ask for (Safety Net)
+    if standard_col not in sheet_mappings_dict:
+        return None
+
+    # Get original mapping data (keyed by Standard_ColumnName)
+    original_data = sheet_mappings_dict.get(standard_col, {})
+
+    conf_raw = mapping.get("Confidence", 0.0)
+    try:
+        conf = float(conf_raw)
+    except Exception:
+        conf = 0.0
+
+    resolved_standard_sheet = standard_sheet or original_data.get("Standard_SheetName", "")
+
+    # Blank source info if confidence is below threshold
+    if conf < MIN_CONFIDENCE:
+        source_col = ""
+        source_sheet = ""
+
+    return {
+        "Source_ColumnName": source_col,
+        "Source_SheetName": source_sheet,
+        "Standard_ColumnName": standard_col,
+        "Standard_SheetName": resolved_standard_sheet,
+        "信息类型": original_data.get("信息类型", ""),
+        "备注": original_data.get("备注", ""),
+        "Confidence": conf,
+        "Rationale": mapping.get("Rationale", "")
+    }
+
+def missing_placeholders(sheet_mappings_dict, covered_standard_cols):
+    """Placeholders for the standard columns the LLM did not return"""
+    placeholders = []
+    for std_col in set(sheet_mappings_dict.keys()) - set(covered_standard_cols):
+        original_data = sheet_mappings_dict.get(std_col, {})
+        placeholders.append({
+            "Source_ColumnName": "",
+            "Source_SheetName": "",
+            "Standard_ColumnName": std_col,
+            "Standard_SheetName": original_data.get("Standard_SheetName", ""),
+            "信息类型": original_data.get("信息类型", ""),
+            "备注": original_data.get("备注", ""),
+            "Confidence": 0.0,
+            "Rationale": "LLM未找到匹配，保留占位"
+        })
+    return placeholders
+
 def parse_llm_response(response, sheet_mappings_dict):
     """Parse LLM response and validate against schema"""
+    response_content = ""
     try:
         # Handle langchain response format
         response_content = response.content if hasattr(response, 'content') else str(response)
@@ -275,71 +690,24 @@ def parse_llm_response(response, sheet_mappings_dict):
         # Extract mappings
         mappings = parsed_response.get('mappings', [])
         
-# Validate and enrich each mapping
+        # Validate and enrich each mapping, keeping the most confident one per standard column
         best_by_standard = {}
         covered_standard_cols = set()
         for mapping in mappings:
-            source_col = mapping.get("Source_ColumnName")
-            source_sheet = mapping.get("Source_SheetName")
-            standard_col = mapping.get("Standard_ColumnName")
-            standard_sheet = mapping.get("Standard_SheetName")
-
-            # Get original mapping data (keyed by Standard_ColumnName)
-            original_data = sheet_mappings_dict.get(standard_col, {})
-
-            if standard_col:
-                covered_standard_cols.add(standard_col)
-
-            conf_raw = mapping.get("Confidence", 0.0)
-            try:
-                conf = float(conf_raw)
-            except Exception:
-                conf = 0.0
-
-            resolved_standard_sheet = standard_sheet or original_data.get("Standard_SheetName", "")
-
-            # Blank source info if confidence is below threshold
-            if conf < 0.8:
-                source_col = ""
-                source_sheet = ""
-
-            candidate = {
-                "Source_ColumnName": source_col,
-                "Source_SheetName": source_sheet,
-                "Standard_ColumnName": standard_col,
-                "Standard_SheetName": resolved_standard_sheet,
-                "信息类型": original_data.get("信息类型", ""),
-                "备注": original_data.get("备注", ""),
-                "Confidence": conf,
-                "Rationale": mapping.get("Rationale", "")
-            }
-
-            key = (resolved_standard_sheet, standard_col)
-            
-            # STRICT FILTER: Ignore mappings for columns we didn't ask for (Safety Net)
-            if standard_col not in sheet_mappings_dict:
+            candidate = validate_mapping(mapping, sheet_mappings_dict)
+            if candidate is None:
                 continue
-                
+            covered_standard_cols.add(candidate["Standard_ColumnName"])
+
+            key = (candidate["Standard_SheetName"], candidate["Standard_ColumnName"])
             current_best = best_by_standard.get(key)
-            if current_best is None or conf > current_best.get("Confidence", 0.0):
+            if current_best is None or candidate["Confidence"] > current_best.get("Confidence", 0.0):
                 best_by_standard[key] = candidate
 
         validated_mappings = list(best_by_standard.values())
 
         # Ensure all standard columns are present even if LLM missed them
-        missing_standards = set(sheet_mappings_dict.keys()) - covered_standard_cols
-        for std_col in missing_standards:
-            original_data = sheet_mappings_dict.get(std_col, {})
-            validated_mappings.append({
-                "Source_ColumnName": "",
-                "Source_SheetName": "",
-                "Standard_ColumnName": std_col,
-                "Standard_SheetName": original_data.get("Standard_SheetName", ""),
-                "信息类型": original_data.get("信息类型", ""),
-                "备注": original_data.get("备注", ""),
-                "Confidence": 0.0,
-                "Rationale": "LLM未找到匹配，保留占位"
-            })
+        validated_mappings.extend(missing_placeholders(sheet_mappings_dict, covered_standard_cols))
         
         return validated_mappings
         
@@ -0,0 +1,198 @@
+"""
+LLM 限流
+
+One limiter shared by every LLM call of the process. A call may start when
+  * fewer than ``concurrency`` calls are in flight,
+  * the requests-per-minute bucket has a request left, and
+  * the tokens-per-minute bucket covers the call's estimated tokens.
+
+``concurrency`` adapts AIMD-style: it grows by roughly one slot per window of
+successful calls, is halved on a 429 and shrinks by 10% when latency exceeds the
+target, between ``min_concurrency`` and ``max_concurrency``. Waiting calls poll
+with short async sleeps; the state is lock-protected because API threads read
+its ``snapshot``. Retries go through ``backoff_delay`` (exponential with jitter).
+"""
+import asyncio
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import openai
+
+# Longest single sleep while waiting for a slot; short enough to notice released slots quickly
+MAX_POLL_SECONDS = 0.25
+
+_CJK = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_RATE_LIMIT_MESSAGE = re.compile(r"(?<!\d)429(?!\d)|rate limit|too many requests")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per four other characters."""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Whether ``exc`` is the provider throttling us (HTTP 429).
+
+    The exception type and status code decide; the message is only checked for
+    errors that carry neither, and "429" has to stand on its own there (not
+    inside a request id or a token count).
+    """
+    if isinstance(exc, openai.RateLimitError):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status is not None:
+        return status == 429
+    message = str(exc).lower()
+    return bool(_RATE_LIMIT_MESSAGE.search(message))
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Delay before retry ``attempt`` (1-based): exponential, capped, with equal jitter."""
+    delay = min(cap, base * (2 ** (attempt - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+class TokenBucket:
+    """Continuously refilled bucket sized for one minute of budget (not thread-safe on its own)."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # A single call larger than the whole bucket only waits for a full bucket
+        needed = min(amount, self.capacity)
+        if self.available >= needed:
+            return 0.0
+        return (needed - self.available) / self.rate
+
+    def take(self, amount: float) -> None:
+        # May go negative when a reservation is corrected upwards; later calls then wait longer
+        self.available -= amount
+
+
+class Permit:
+    """Handed out by ``AdaptiveRateLimiter.slot``; set ``used_tokens`` once the real usage is known."""
+
+    def __init__(self, reserved_tokens: int):
+        self.reserved_tokens = reserved_tokens
+        self.used_tokens: Optional[int] = None
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rpm: int, tpm: int, max_concurrency: int, min_concurrency: int = 1,
+                 latency_target: float = 60.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.latency_target = latency_target
+        self.concurrency = float(self.max_concurrency)
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.throttled = 0
+        self.errors = 0
+
+    # --- acquiring ---
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take a slot and return 0, or return how long to wait before trying again."""
+        with self._lock:
+            if self.in_flight >= int(self.concurrency):
+                return MAX_POLL_SECONDS
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    async def acquire(self, tokens: int) -> None:
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                wait = self._try_acquire(tokens)
+                if not wait:
+                    return
+                await asyncio.sleep(min(wait, MAX_POLL_SECONDS))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    # --- releasing / feedback ---
+
+    def release(self, permit: Permit, latency: float, outcome: str = "ok") -> None:
+        """Free a slot. ``outcome`` is ``ok``, ``throttled``, ``error`` or ``cancelled``."""
+        with self._lock:
+            self.in_flight -= 1
+            if permit.used_tokens is not None:
+                self._tokens.take(permit.used_tokens - permit.reserved_tokens)
+            if outcome == "throttled":
+                self.throttled += 1
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            elif outcome == "error":
+                self.errors += 1
+            elif outcome == "ok":
+                self.completed += 1
+                if latency > self.latency_target:
+                    self.concurrency = max(self.min_concurrency, self.concurrency * 0.9)
+                else:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int):
+        """``async with limiter.slot(n) as permit:`` around one LLM call."""
+        await self.acquire(tokens)
+        permit = Permit(tokens)
+        started = time.monotonic()
+        try:
+            yield permit
+        except Exception as exc:
+            outcome = "throttled" if is_rate_limit_error(exc) else "error"
+            self.release(permit, time.monotonic() - started, outcome)
+            raise
+        except BaseException:
+            # Cancelled: give the slot back without judging the provider
+            self.release(permit, time.monotonic() - started, "cancelled")
+            raise
+        self.release(permit, time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._requests._refill(now)
+            self._tokens._refill(now)
+            return {
+                "rpm": int(self._requests.capacity),
+                "tpm": int(self._tokens.capacity),
+                "concurrency": round(self.concurrency, 2),
+                "min_concurrency": self.min_concurrency,
+                "max_concurrency": self.max_concurrency,
+                "latency_target": self.latency_target,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "requests_available": int(self._requests.available),
+                "tokens_available": int(self._tokens.available),
+                "completed": self.completed,
+                "throttled": self.throttled,
+                "errors": self.errors,
+            }
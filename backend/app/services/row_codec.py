@@ -0,0 +1,56 @@
+"""
+Row encoding for ``DatasetRow.data``.
+
+Rows are stored as positional JSON arrays aligned with ``DatasetSheet.column_names``
+(headers are stored once per sheet instead of in every row), with trailing empty
+cells trimmed. Rows written before this format are JSON objects; every reader goes
+through ``decode_row`` so both formats keep working side by side.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def encode_row(columns: Sequence[str], row: Sequence[Any]) -> List[Any]:
+    """Positional storage form of a cleaned row (trailing ``None`` cells dropped)."""
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return list(row[:end])
+
+
+def decode_row(columns: Optional[Sequence[str]], data: Any) -> Dict[str, Any]:
+    """Return a ``{column: value}`` dict for either storage format."""
+    if data is None:
+        return {}
+    if isinstance(data, dict):
+        return data
+    columns = columns or []
+    values = list(data) + [None] * (len(columns) - len(data))
+    return dict(zip(columns, values))
+
+
+def row_value(columns: Optional[Sequence[str]], data: Any, column_name: str) -> Any:
+    """Read one cell without building the whole dict."""
+    if data is None:
+        return None
+    if isinstance(data, dict):
+        return data.get(column_name)
+    position = column_position(columns, column_name)
+    if position is None or position >= len(data):
+        return None
+    return data[position]
+
+
+def column_position(columns: Optional[Sequence[str]], column_name: str) -> Optional[int]:
+    try:
+        return list(columns or []).index(column_name)
+    except ValueError:
+        return None
+
+
+def sheet_columns(column_names: Optional[Sequence[str]], sample_data: Any = None) -> List[str]:
+    """Headers of a sheet: the stored ones, or the keys of a legacy dict row."""
+    if column_names:
+        return list(column_names)
+    if isinstance(sample_data, dict):
+        return list(sample_data.keys())
+    return []
@@ -0,0 +1,199 @@
+"""
+全文检索索引
+
+Inverted index over column headers and frequent cell values of every dataset
+sheet, built at import time from the column profiler. Texts are lower-cased and
+split into overlapping character bigrams, which works for CJK (no word
+boundaries) as well as codes such as ``AESTDAT``. A query is split the same way;
+candidate entries are found through the ``search_grams`` postings and ranked by
+gram coverage, substring/exact match and whether the header itself matched.
+
+The index is bounded per column (``SEARCH_VALUES_PER_COLUMN``), so its size and
+query time do not grow with the number of rows.
+"""
+import math
+import os
+import re
+from typing import Any, Dict, List, Set
+
+from sqlalchemy import delete, func, insert, or_, select, tuple_
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .. import models
+
+entries_table = models.SearchEntry.__table__
+grams_table = models.SearchGram.__table__
+
+# Most frequent distinct values indexed per column
+SEARCH_VALUES_PER_COLUMN = int(os.getenv("SEARCH_VALUES_PER_COLUMN", "200"))
+# Only the start of long values is tokenized
+MAX_INDEXED_LENGTH = 64
+# Column types whose values are worth indexing (dates and numbers are not searched by term)
+INDEXED_VALUE_TYPES = ("text", "code")
+# Share of the query grams an entry must contain to be considered
+MIN_COVERAGE = 0.5
+MAX_CANDIDATES = 500
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: Any) -> str:
+    return _WHITESPACE.sub(" ", str(text)).strip().lower()
+
+
+def ngrams(text: str) -> Set[str]:
+    """Character bigrams of an already normalized text (the text itself if shorter)."""
+    text = text[:MAX_INDEXED_LENGTH]
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def build_entries(columns: List[str], profiler, profiles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Searchable entries of one sheet, from its finished ``ColumnProfiler`` and profile dicts."""
+    entries = []
+    for position, (name, profile) in enumerate(zip(columns, profiles)):
+        top = profile["top_values"]
+        entries.append({
+            "position": position,
+            "ordinal": 0,
+            "column_name": name,
+            "kind": "column",
+            "text": str(name)[:255],
+            "example": str(top[0]["value"])[:255] if top else None,
+            "frequency": profile["row_count"] - profile["null_count"],
+        })
+        if profile["inferred_type"] not in INDEXED_VALUE_TYPES:
+            continue
+        for ordinal, (value, count) in enumerate(
+            profiler.distinct_values(position).most_common(SEARCH_VALUES_PER_COLUMN), start=1
+        ):
+            entries.append({
+                "position": position,
+                "ordinal": ordinal,
+                "column_name": name,
+                "kind": "value",
+                "text": str(value)[:255],
+                "example": str(value)[:255],
+                "frequency": count,
+            })
+    return entries
+
+
+def entries_from_profiles(column_profiles: List[models.ColumnProfile]) -> List[Dict[str, Any]]:
+    """Entries rebuilt from stored profiles (top values only), for sheets imported before the index."""
+    entries = []
+    for p in column_profiles:
+        top = p.top_values or []
+        entries.append({
+            "position": p.position, "ordinal": 0, "column_name": p.column_name, "kind": "column",
+            "text": str(p.column_name)[:255], "example": str(top[0]["value"])[:255] if top else None,
+            "frequency": (p.row_count or 0) - (p.null_count or 0),
+        })
+        if p.inferred_type not in INDEXED_VALUE_TYPES:
+            continue
+        for ordinal, item in enumerate(top, start=1):
+            entries.append({
+                "position": p.position, "ordinal": ordinal, "column_name": p.column_name, "kind": "value",
+                "text": str(item["value"])[:255], "example": str(item["value"])[:255], "frequency": item["count"],
+            })
+    return entries
+
+
+def delete_index(conn: Connection, sheet_ids: List[int]) -> None:
+    if sheet_ids:
+        conn.execute(delete(grams_table).where(grams_table.c.sheet_id.in_(sheet_ids)))
+        conn.execute(delete(entries_table).where(entries_table.c.sheet_id.in_(sheet_ids)))
+
+
+def write_index(conn: Connection, entries_by_sheet: Dict[int, List[Dict[str, Any]]]) -> None:
+    """Replace the index of every sheet in ``{sheet_id: [entry, ...]}``."""
+    if not entries_by_sheet:
+        return
+    delete_index(conn, list(entries_by_sheet))
+    entry_params, gram_params = [], []
+    for sheet_id, entries in entries_by_sheet.items():
+        for entry in entries:
+            entry_params.append(dict(entry, sheet_id=sheet_id))
+            key = {"sheet_id": sheet_id, "position": entry["position"], "ordinal": entry["ordinal"]}
+            gram_params.extend(dict(key, gram=gram) for gram in ngrams(normalize(entry["text"])))
+    if entry_params:
+        conn.execute(insert(entries_table), entry_params)
+    if gram_params:
+        conn.execute(insert(grams_table), gram_params)
+
+
+def index_missing_sheets(engine: Engine) -> int:
+    """Index sheets that have profiles but no entries yet; returns the number of sheets indexed."""
+    with Session(engine) as db:
+        indexed = select(entries_table.c.sheet_id).distinct()
+        sheets = db.query(models.DatasetSheet).filter(
+            models.DatasetSheet.profiles.any(), models.DatasetSheet.id.not_in(indexed)
+        ).all()
+        entries_by_sheet = {s.id: entries_from_profiles(s.profiles) for s in sheets}
+    with engine.begin() as conn:
+        write_index(conn, entries_by_sheet)
+    return len(entries_by_sheet)
+
+
+def search(db: Session, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Best hit per (sheet, column) for ``query``, highest score first."""
+    needle = normalize(query)
+    grams = ngrams(needle)
+    if not grams:
+        return []
+
+    key = (grams_table.c.sheet_id, grams_table.c.position, grams_table.c.ordinal)
+    if len(needle) < 2:
+        # A single character is the first or the second half of the indexed bigrams (the last one of a text only the latter)
+        condition = or_(
+            grams_table.c.gram.startswith(needle, autoescape=True), grams_table.c.gram.endswith(needle, autoescape=True)
+        )
+    else:
+        condition = grams_table.c.gram.in_(grams)
+    matched = func.count(func.distinct(grams_table.c.gram)).label("matched")
+    required = max(1, math.ceil(len(grams) * MIN_COVERAGE))
+    candidates = db.execute(
+        select(*key, matched).where(condition).group_by(*key)
+        .having(matched >= required).order_by(matched.desc()).limit(MAX_CANDIDATES)
+    ).all()
+    if not candidates:
+        return []
+
+    coverage = {(c.sheet_id, c.position, c.ordinal): min(1.0, c.matched / len(grams)) for c in candidates}
+    Entry, Sheet, Dataset = models.SearchEntry, models.DatasetSheet, models.Dataset
+    rows = db.query(Entry, Sheet.name, Dataset.id, Dataset.name).join(
+        Sheet, Sheet.id == Entry.sheet_id
+    ).join(Dataset, Dataset.id == Sheet.dataset_id).filter(
+        tuple_(Entry.sheet_id, Entry.position, Entry.ordinal).in_(list(coverage))
+    ).all()
+
+    best: Dict[tuple, Dict[str, Any]] = {}
+    for entry, sheet_name, dataset_id, dataset_name in rows:
+        text = normalize(entry.text)
+        score = coverage[(entry.sheet_id, entry.position, entry.ordinal)]
+        if needle in text:
+            score += 1.0
+            if text == needle:
+                score += 0.5
+        if entry.kind == "column":
+            score += 0.3
+        # Small tie-breaker towards values that occur often
+        score += min(0.1, math.log10(1 + (entry.frequency or 0)) / 100)
+
+        hit_key = (entry.sheet_id, entry.position)
+        if hit_key in best and best[hit_key]["score"] >= score:
+            continue
+        best[hit_key] = {
+            "dataset_id": dataset_id,
+            "dataset_name": dataset_name,
+            "sheet_name": sheet_name,
+            "column_name": entry.column_name,
+            "example": entry.example,
+            "match": entry.kind,
+            "score": round(score, 4),
+        }
+
+    hits = sorted(best.values(), key=lambda h: (-h["score"], h["dataset_name"], h["sheet_name"], h["column_name"]))
+    return hits[:limit]
@@ -0,0 +1,139 @@
+"""
+源 Sheet 路由
+
+Decides which source sheets are put into the prompts of a standard sheet group.
+Every (standard sheet, source sheet) pair gets a score from three signals:
+
+  * name    - equal names / the standard name as a token or substring of the
+              source name, otherwise character n-gram similarity of the names
+              (expanded with the term and abbreviation tables),
+  * columns - how well the source sheet's columns cover the standard columns
+              (best ``CandidateMatcher`` score per target column, averaged),
+  * domain  - both sheets belong to the same clinical domain of ``SHEET_MEANINGS``
+              (AE, DM, EX, ...), recognized by code or by its English/Chinese title.
+
+Only the top ``SHEET_ROUTE_TOP_K`` sheets scoring at least ``SHEET_ROUTE_MIN_SCORE``
+are kept, so prompt size no longer grows with the number of sheets in a dataset.
+If no sheet reaches the cutoff, the top-ranked sheets are used anyway.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from .candidate_matcher import CandidateMatcher, _normalize, _tfidf, expand_terms
+
+# Business meaning of the usual source sheets (also shown to the LLM by build_sheet_context)
+SHEET_MEANINGS = {
+    "AE": "Adverse Events - Records of any adverse medical events occurring during the study",
+    "DA1": "Drug Administration - Records of drug exposure and administration details",
+    "DM": "Demographics - Subject demographics and basic study information",
+    "EX": "Exposure - Drug exposure information and administration details",
+    "CM": "Concomitant Medications - Other medications taken during the study",
+    "MH": "Medical History - Subject's pre-existing medical conditions",
+    "VS": "Vital Signs - Measurements of basic body functions",
+    "LB": "Laboratory - Clinical laboratory test results"
+}
+
+# Source sheets kept per standard sheet group (0 disables routing: all sheets are sent)
+SHEET_ROUTE_TOP_K = int(os.getenv("SHEET_ROUTE_TOP_K", "3"))
+# Minimum combined score of a routed sheet (0..1)
+SHEET_ROUTE_MIN_SCORE = float(os.getenv("SHEET_ROUTE_MIN_SCORE", "0.35"))
+# Signal weights of the combined score
+NAME_WEIGHT = 0.35
+COLUMN_WEIGHT = 0.45
+DOMAIN_WEIGHT = 0.2
+# A target column only counts as covered by a sheet from this column score on
+COLUMN_HIT_SCORE = 0.5
+
+_TOKENS = re.compile(r"[^A-Za-z0-9]+")
+
+
+@dataclass
+class SheetRoute:
+    sheet: str
+    score: float
+    name: float
+    columns: float
+    domain: float
+
+
+def sheet_domain(sheet_name: str) -> Optional[str]:
+    """``SHEET_MEANINGS`` code of a sheet name ("AE_2", "Adverse Events", "不良事件" -> "AE")."""
+    for token in _TOKENS.split(str(sheet_name).upper()):
+        if token in SHEET_MEANINGS:
+            return token
+        if token.rstrip("0123456789") in SHEET_MEANINGS:
+            return token.rstrip("0123456789")
+    expanded = expand_terms(sheet_name)
+    for code, meaning in SHEET_MEANINGS.items():
+        title = meaning.split(" - ")[0].lower()
+        # "Adverse Events" also matches the singular produced by the term table
+        if title in expanded or title.rstrip("s") in expanded:
+            return code
+    return None
+
+
+def _name_score(std_sheet: str, src_sheet: str) -> Optional[float]:
+    """Score of an equal / token / substring name match, ``None`` if the names are unrelated."""
+    std, src = _normalize(std_sheet), _normalize(src_sheet)
+    if not std:
+        return None
+    if std == src:
+        return 1.0
+    if std in {t.lower() for t in _TOKENS.split(src) if t}:
+        return 0.9
+    if std in src:
+        return 0.7
+    return None
+
+
+class SheetRouter:
+    """Ranks the sheets of ``source_data`` for each standard sheet group."""
+
+    def __init__(self, source_data: Dict[str, Any]):
+        self.source_data = source_data
+        self.sheets: List[str] = list(source_data.get("sheets", {}).keys())
+        # Vectorizes the source columns once; per-group matchers are ``matcher.subset(routed)``
+        self.matcher = CandidateMatcher(source_data)
+        self._domains = {sheet: sheet_domain(sheet) for sheet in self.sheets}
+        self._names = [expand_terms(sheet) for sheet in self.sheets]
+
+    def rank(self, sheet_name: str, sheet_mappings_dict: Dict[str, Dict[str, Any]]) -> List[SheetRoute]:
+        """Every source sheet with its scores, best first."""
+        if not self.sheets:
+            return []
+        names = _tfidf([expand_terms(sheet_name)] + self._names)
+        name_similarity = names[1:] @ names[0]
+        column_scores = self.matcher.sheet_scores(sheet_mappings_dict)
+        domain = sheet_domain(sheet_name)
+
+        routes = []
+        for i, sheet in enumerate(self.sheets):
+            name = _name_score(sheet_name, sheet)
+            if name is None:
+                name = float(name_similarity[i])
+            hits = [best.get(sheet, 0.0) for best in column_scores.values()]
+            columns = sum(h for h in hits if h >= COLUMN_HIT_SCORE) / len(hits) if hits else 0.0
+            same_domain = 1.0 if domain is not None and self._domains[sheet] == domain else 0.0
+            score = NAME_WEIGHT * name + COLUMN_WEIGHT * columns + DOMAIN_WEIGHT * same_domain
+            routes.append(SheetRoute(sheet, round(score, 4), round(name, 4), round(columns, 4), same_domain))
+        return sorted(routes, key=lambda r: -r.score)
+
+    def route(self, sheet_name: str, sheet_mappings_dict: Dict[str, Dict[str, Any]],
+              top_k: int = SHEET_ROUTE_TOP_K, min_score: float = SHEET_ROUTE_MIN_SCORE) -> Dict[str, Any]:
+        """``source_data`` limited to the best-ranked sheets for ``sheet_name``."""
+        if top_k <= 0 or len(self.sheets) <= 1:
+            return self.source_data
+        ranked = self.rank(sheet_name, sheet_mappings_dict)
+        selected = [r for r in ranked if r.score >= min_score][:top_k]
+        if not selected:
+            selected = ranked[:top_k]
+            print(f"    ⚠️ No source sheet reaches score {min_score} for '{sheet_name}', "
+                  f"using the top {len(selected)}")
+        print(f"    🧭 Routed '{sheet_name}' to " + ", ".join(f"{r.sheet} ({r.score:.2f})" for r in selected))
+        keep = {r.sheet for r in selected}
+        return {
+            "description": self.source_data.get("description", ""),
+            "sheets": {k: v for k, v in self.source_data.get("sheets", {}).items() if k in keep}
+        }
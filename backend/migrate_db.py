@@ -1,42 +1,116 @@
+import sys
+
+from app import models
 from app.database import engine
+from app.services import search_index
 from sqlalchemy import text
 
-def migrate():
+# (table, column, DDL type) added after the initial schema
+NEW_COLUMNS = [
+    ("mappings", "status", "VARCHAR(50) DEFAULT 'official'"),
+    ("datasets", "content_hash", "VARCHAR(64)"),
+    ("dataset_sheets", "content_hash", "VARCHAR(64)"),
+    ("frameworks", "content_hash", "VARCHAR(64)"),
+    ("dataset_sheets", "column_names", "JSON"),
+    ("dataset_sheets", "row_count", "INTEGER"),
+    ("generation_jobs", "requested_by", "VARCHAR(100) DEFAULT 'anonymous'"),
+    ("generation_jobs", "flight_key", "VARCHAR(64)"),
+    ("generation_jobs", "llm_usage", "JSON"),
+    ("generation_jobs", "batch_id", "VARCHAR(32)"),
+    ("mappings", "approved_at", "DATETIME"),
+]
+
+# Both save paths set a status, so a mapping without one was never saved by a
+# user; it must not be reused as reviewed history
+LEGACY_MAPPINGS = "UPDATE mappings SET status = 'legacy' WHERE status IS NULL"
+# 'official' mappings without approved_at were saved before it existed: user saves,
+# or raw LLM output stored before drafts. They stay official unless
+# --legacy-unreviewed is given (for databases that only hold the latter)
+UNREVIEWED_MAPPINGS = "status = 'official' AND approved_at IS NULL"
+
+# (table, index name, columns)
+NEW_INDEXES = [
+    ("dataset_rows", "ix_dataset_rows_sheet_row", "sheet_id, row_index"),
+    ("generation_jobs", "ix_generation_jobs_flight_key", "flight_key"),
+    ("generation_jobs", "ix_generation_jobs_batch_id", "batch_id"),
+]
+
+def column_exists(conn, table, column):
+    if 'sqlite' in str(engine.url):
+        result = conn.execute(text(f"PRAGMA table_info({table})")).fetchall()
+        return any(row[1] == column for row in result)
+    result = conn.execute(text(f"SHOW COLUMNS FROM {table} LIKE '{column}'"))
+    return result.fetchone() is not None
+
+def add_column(conn, table, column, ddl):
+    try:
+        if column_exists(conn, table, column):
+            print(f"Column '{table}.{column}' already exists.")
+            return
+        print(f"Adding '{table}.{column}' column...")
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        conn.commit()
+        print("Migration successful.")
+    except Exception as e:
+        print(f"Migration of '{table}.{column}' failed: {e}")
+        conn.rollback()
+
+def index_exists(conn, table, index):
+    if 'sqlite' in str(engine.url):
+        result = conn.execute(text(f"PRAGMA index_list({table})")).fetchall()
+        return any(row[1] == index for row in result)
+    result = conn.execute(text(f"SHOW INDEX FROM {table} WHERE Key_name = '{index}'"))
+    return result.fetchone() is not None
+
+def add_index(conn, table, index, columns):
+    try:
+        if index_exists(conn, table, index):
+            print(f"Index '{index}' already exists.")
+            return
+        print(f"Creating index '{index}'...")
+        conn.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+        conn.commit()
+        print("Migration successful.")
+    except Exception as e:
+        print(f"Creating index '{index}' failed: {e}")
+        conn.rollback()
+
+def migrate(legacy_unreviewed=False):
     print("Migrating database...")
     with engine.connect() as conn:
-        try:
-            # Check if column exists
-            result = conn.execute(text("SHOW COLUMNS FROM mappings LIKE 'status'"))
-            if result.fetchone():
-                print("Column 'status' already exists.")
-            else:
-                print("Adding 'status' column...")
-                conn.execute(text("ALTER TABLE mappings ADD COLUMN status VARCHAR(50) DEFAULT 'official'"))
-                # Set existing records to official
-                conn.execute(text("UPDATE mappings SET status = 'official' WHERE status IS NULL"))
-                conn.commit()
-                print("Migration successful.")
-        except Exception as e:
-            print(f"Migration failed: {e}")
-            # Fallback for SQLite (if environment differs, but user said 'mysql' in prompt)
-            # If using sqlite, ALTER TABLE ADD COLUMN is supported but syntax different? 
-            # Standard SQL supports ADD COLUMN.
-            # But "SHOW COLUMNS" is MySQL specific.
-            # If SQLite: PRAGMA table_info(mappings)
-            try:
-                # SQLite fallback check
-                if 'sqlite' in str(engine.url):
-                    print("Detected SQLite, attempting fallback check...")
-                    result = conn.execute(text("PRAGMA table_info(mappings)")).fetchall()
-                    has_status = any(row[1] == 'status' for row in result)
-                    if not has_status:
-                        conn.execute(text("ALTER TABLE mappings ADD COLUMN status VARCHAR(50) DEFAULT 'official'"))
-                        conn.commit()
-                        print("SQLite Migration successful.")
-                    else:
-                        print("SQLite: status column exists.")
-            except Exception as e2:
-                 print(f"Fallback failed: {e2}")
+        for table, column, ddl in NEW_COLUMNS:
+            add_column(conn, table, column, ddl)
+        for table, index, columns in NEW_INDEXES:
+            add_index(conn, table, index, columns)
+        backfill_mapping_status(conn, legacy_unreviewed)
+    backfill_search_index()
+
+def backfill_mapping_status(conn, legacy_unreviewed=False):
+    # Only status 'official' mappings are reused as history (mapping_history); report every change made here
+    try:
+        marked = conn.execute(text(LEGACY_MAPPINGS)).rowcount
+        unreviewed = conn.execute(text(f"SELECT COUNT(*) FROM mappings WHERE {UNREVIEWED_MAPPINGS}")).scalar()
+        if legacy_unreviewed and unreviewed:
+            conn.execute(text(f"UPDATE mappings SET status = 'legacy' WHERE {UNREVIEWED_MAPPINGS}"))
+            marked += unreviewed
+            unreviewed = 0
+        conn.commit()
+        print(f"Mappings: {marked} marked 'legacy' (no longer reused as saved history).")
+        if unreviewed:
+            print(f"Mappings: {unreviewed} official mapping(s) saved before approved_at existed are still reused; "
+                  f"run 'python migrate_db.py --legacy-unreviewed' if they are unreviewed LLM output.")
+    except Exception as e:
+        print(f"Mapping status backfill failed: {e}")
+        conn.rollback()
+
+def backfill_search_index():
+    # Sheets imported before the search index existed are indexed from their column profiles
+    try:
+        models.Base.metadata.create_all(bind=engine, tables=[models.SearchEntry.__table__, models.SearchGram.__table__])
+        count = search_index.index_missing_sheets(engine)
+        print(f"Search index: {count} sheet(s) backfilled.")
+    except Exception as e:
+        print(f"Search index backfill failed: {e}")
 
 if __name__ == "__main__":
-    migrate()
+    migrate(legacy_unreviewed="--legacy-unreviewed" in sys.argv[1:])
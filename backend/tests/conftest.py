@@ -0,0 +1,40 @@
+"""Test setup: a throwaway SQLite database and LLM cache, configured before ``app`` is imported."""
+import os
+import sys
+import tempfile
+import uuid
+
+_TMP = tempfile.mkdtemp(prefix="pv-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["LLM_CACHE_PATH"] = os.path.join(_TMP, "llm_cache.db")
+os.environ["MAPPING_HISTORY_ENABLED"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from app import models  # noqa: E402
+from app.database import SessionLocal, engine  # noqa: E402
+
+models.Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def dataset_framework():
+    """A one-sheet dataset and a framework with two DM columns; returns their ids."""
+    name = uuid.uuid4().hex[:8]
+    with SessionLocal() as db:
+        dataset = models.Dataset(name=f"ds-{name}", content_hash=name)
+        db.add(dataset)
+        db.flush()
+        sheet = models.DatasetSheet(dataset_id=dataset.id, name="DM", column_names=["SUBJID", "AGE"], row_count=1)
+        db.add(sheet)
+        db.flush()
+        db.add(models.DatasetRow(sheet_id=sheet.id, row_index=0, data=["S-001", 42]))
+        framework = models.Framework(name=f"fw-{name}", version="1", content_hash=name)
+        db.add(framework)
+        db.flush()
+        for column in ("SUBJID", "AGE"):
+            db.add(models.FrameworkSheet(framework_id=framework.id, standard_sheet_name="DM",
+                                         standard_column_name=column))
+        db.commit()
+        return dataset.id, framework.id
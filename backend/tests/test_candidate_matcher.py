@@ -0,0 +1,67 @@
+import numpy as np
+
+from app.services.candidate_matcher import CandidateMatcher, expand_terms
+
+SOURCE = {"sheets": {
+    "AE": {"columns": [{"name": "不良事件名称 (AETERM)"}, {"name": "开始日期 (AESTDAT)"}, {"name": "严重性 (AESEV)"}]},
+    "DM": {"columns": [{"name": "受试者编号 (SUBJID)"}, {"name": "年龄 (AGE)"}, {"name": "性别 (SEX)"}]},
+}}
+
+
+def target(column, note="", sheet="AE"):
+    return {"Standard_ColumnName": column, "Standard_SheetName": sheet, "备注": note}
+
+
+def test_expand_terms_adds_translations_and_glued_abbreviations():
+    assert "adverse event" in expand_terms("不良事件")
+    assert "date" in expand_terms("AESTDAT")
+
+
+def test_code_in_parentheses_is_an_exact_match_and_resolved_directly():
+    matcher = CandidateMatcher(SOURCE)
+    targets = {"AESTDAT": target("AESTDAT", "开始日期")}
+    candidates = matcher.match(targets, top_k=3)
+    best = candidates["AESTDAT"][0]
+    assert (best.sheet, best.column, best.exact) == ("AE", "开始日期 (AESTDAT)", True)
+    resolved = matcher.resolve("AE", targets, candidates)
+    assert resolved[0]["Source_ColumnName"] == "开始日期 (AESTDAT)"
+    assert resolved[0]["Provenance"]["match"] == "exact"
+
+
+def test_sheet_scores_give_exact_matches_full_score():
+    scores = CandidateMatcher(SOURCE).sheet_scores({"AGE": target("AGE", sheet="DM")})
+    assert scores["AGE"]["DM"] == 1.0
+    assert scores["AGE"]["AE"] < 1.0
+
+
+def test_grams_unseen_in_the_sources_still_lower_the_score():
+    matcher = CandidateMatcher(SOURCE)
+    plain = matcher.match({"X": target("年龄")}, top_k=1)["X"][0]
+    noisy = matcher.match({"X": target("年龄 qzxqzxqzx")}, top_k=1)["X"][0]
+    assert plain.column == noisy.column == "年龄 (AGE)"
+    assert noisy.score < plain.score
+
+
+def test_subset_reuses_the_parent_vectors():
+    # Regression: every routed sheet selection used to re-vectorize its source columns
+    parent = CandidateMatcher(SOURCE)
+    routed = {"sheets": {"DM": SOURCE["sheets"]["DM"]}}
+    child = parent.subset(routed)
+    assert parent.subset(SOURCE) is parent
+    assert child._index is parent._index
+    assert child.columns == [("DM", c["name"]) for c in SOURCE["sheets"]["DM"]["columns"]]
+
+    targets = {"SEX": target("性别", sheet="DM"), "AGE": target("age", sheet="DM")}
+    _, parent_scores, _ = parent._scores(targets)
+    _, child_scores, _ = child._scores(targets)
+    np.testing.assert_allclose(child_scores, parent_scores[:, 3:])
+
+
+def test_restrict_keeps_only_candidate_columns_of_large_sources():
+    matcher = CandidateMatcher(SOURCE)
+    candidates = matcher.match({"AGE": target("AGE", sheet="DM")}, top_k=1)
+    assert matcher.restrict(candidates, ["AGE"]) is SOURCE  # small enough to send in full
+    narrowed = matcher.restrict(candidates, ["AGE"], min_columns=0)
+    assert list(narrowed["sheets"]) == ["DM"]
+    assert [c["name"] for c in narrowed["sheets"]["DM"]["columns"]] == ["年龄 (AGE)"]
+    assert SOURCE["sheets"]["DM"]["columns"][0]["name"] == "受试者编号 (SUBJID)"
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+
+from app import models
+from app.database import SessionLocal
+from app.services import generation_jobs, mapping_generation_service
+
+
+def stored_status(job_id):
+    with SessionLocal() as db:
+        return db.get(models.GenerationJob, job_id).status
+
+
+def wait_until_finished(job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = stored_status(job_id)
+        if status not in generation_jobs.ACTIVE_STATUSES:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {stored_status(job_id)}")
+
+
+async def collect(manager, job_id):
+    return [payload["type"] async for _, payload in manager.follow(job_id)]
+
+
+def test_cancel_while_preparing_is_not_overwritten(dataset_framework, monkeypatch):
+    # Regression: the prepare thread set 'running' after _run had recorded the cancellation
+    dataset_id, framework_id = dataset_framework
+    entered, release = threading.Event(), threading.Event()
+    load_request_data = mapping_generation_service.load_request_data
+
+    def slow_load(*args, **kwargs):
+        entered.set()
+        release.wait(5)
+        return load_request_data(*args, **kwargs)
+
+    llm_requests = []
+    monkeypatch.setattr(mapping_generation_service, "load_request_data", slow_load)
+    monkeypatch.setattr(generation_jobs, "get_default_llm", lambda: llm_requests.append("default"))
+    monkeypatch.setattr(generation_jobs, "get_fast_llm", lambda: None)
+
+    manager = generation_jobs.GenerationJobManager()
+    job_id = manager.submit(dataset_id, framework_id, use_cache=False, user="tester")
+    assert entered.wait(5)
+    assert manager.cancel(job_id)
+    release.set()
+
+    assert wait_until_finished(job_id) == "cancelled"
+    time.sleep(0.2)
+    assert stored_status(job_id) == "cancelled"
+    assert manager.get(job_id)["status"] == "cancelled"
+    assert llm_requests == []
+
+    # A finished job keeps no events in memory; followers replay them from the database
+    assert manager._live[job_id].events == []
+    assert asyncio.run(collect(manager, job_id))[-1] == "cancelled"
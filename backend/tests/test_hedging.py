@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app.services.hedging import HedgePolicy
+
+
+def policy(**kwargs):
+    options = dict(enabled=True, percentile=95, max_fraction=1.0, min_samples=3, min_delay=0.05)
+    options.update(kwargs)
+    hedge = HedgePolicy(**options)
+    for _ in range(3):
+        hedge.record("m", 0.05)
+    return hedge
+
+
+def calls(*durations, results=None):
+    """``call(sent)`` whose n-th invocation takes ``durations[n]`` and returns ``results[n]`` (default n + 1)."""
+    started = []
+
+    async def call(sent):
+        index = len(started)
+        started.append(index)
+        sent()
+        await asyncio.sleep(durations[index])
+        return results[index] if results else index + 1
+
+    return call, started
+
+
+def test_delay_needs_samples_and_respects_the_floor():
+    hedge = HedgePolicy(enabled=True, min_samples=3, min_delay=1.0)
+    hedge.record("m", 0.1)
+    assert hedge.delay("m") is None
+    hedge.record("m", 0.2)
+    hedge.record("m", 3.0)
+    assert hedge.delay("m") == 3.0
+    assert hedge.delay("other") is None
+    hedge.record("fast", 0.1)
+    hedge.record("fast", 0.1)
+    hedge.record("fast", 0.1)
+    assert hedge.delay("fast") == 1.0
+
+
+def test_disabled_policy_never_hedges():
+    hedge = policy(enabled=False)
+    call, started = calls(0.2)
+    assert asyncio.run(hedge.run("m", call, accept=lambda r: True)) == 1
+    assert len(started) == 1
+
+
+def test_slow_call_is_raced_and_the_hedge_wins():
+    hedge = policy()
+    call, started = calls(0.5, 0.01)
+    assert asyncio.run(hedge.run("m", call, accept=lambda r: True)) == 2
+    assert len(started) == 2
+    assert hedge.hedge_wins == 1
+
+
+def test_cancelled_primary_is_recorded_as_a_censored_latency():
+    # Regression: only completed calls were recorded, so a hedge win dropped the slow sample
+    hedge = policy()
+    call, _ = calls(0.5, 0.01)
+    asyncio.run(hedge.run("m", call, accept=lambda r: True))
+    samples = sorted(hedge._latencies["m"])
+    assert len(samples) == 5  # 3 seeded, the hedge, and the cancelled primary
+    assert samples[-1] >= 0.05
+
+
+def test_cap_stops_hedging():
+    hedge = policy(max_fraction=0.0)
+    call, started = calls(0.2)
+    asyncio.run(hedge.run("m", call, accept=lambda r: True))
+    assert len(started) == 1
+    assert hedge.capped == 1
+
+
+def test_rejected_result_is_returned_when_nothing_is_accepted():
+    hedge = policy(enabled=False)
+    call, _ = calls(0.0, results=[[]])
+    assert asyncio.run(hedge.run("m", call, accept=bool)) == []
+
+
+def test_error_is_raised_when_every_call_fails():
+    hedge = policy(enabled=False)
+
+    async def call(sent):
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hedge.run("m", call, accept=lambda r: True))
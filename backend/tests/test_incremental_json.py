@@ -0,0 +1,54 @@
+import json
+import time
+
+from app.services.incremental_json import IncrementalObjectParser
+
+RESPONSE = "```json\n" + json.dumps({"mappings": [
+    {"Standard_ColumnName": "AESTDAT", "Rationale": "braces } { and \"quotes\" in a value"},
+    {"Standard_ColumnName": "AETERM", "Nested": {"k": [1, 2]}},
+]}) + "\n```"
+
+
+def feed_in_pieces(parser, text, size):
+    objects = []
+    for i in range(0, len(text), size):
+        objects.extend(parser.feed(text[i:i + size]))
+    return objects
+
+
+def test_objects_are_returned_when_they_close():
+    parser = IncrementalObjectParser(required_key="Standard_ColumnName")
+    objects = feed_in_pieces(parser, RESPONSE, 1)
+    assert [o["Standard_ColumnName"] for o in objects] == ["AESTDAT", "AETERM"]
+    assert objects[0]["Rationale"] == 'braces } { and "quotes" in a value'
+    assert parser.text == RESPONSE
+
+
+def test_without_required_key_nested_and_wrapper_objects_are_returned():
+    objects = IncrementalObjectParser().feed(RESPONSE)
+    assert {"k": [1, 2]} in objects
+    assert "mappings" in objects[-1]
+
+
+def test_unparseable_fragments_are_skipped():
+    parser = IncrementalObjectParser(required_key="Standard_ColumnName")
+    assert parser.feed('{"Standard_ColumnName": x} {"Standard_ColumnName": "A"}') == [{"Standard_ColumnName": "A"}]
+    assert parser.feed("") == []
+
+
+def test_many_small_chunks_parse_in_linear_time():
+    # Regression: every feed used to re-join the whole text, quadratic in the number of chunks
+    mappings = [
+        {"Standard_ColumnName": f"C{i}", "Source_ColumnName": "受试者编号 {x}",
+         "Rationale": "a \"quoted\" {brace} value \\ ok" * 2}
+        for i in range(2400)
+    ]
+    document = json.dumps({"mappings": mappings}, ensure_ascii=False)  # about 350 KB
+    parser = IncrementalObjectParser(required_key="Standard_ColumnName")
+    started = time.perf_counter()
+    objects = feed_in_pieces(parser, document, 4)
+    assert time.perf_counter() - started < 2.0
+    assert objects == mappings
+    # Whether a growing string is copied on every feed depends on the allocator, so check it was never joined
+    assert len(parser._chunks) == -(-len(document) // 4)
+    assert parser.text == document
@@ -0,0 +1,30 @@
+from app.services import preview_cache
+from app.services.preview_cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_hit_requires_the_same_token():
+    cache = LRUCache(max_size=4)
+    cache.put("k", ["v"], token=(1, "hash-1"))
+    assert cache.get("k", (1, "hash-1")) == ["v"]
+    assert cache.get("k", (1, "hash-2")) is None
+    assert cache.stats() == {"size": 1, "max_size": 4, "hits": 1, "misses": 1}
+
+
+def test_invalidate_dataset_drops_only_its_keys():
+    preview_cache.column_previews.clear()
+    preview_cache.column_previews.put((1, "DM", "AGE", 10), ["42"])
+    preview_cache.column_previews.put((2, "DM", "AGE", 10), ["43"])
+    assert preview_cache.invalidate_dataset(1) == 1
+    assert preview_cache.column_previews.get((1, "DM", "AGE", 10)) is None
+    assert preview_cache.column_previews.get((2, "DM", "AGE", 10)) == ["43"]
+    preview_cache.column_previews.clear()
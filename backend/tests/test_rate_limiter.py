@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from app.services.rate_limiter import (
+    AdaptiveRateLimiter, TokenBucket, backoff_delay, estimate_tokens, is_rate_limit_error,
+)
+
+REQUEST = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+
+
+def test_estimate_tokens_counts_cjk_characters_one_each():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("受试者编号") == 5
+
+
+def test_rate_limit_errors_are_classified_by_type_and_status_first():
+    assert is_rate_limit_error(openai.RateLimitError("slow down", response=httpx.Response(429, request=REQUEST), body=None))
+    server_error = openai.InternalServerError("rate limit backend failed", response=httpx.Response(500, request=REQUEST),
+                                              body=None)
+    assert not is_rate_limit_error(server_error)
+
+
+def test_rate_limit_message_fallback_needs_a_standalone_429():
+    assert is_rate_limit_error(Exception("Error code: 429 - busy"))
+    assert is_rate_limit_error(Exception("Rate limit reached for requests"))
+    assert not is_rate_limit_error(Exception("request req_14290 failed"))
+    assert not is_rate_limit_error(ValueError("boom"))
+
+
+def test_backoff_delay_is_capped_with_equal_jitter():
+    for attempt in range(1, 8):
+        delay = min(8.0, 2 ** (attempt - 1))
+        assert delay / 2 <= backoff_delay(attempt, base=1.0, cap=8.0) <= delay
+
+
+def test_token_bucket_waits_for_missing_budget_only():
+    bucket = TokenBucket(per_minute=60)  # one per second
+    now = bucket._updated
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    # A request larger than the bucket waits for a full bucket, not forever
+    assert bucket.wait_time(600, now) == pytest.approx(60.0)
+
+
+def run_slot(limiter, error=None, used_tokens=None):
+    async def call():
+        async with limiter.slot(100) as permit:
+            permit.used_tokens = used_tokens
+            if error is not None:
+                raise error
+    try:
+        asyncio.run(call())
+    except BaseException as exc:
+        if exc is not error:
+            raise
+
+
+def test_throttling_halves_concurrency_and_success_grows_it_back():
+    limiter = AdaptiveRateLimiter(rpm=1000, tpm=1_000_000, max_concurrency=8)
+    run_slot(limiter, error=Exception("Error code: 429"))
+    assert limiter.concurrency == 4
+    assert limiter.throttled == 1
+    run_slot(limiter)
+    assert 4 < limiter.concurrency <= 8
+    run_slot(limiter, error=ValueError("bad request"))
+    assert limiter.errors == 1
+    assert limiter.in_flight == 0
+
+
+def test_reported_usage_corrects_the_token_reservation():
+    limiter = AdaptiveRateLimiter(rpm=1000, tpm=10_000, max_concurrency=2)
+    run_slot(limiter, used_tokens=1100)
+    snapshot = limiter.snapshot()
+    assert snapshot["completed"] == 1
+    assert snapshot["tokens_available"] <= 10_000 - 1100 + 5
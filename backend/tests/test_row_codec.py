@@ -0,0 +1,31 @@
+from app.services import row_codec
+
+
+def test_encode_row_trims_only_trailing_empty_cells():
+    assert row_codec.encode_row(["a", "b", "c", "d"], ["x", None, "z", None]) == ["x", None, "z"]
+    assert row_codec.encode_row(["a"], [None]) == []
+
+
+def test_decode_row_pads_short_positional_rows():
+    assert row_codec.decode_row(["a", "b", "c"], ["x"]) == {"a": "x", "b": None, "c": None}
+
+
+def test_decode_row_passes_legacy_dict_rows_through():
+    assert row_codec.decode_row(["ignored"], {"a": 1}) == {"a": 1}
+    assert row_codec.decode_row(["a"], None) == {}
+
+
+def test_row_value_reads_both_formats():
+    columns = ["a", "b", "c"]
+    assert row_codec.row_value(columns, ["x", "y"], "b") == "y"
+    assert row_codec.row_value(columns, ["x", "y"], "c") is None  # trimmed trailing cell
+    assert row_codec.row_value(columns, ["x"], "missing") is None
+    assert row_codec.row_value(None, {"b": 2}, "b") == 2
+
+
+def test_sheet_columns_falls_back_to_legacy_row_keys():
+    assert row_codec.sheet_columns(["a", "b"]) == ["a", "b"]
+    assert row_codec.sheet_columns(None, {"x": 1, "y": 2}) == ["x", "y"]
+    assert row_codec.sheet_columns(None, ["x"]) == []
+    assert row_codec.column_position(["a", "b"], "b") == 1
+    assert row_codec.column_position(None, "b") is None
@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import models
+from app.services import search_index
+
+
+def entry(position, text, kind="column", ordinal=0, frequency=1):
+    return {"position": position, "ordinal": ordinal, "column_name": f"col{position}", "kind": kind,
+            "text": text, "example": text, "frequency": frequency}
+
+
+@pytest.fixture
+def index_db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        dataset = models.Dataset(name="search")
+        db.add(dataset)
+        db.flush()
+        sheet = models.DatasetSheet(dataset_id=dataset.id, name="AE")
+        db.add(sheet)
+        db.commit()
+        sheet_id = sheet.id
+    with engine.begin() as conn:
+        search_index.write_index(conn, {sheet_id: [
+            entry(0, "AESTDAT"),
+            entry(1, "受试者号"),
+            entry(2, "AETERM"),
+            entry(2, "Headache", kind="value", ordinal=1, frequency=30),
+        ]})
+    with Session(engine) as db:
+        yield db
+
+
+def test_ngrams_are_bigrams_of_normalized_text():
+    assert search_index.normalize("  AE   Term ") == "ae term"
+    assert search_index.ngrams("abc") == {"ab", "bc"}
+    assert search_index.ngrams("a") == {"a"}
+    assert search_index.ngrams("") == set()
+
+
+def test_exact_header_ranks_above_partial_matches(index_db):
+    hits = search_index.search(index_db, "aestdat")
+    assert hits[0]["column_name"] == "col0"
+    assert hits[0]["match"] == "column"
+
+
+def test_values_are_searchable(index_db):
+    hits = search_index.search(index_db, "headache")
+    assert [(h["column_name"], h["match"], h["example"]) for h in hits] == [("col2", "value", "Headache")]
+
+
+def test_cjk_substring(index_db):
+    assert [h["column_name"] for h in search_index.search(index_db, "受试")] == ["col1"]
+
+
+def test_one_character_query_matches_the_end_of_a_text(index_db):
+    # Regression: single characters were only matched as the first half of a bigram
+    assert [h["column_name"] for h in search_index.search(index_db, "号")] == ["col1"]
+    assert "col0" in [h["column_name"] for h in search_index.search(index_db, "t")]
+
+
+def test_no_match(index_db):
+    assert search_index.search(index_db, "zzzz") == []
+    assert search_index.search(index_db, "   ") == []
@@ -0,0 +1,46 @@
+from app.services.sheet_router import SheetRouter, sheet_domain
+
+SOURCE = {"description": "test", "sheets": {
+    "AE_2": {"columns": [{"name": "不良事件名称 (AETERM)"}, {"name": "开始日期 (AESTDAT)"}]},
+    "Demographics": {"columns": [{"name": "受试者编号 (SUBJID)"}, {"name": "年龄 (AGE)"}]},
+    "LB": {"columns": [{"name": "检查项目 (LBTEST)"}, {"name": "结果 (LBORRES)"}]},
+}}
+
+AE_TARGETS = {
+    "AETERM": {"Standard_ColumnName": "AETERM", "备注": "不良事件名称"},
+    "AESTDAT": {"Standard_ColumnName": "AESTDAT", "备注": "开始日期"},
+}
+
+
+def test_sheet_domain_recognizes_codes_and_titles():
+    assert sheet_domain("AE_2") == "AE"
+    assert sheet_domain("DA1") == "DA1"
+    assert sheet_domain("Adverse Events") == "AE"
+    assert sheet_domain("不良事件") == "AE"
+    assert sheet_domain("Misc") is None
+
+
+def test_matching_sheet_ranks_first():
+    ranked = SheetRouter(SOURCE).rank("AE", AE_TARGETS)
+    assert ranked[0].sheet == "AE_2"
+    assert ranked[0].domain == 1.0
+    assert ranked[0].score > ranked[1].score
+
+
+def test_route_keeps_the_top_sheets_and_leaves_the_source_alone():
+    router = SheetRouter(SOURCE)
+    routed = router.route("AE", AE_TARGETS, top_k=1)
+    assert list(routed["sheets"]) == ["AE_2"]
+    assert routed["sheets"]["AE_2"] is SOURCE["sheets"]["AE_2"]
+    assert len(SOURCE["sheets"]) == 3
+
+
+def test_route_falls_back_to_the_top_sheets_below_the_cutoff():
+    routed = SheetRouter(SOURCE).route("AE", AE_TARGETS, top_k=2, min_score=2.0)
+    assert len(routed["sheets"]) == 2
+
+
+def test_routing_disabled_returns_every_sheet():
+    router = SheetRouter(SOURCE)
+    assert router.route("AE", AE_TARGETS, top_k=0) is SOURCE
+    assert router.matcher.columns[0] == ("AE_2", "不良事件名称 (AETERM)")
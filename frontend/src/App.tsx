@@ -238,9 +238,10 @@ export default function App() {
           }));
 
           setMappings(prev => {
-            // Avoid duplicates if needed, or just append
-            // Since backend yields distinct chunks, appending is safe
-            return [...prev, ...newMappings];
+            // A resumed or retried job may send a column again: the newer entry replaces the old one
+            const key = (m: Mapping) => `${m.standardSheetName}\u0000${m.standardColumnName}`;
+            const incoming = new Set(newMappings.map(key));
+            return [...prev.filter(m => !incoming.has(key(m))), ...newMappings];
           });
         } else if (data.type === 'done') {
           console.log("Stream complete");
@@ -3,16 +3,32 @@ import { Dataset, Mapping, SavedMapping, TargetFramework } from '../App';
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL;
 
+// Generation jobs are scheduled fairly per user; without a login each browser is one user
+const CLIENT_ID_KEY = 'pv-mapping-client-id';
+
+const getClientId = (): string => {
+    try {
+        let id = localStorage.getItem(CLIENT_ID_KEY);
+        if (!id) {
+            id = typeof crypto !== 'undefined' && crypto.randomUUID
+                ? crypto.randomUUID()
+                : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+            localStorage.setItem(CLIENT_ID_KEY, id);
+        }
+        return `browser-${id}`;
+    } catch {
+        return 'anonymous';
+    }
+};
+
 // Types matching backend response
-interface BackendDataset {
+interface BackendDatasetSummary {
     id: number;
     name: string;
     sheets: {
         name: string;
-        rows: {
-            row_index: number;
-            data: Record<string, any>;
-        }[];
+        columns: string[];
+        row_count: number;
     }[];
 }
 
@@ -40,22 +56,17 @@ interface BackendMapping {
 export const api = {
     // Datasets
     getDatasets: async (): Promise<Dataset[]> => {
-        const response = await fetch(`${API_BASE_URL}/datasets/`);
+        // Summary endpoint: headers and row counts only, no row payload
+        const response = await fetch(`${API_BASE_URL}/datasets/summary`);
         if (!response.ok) throw new Error('Failed to fetch datasets');
         try {
-            const data: BackendDataset[] = await response.json();
+            const data: BackendDatasetSummary[] = await response.json();
             // Transform to frontend format
             return data.map(d => {
-                const sheetInfos = d.sheets.map(s => {
-                    const allKeys = new Set<string>();
-                    if (s.rows.length > 0 && s.rows[0].data) {
-                        Object.keys(s.rows[0].data).forEach(k => allKeys.add(k));
-                    }
-                    return {
-                        name: s.name,
-                        columns: Array.from(allKeys)
-                    };
-                });
+                const sheetInfos = d.sheets.map(s => ({
+                    name: s.name,
+                    columns: s.columns
+                }));
 
                 return {
                     id: d.id.toString(),
@@ -200,7 +211,8 @@ export const api = {
     },
 
     generateMappingStream: (datasetId: string, frameworkId: string, onMessage: (event: any) => void, onError: (err: any) => void) => {
-        const url = `${API_BASE_URL}/mappings/generate/stream?dataset_id=${datasetId}&framework_id=${frameworkId}`;
+        // EventSource cannot send an X-User header, so the scheduling identity goes in the query
+        const url = `${API_BASE_URL}/mappings/generate/stream?dataset_id=${datasetId}&framework_id=${frameworkId}&user=${encodeURIComponent(getClientId())}`;
         const eventSource = new EventSource(url);
 
         eventSource.onmessage = (event) => {
@@ -216,6 +228,9 @@ export const api = {
         };
 
         eventSource.onerror = (err) => {
+            // Dropped connection: the browser reconnects with Last-Event-ID and the
+            // server replays what was missed (the generation job keeps running meanwhile)
+            if (eventSource.readyState === EventSource.CONNECTING) return;
             console.error("SSE Error", err);
             onError(err);
             eventSource.close();